@@ -0,0 +1,203 @@
+"""
+Micro-benchmarks of the search engine hot paths at several corpus sizes, compared against stored baselines.
+
+Every size gets a synthetic TSV corpus (see `synthetic.write_synthetic_tsv`) that runs through the
+pipeline with the deterministic `StubEmbeddingModel`, so the numbers measure our own code around the model:
+loading the TSV, computing embeddings at two batch sizes, saving and loading them as TFRecord and flat
+stores, building the Annoy index from both, saving and loading it, and `QueryInterface.query` with and
+without the query cache. Each step is repeated and its median time is reported, queries per call.
+
+A step regresses when it is slower than its baseline by more than the threshold, a fraction of the
+baseline time, and by at least --min-seconds, so tiny timings don't fail on noise. The script then
+exits with status 1, so it can run in CI. Baselines depend on the machine: record them where the suite
+runs with --save-baseline, which overwrites the measured sizes in the baseline file. Thresholds of single
+steps can be set in its "thresholds" entry.
+
+Usage:
+    python -m benchmarks.bench_components --sizes 1000 10000
+    python -m benchmarks.bench_components --sizes 1000 10000 --save-baseline
+    python -m benchmarks.bench_components --threshold 0.5 --baseline /path/to/ci_baselines.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmarks.synthetic import StubEmbeddingModel, write_synthetic_tsv
+from search_engine.data_pipeline import DataPipeline
+from search_engine.index_builder import IndexBuilder
+from search_engine.query_cache import QueryCache
+from search_engine.query_interface import QueryInterface
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "component_baselines.json")
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_MIN_SECONDS = 0.005
+METADATA_COLUMNS = ["Artist", "Title", "Index"]
+
+
+def median_seconds(fn, repeat):
+    """
+    Call a function `repeat` times with its prints silenced.
+
+    Returns:
+        The median wall-clock time of a call in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _pipeline(model, batch_size):
+    with patch("tensorflow_hub.load", return_value=model), contextlib.redirect_stdout(io.StringIO()):
+        return DataPipeline(batch_size=batch_size)
+
+
+def measure(size, work_dir, repeat=3, n_trees=25, n_queries=200):
+    """
+    Run every step on a synthetic corpus of `size` songs.
+
+    Returns:
+        Dict of step name to median seconds.
+    """
+    model = StubEmbeddingModel()
+    tsv_path = os.path.join(work_dir, "corpus.tsv")
+    tfrecord_path = os.path.join(work_dir, "embeddings.tfrecord")
+    flat_path = os.path.join(work_dir, "embeddings")
+    index_path = os.path.join(work_dir, "index.ann")
+    write_synthetic_tsv(tsv_path, size)
+
+    results = {}
+    pipeline = _pipeline(model, 64)
+    results['load_tsv'] = median_seconds(lambda: pipeline.load_tsv(tsv_path, metadata_columns=METADATA_COLUMNS),
+                                         repeat)
+    for batch_size in (64, 256):
+        batched = _pipeline(model, batch_size)
+        batched.load_tsv(tsv_path, metadata_columns=METADATA_COLUMNS)
+        results[f'compute_embeddings[batch={batch_size}]'] = median_seconds(batched.compute_embeddings, repeat)
+    pipeline.compute_embeddings()
+
+    results['save_embeddings[tfrecord]'] = median_seconds(lambda: pipeline.save_embeddings(tfrecord_path), repeat)
+    results['load_embeddings[tfrecord]'] = median_seconds(lambda: pipeline.load_embeddings(tfrecord_path), repeat)
+    results['save_embeddings[flat]'] = median_seconds(lambda: pipeline.save_embeddings(flat_path, fmt="flat"), repeat)
+    results['load_embeddings[flat]'] = median_seconds(lambda: pipeline.load_embeddings(flat_path), repeat)
+
+    # A built Annoy index can't be built again, every repetition gets a new builder
+    results['build_index[tfrecord]'] = median_seconds(
+        lambda: IndexBuilder(n_trees=n_trees).build_index_from_files([tfrecord_path]), repeat)
+    results['build_index[flat]'] = median_seconds(
+        lambda: IndexBuilder(n_trees=n_trees).build_index_from_files([flat_path]), repeat)
+    builder = IndexBuilder(n_trees=n_trees)
+    with contextlib.redirect_stdout(io.StringIO()):
+        builder.build_index_from_files([flat_path])
+    results['save_index'] = median_seconds(lambda: builder.save_to_file(index_path), repeat)
+    results['load_index'] = median_seconds(lambda: IndexBuilder(n_trees=n_trees).load_from_file(index_path), repeat)
+
+    index = IndexBuilder(n_trees=n_trees).load_from_file(index_path)
+    queries = [f"query {i} love night" for i in range(n_queries)]
+    uncached = QueryInterface(index, model)
+    uncached.query("warm up")
+    results['query'] = statistics.median(median_seconds(lambda: uncached.query(query), 1) for query in queries)
+    cached = QueryInterface(index, model, cache=QueryCache())
+    cached.query(queries[0])
+    results['query[cached]'] = median_seconds(lambda: cached.query(queries[0]), n_queries)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    """
+    Compare measured times with the baseline.
+
+    Args:
+        results: Dict of size to a dict of step name to seconds, as returned by `measure`.
+        baseline: Contents of the baseline file, with a "results" dict keyed by size as a string
+            and an optional "thresholds" dict of step name to threshold.
+        threshold: Allowed slowdown as a fraction of the baseline time, 1.0 allows twice the baseline time.
+        min_seconds: Slowdowns smaller than this never count as regressions.
+
+    Returns:
+        List of (size, step, seconds, baseline seconds or None, regressed) tuples.
+    """
+    rows = []
+    thresholds = baseline.get('thresholds', {})
+    for size, steps in results.items():
+        baseline_steps = baseline.get('results', {}).get(str(size), {})
+        for step, seconds in steps.items():
+            expected = baseline_steps.get(step)
+            allowed = thresholds.get(step, threshold)
+            regressed = (expected is not None and seconds > expected * (1.0 + allowed)
+                         and seconds - expected >= min_seconds)
+            rows.append((size, step, seconds, expected, regressed))
+    return rows
+
+
+def environment():
+    """
+    Describe the machine the baseline was recorded on.
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def run(sizes, repeat, baseline_path, save_baseline, threshold, min_seconds):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    if threshold is None:
+        threshold = baseline.get('threshold', DEFAULT_THRESHOLD)
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[size] = measure(size, work_dir, repeat)
+
+    print(f"{'size':>8} {'step':>30} {'ms':>10} {'baseline ms':>12} {'ratio':>7}")
+    failed = False
+    for size, step, seconds, expected, regressed in compare(results, baseline, threshold, min_seconds):
+        ratio = f"{seconds / expected:.2f}" if expected else "-"
+        expected_ms = f"{expected * 1000:.3f}" if expected is not None else "-"
+        print(f"{size:>8} {step:>30} {seconds * 1000:>10.3f} {expected_ms:>12} {ratio:>7}"
+              f"{'  REGRESSION' if regressed else ''}")
+        failed = failed or regressed
+
+    if save_baseline:
+        baseline.setdefault('threshold', DEFAULT_THRESHOLD)
+        baseline.setdefault('thresholds', {})
+        baseline['environment'] = environment()
+        baseline.setdefault('results', {}).update(
+            {str(size): {step: float(f"{seconds:.4g}") for step, seconds in steps.items()} for size, steps in results.items()})
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {baseline_path}")
+        return 0
+    if not baseline:
+        print(f"No baseline at {baseline_path}, record one with --save-baseline")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of every step, the median is reported")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the measured times as the baseline")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Allowed slowdown as a fraction of the baseline, defaults to the baseline file's or 1.0")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                        help="Smaller slowdowns never count as regressions")
+    args = parser.parse_args()
+    sys.exit(run(args.sizes, args.repeat, args.baseline, args.save_baseline, args.threshold, args.min_seconds))
@@ -0,0 +1,72 @@
+"""
+Measures how long importing the search engine and the web app takes, to catch heavy dependencies
+such as TensorFlow or pandas creeping back into the import path.
+
+Every module is imported in a fresh interpreter with `python -X importtime`. The script prints the
+wall-clock import time, whether TensorFlow or pandas got loaded and the modules that took the
+longest to import themselves, excluding their own imports.
+It exits with status 1 when an import loads one of those or, with --max-seconds, takes longer,
+so it can run in CI.
+
+Usage:
+    python -m benchmarks.bench_import_time --max-seconds 1.5
+    python -m benchmarks.bench_import_time --modules search_engine web_app.main --top 20
+"""
+import argparse
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["search_engine", "search_engine.query_interface", "web_app.lyrics_search.routes", "web_app.main"]
+HEAVY_MODULES = ["tensorflow", "tensorflow_hub", "pandas"]
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        The import time in seconds, the heavy modules that were loaded and a list of
+        (self microseconds, module name) parsed from the -X importtime report.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    elapsed, loaded = result.stdout.strip().splitlines()[-1].partition(" ")[::2]
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        imports.append((int(self_time), name.strip()))
+    return float(elapsed), [name for name in loaded.split(",") if name], imports
+
+
+def run(modules, top, max_seconds):
+    failed = False
+    for module in modules:
+        elapsed, loaded, imports = measure(module)
+        too_slow = max_seconds is not None and elapsed > max_seconds
+        failed = failed or too_slow or bool(loaded)
+        print(f"{module}: {elapsed:.3f}s{' (over the limit)' if too_slow else ''}, "
+              f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+        for self_time, name in sorted(imports, reverse=True)[:top]:
+            print(f"  {self_time / 1e6:>8.3f}s  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules listed per import")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if an import takes longer")
+    args = parser.parse_args()
+    sys.exit(run(args.modules, args.top, args.max_seconds))
@@ -0,0 +1,44 @@
+"""
+Reports memory, latency and recall@k of scalar quantized search against the exact float32 baseline.
+
+Usage:
+    python -m benchmarks.bench_quantization --sizes 10000 50000 --rerank-candidates 50
+"""
+import argparse
+
+from benchmarks.synthetic import exact_top_k, random_unit_vectors, recall_at_k, time_calls
+from search_engine.quantization import ScalarQuantizer
+from search_engine.search_backends import ExactBackend, QuantizedBackend
+
+
+def run(sizes, dims=512, n_queries=200, n_items=10, rerank_candidates=50):
+    print(f"{'size':>8} {'mode':>16} {'memory MB':>10} {'p50 ms':>8} {'p99 ms':>8} {'recall@' + str(n_items):>10}")
+    for size in sizes:
+        vectors = random_unit_vectors(size, dims)
+        queries = random_unit_vectors(n_queries, dims, seed=1)
+        expected = exact_top_k(vectors, queries, n_items)
+        backends = {'float32': (ExactBackend(vectors), vectors.nbytes)}
+        for mode in ("float16", "int8"):
+            quantizer = ScalarQuantizer(mode).fit(vectors)
+            codes = quantizer.encode(vectors)
+            backends[mode] = (QuantizedBackend(codes, quantizer), codes.nbytes)
+            backends[mode + " + rerank"] = (
+                QuantizedBackend(codes, quantizer, rerank_embeddings=vectors, rerank_candidates=rerank_candidates),
+                codes.nbytes,
+            )
+        for name, (backend, memory) in backends.items():
+            timings = time_calls(lambda query: backend.search(query, n_items), list(queries))
+            recall = recall_at_k(backend.search_batch(queries, n_items), expected)
+            print(f"{size:>8} {name:>16} {memory / 2 ** 20:>10.1f} {timings['p50_ms']:>8.3f} "
+                  f"{timings['p99_ms']:>8.3f} {recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--dims", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-items", type=int, default=10)
+    parser.add_argument("--rerank-candidates", type=int, default=50)
+    args = parser.parse_args()
+    run(args.sizes, args.dims, args.queries, args.n_items, args.rerank_candidates)
@@ -0,0 +1,39 @@
+"""
+Compares query latency of the Annoy and exact NumPy search backends at several corpus sizes.
+
+Usage:
+    python -m benchmarks.bench_search_backends --sizes 1000 10000 50000
+"""
+import argparse
+
+from benchmarks.synthetic import build_annoy_index, exact_top_k, random_unit_vectors, recall_at_k, time_calls
+from search_engine.search_backends import AnnoyBackend, ExactBackend
+
+
+def run(sizes, dims=512, n_trees=100, n_queries=200, n_items=5):
+    print(f"{'size':>8} {'backend':>8} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'recall@' + str(n_items):>10}")
+    for size in sizes:
+        vectors = random_unit_vectors(size, dims)
+        queries = random_unit_vectors(n_queries, dims, seed=1)
+        expected = exact_top_k(vectors, queries, n_items)
+        backends = {
+            'annoy': AnnoyBackend(build_annoy_index(vectors, n_trees)),
+            'exact': ExactBackend(vectors),
+        }
+        for name, backend in backends.items():
+            backend.search(queries[0], n_items)  # warm-up
+            timings = time_calls(lambda query: backend.search(query, n_items), list(queries))
+            recall = recall_at_k([backend.search(query, n_items) for query in queries], expected)
+            print(f"{size:>8} {name:>8} {timings['mean_ms']:>9.3f} {timings['p50_ms']:>9.3f} "
+                  f"{timings['p99_ms']:>9.3f} {recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dims", type=int, default=512)
+    parser.add_argument("--n-trees", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-items", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.dims, args.n_trees, args.queries, args.n_items)
@@ -0,0 +1,47 @@
+"""
+Measures query latency and recall of the Annoy search presets (see `search_engine.search_backends.SEARCH_PRESETS`)
+and of explicit search_k values, against exact brute-force neighbors.
+
+Usage:
+    python -m benchmarks.bench_search_presets --sizes 10000 50000 --n-items 5 20 --search-k 1000 5000
+"""
+import argparse
+
+from benchmarks.synthetic import build_annoy_index, exact_top_k, random_unit_vectors, recall_at_k, time_calls
+from search_engine.search_backends import SEARCH_PRESETS, AnnoyBackend, ExactBackend, annoy_search_k
+
+
+def run(sizes, n_items_values=(5,), search_k_values=(), dims=512, n_trees=100, n_queries=200):
+    print(f"{'size':>8} {'n':>4} {'search_k':>10} {'candidates':>11} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'recall':>7}")
+    for size in sizes:
+        vectors = random_unit_vectors(size, dims)
+        queries = list(random_unit_vectors(n_queries, dims, seed=1))
+        annoy = AnnoyBackend(build_annoy_index(vectors, n_trees))
+        exact = ExactBackend(vectors)
+        for n_items in n_items_values:
+            expected = exact_top_k(vectors, queries, n_items)
+            settings = [(preset, annoy) for preset in SEARCH_PRESETS] + [(k, annoy) for k in search_k_values]
+            settings.append(("brute", exact))
+            for search_k, backend in settings:
+                knob = None if search_k == "brute" else search_k
+                backend.search(queries[0], n_items, knob)  # warm-up
+                timings = time_calls(lambda query: backend.search(query, n_items, knob), queries)
+                recall = recall_at_k([backend.search(query, n_items, knob) for query in queries], expected)
+                candidates = "-" if backend is exact else annoy_search_k(search_k, n_items, n_trees, size)
+                if candidates == -1:
+                    candidates = n_items * n_trees
+                print(f"{size:>8} {n_items:>4} {search_k:>10} {candidates:>11} {timings['mean_ms']:>9.3f} "
+                      f"{timings['p50_ms']:>9.3f} {timings['p99_ms']:>9.3f} {recall:>7.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--n-items", type=int, nargs="+", default=[5])
+    parser.add_argument("--search-k", type=int, nargs="*", default=[])
+    parser.add_argument("--dims", type=int, default=512)
+    parser.add_argument("--n-trees", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.n_items, args.search_k, args.dims, args.n_trees, args.queries)
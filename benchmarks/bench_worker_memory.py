@@ -0,0 +1,106 @@
+"""
+Measures cold-start time and memory of gunicorn workers with and without PRELOAD_APP.
+
+Starts gunicorn with gunicorn.conf.py for every mode, waits until all workers log that they are
+ready, then reads /proc/<pid>/smaps_rollup of the master and each worker. RSS counts shared pages
+in every process, PSS splits them between the processes sharing them, so the PSS total is the
+memory the whole server really uses. Linux only. Run from the repository root with a database
+and index in place, e.g. inside the web container:
+
+Usage:
+    python -m benchmarks.bench_worker_memory --workers 4 --modes preload no-preload
+"""
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+_READY = re.compile(r"Worker (\d+) ready ([\d.]+)s after fork, ([\d.]+)s after master start")
+
+
+def read_memory(pid):
+    """
+    Read the memory counters of a process in MiB.
+    """
+    counters = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                counters[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    shared = counters.get("Shared_Clean", 0.0) + counters.get("Shared_Dirty", 0.0)
+    return {'rss': counters.get("Rss", 0.0), 'pss': counters.get("Pss", 0.0), 'shared': shared}
+
+
+def drain(stream):
+    """
+    Read a process output stream until it is closed, in a daemon thread, so the process never blocks
+    on a full pipe.
+    """
+    def read():
+        for _ in stream:
+            pass
+    threading.Thread(target=read, name="drain", daemon=True).start()
+
+
+def start_server(app, workers, preload, bind, timeout, env=None):
+    """
+    Start gunicorn and wait until every worker is ready. `env` adds environment variables, e.g. GUNICORN_THREADS.
+    Its log is discarded afterwards.
+
+    Returns:
+        The gunicorn process and a list of (pid, seconds after fork, seconds after master start).
+    """
+    env = dict(os.environ, **(env or {}), GUNICORN_WORKERS=str(workers), GUNICORN_BIND=bind,
+               PRELOAD_APP="true" if preload else "false")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", app],
+                               env=env, stderr=subprocess.PIPE, text=True)
+    ready = []
+    deadline = time.monotonic() + timeout
+    while len(ready) < workers:
+        line = process.stderr.readline()
+        if not line:
+            raise RuntimeError("gunicorn exited before all workers were ready")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Workers not ready after {timeout}s")
+        match = _READY.search(line)
+        if match:
+            ready.append((int(match.group(1)), float(match.group(2)), float(match.group(3))))
+    drain(process.stderr)
+    return process, ready
+
+
+def run(app, workers, modes, bind, timeout):
+    print(f"{'mode':>11} {'process':>8} {'ready s':>8} {'RSS MiB':>9} {'PSS MiB':>9} {'shared MiB':>11}")
+    for mode in modes:
+        process, ready = start_server(app, workers, mode == "preload", bind, timeout)
+        try:
+            master = read_memory(process.pid)
+            print(f"{mode:>11} {'master':>8} {'':>8} {master['rss']:>9.1f} {master['pss']:>9.1f} "
+                  f"{master['shared']:>11.1f}")
+            total_pss = master['pss']
+            for pid, after_fork, _ in ready:
+                memory = read_memory(pid)
+                total_pss += memory['pss']
+                print(f"{mode:>11} {pid:>8} {after_fork:>8.2f} {memory['rss']:>9.1f} {memory['pss']:>9.1f} "
+                      f"{memory['shared']:>11.1f}")
+            cold_start = max(after_start for _, _, after_start in ready)
+            print(f"{mode:>11} all workers ready after {cold_start:.2f}s, total PSS {total_pss:.1f} MiB")
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="web_app.main:create_app()")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", choices=["preload", "no-preload"], default=["preload", "no-preload"])
+    parser.add_argument("--bind", default="127.0.0.1:5055")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+    run(args.app, args.workers, args.modes, args.bind, args.timeout)
@@ -0,0 +1,310 @@
+"""
+End-to-end load test of the search service over HTTP.
+
+Builds a fixture of synthetic songs: a SQLite database and an Annoy index of random vectors. It then
+starts gunicorn with `benchmarks.load_test_app`, the real app with a deterministic stub embedding model,
+for every server configuration. Concurrent clients send a mix of requests for a fixed time, each client
+waits for its response before sending the next request. Reported per configuration, mix and concurrency:
+throughput, p50/p95/p99 latency and error rate of every request kind. Responses other than 2xx and 304,
+timeouts and connection errors count as errors.
+
+Server configurations are written as WORKERSxTHREADS with optional flags, e.g. `4x8+batch+preload`:
+`batch` enables QUERY_BATCHING, `preload` PRELOAD_APP. `asgi` serves the async app with uvicorn instead,
+THREADS then sets INFERENCE_THREADS, e.g. `1x4+asgi`. With --url an already running server is tested
+instead, e.g. the docker-compose setup with Postgres and the real model.
+
+Mixes (see MIXES): `search` only sends new queries, `popular` repeats 100 queries, so results come
+from the query cache, `browse` also opens results with GET /songs/<index>, `mixed` adds batch queries.
+
+Run from the repository root, Linux only:
+
+Usage:
+    python -m benchmarks.load_test --configs 1x1 2x4 2x4+batch --mixes search browse --concurrency 1 8 32
+    python -m benchmarks.load_test --model-ms 20 --configs 1x8 1x8+batch --concurrency 32
+    python -m benchmarks.load_test --configs 2x4 1x4+asgi --mixes browse --concurrency 8 64
+    python -m benchmarks.load_test --url http://localhost:5000 --mixes browse --concurrency 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from benchmarks.bench_worker_memory import drain, start_server
+from benchmarks.synthetic import WORDS, build_annoy_index, random_unit_vectors, synthetic_lyrics
+
+# Share of every request kind
+MIXES = {
+    'search': {'query': 1.0},
+    'popular': {'popular_query': 1.0},
+    'browse': {'query': 0.6, 'popular_query': 0.2, 'song': 0.2},
+    'mixed': {'query': 0.5, 'popular_query': 0.2, 'song': 0.2, 'batch': 0.1},
+}
+BATCH_SIZE = 8
+N_POPULAR_QUERIES = 100
+
+
+def parse_configuration(text):
+    """
+    Parse a server configuration such as `4x8+batch+preload`.
+
+    Returns:
+        Dict with the label, workers, threads, batch, preload and asgi flags.
+    """
+    sizes, *flags = text.split("+")
+    workers, threads = (int(n) for n in sizes.lower().split("x"))
+    unknown = set(flags) - {"batch", "preload", "asgi"}
+    if workers < 1 or threads < 1 or unknown or ("asgi" in flags and len(flags) > 1):
+        raise argparse.ArgumentTypeError(f"Invalid configuration {text!r}, expected e.g. 4x8+batch+preload")
+    return {'label': text, 'workers': workers, 'threads': threads, 'batch': "batch" in flags,
+            'preload': "preload" in flags, 'asgi': "asgi" in flags}
+
+
+def prepare_fixture(directory, n_songs=10000, dims=512, n_trees=50):
+    """
+    Write a SQLite database with `n_songs` songs and an Annoy index with one random vector per song.
+    An existing fixture in the directory is reused.
+
+    Returns:
+        Environment variables pointing the app at the fixture.
+    """
+    os.makedirs(directory, exist_ok=True)
+    directory = os.path.abspath(directory)
+    index_path = os.path.join(directory, "index.ann")
+    env = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'songs.db')}",
+        'SEARCH_BACKEND': "annoy",
+        'INDEX_PATH': index_path,
+        'DELTA_INDEX_PATH': os.path.join(directory, "delta.npz"),
+        'STUB_MODEL_DIMS': str(dims),
+        'WARM_UP': "blocking",
+    }
+    if os.path.exists(index_path):
+        print(f"Reusing the fixture in {directory}")
+        return env
+
+    print(f"Writing {n_songs} songs to {directory}")
+    os.environ['DATABASE_URL'] = env['DATABASE_URL']
+    # Imported here, the database URL is read when the app is created
+    from web_app import create_app
+    from web_app.lyrics_search.extensions import db
+    from web_app.lyrics_search.models import Song
+    app = create_app()
+    rng = random.Random(0)
+    with app.app_context():
+        db.create_all()
+        for i in range(n_songs):
+            db.session.add(Song(title=f"Song {i}", author=f"Artist {i % 500}", lyrics=synthetic_lyrics(rng), index=i))
+        db.session.commit()
+    # Written last, so an interrupted run doesn't leave a fixture that looks complete
+    build_annoy_index(random_unit_vectors(n_songs, dims), n_trees).save(index_path)
+    return env
+
+
+def _request(kind, rng, n_songs, popular_queries):
+    if kind == 'query':
+        return "POST", "/query_lyrics", {'query': " ".join(rng.choices(WORDS, k=4)) + f" {rng.random()}"}
+    if kind == 'popular_query':
+        return "POST", "/query_lyrics", {'query': rng.choice(popular_queries)}
+    if kind == 'batch':
+        return "POST", "/query_lyrics/batch", {'queries': [" ".join(rng.choices(WORDS, k=4)) + f" {rng.random()}"
+                                                           for _ in range(BATCH_SIZE)]}
+    if kind == 'song':
+        return "GET", f"/songs/{rng.randrange(n_songs)}", None
+    raise ValueError(f"Unknown request kind: {kind}")
+
+
+def _client(url, mix, n_songs, seed, warmup_until, stop_at, timeout, samples):
+    """
+    Send requests one after another until `stop_at`, appending (kind, seconds, ok) to `samples`
+    for requests started after `warmup_until`.
+    """
+    rng = random.Random(seed)
+    popular_queries = [" ".join(random.Random(i).choices(WORDS, k=3)) for i in range(N_POPULAR_QUERIES)]
+    kinds, weights = list(mix), list(mix.values())
+    parts = urlsplit(url)
+    connection = None
+    while True:
+        start = time.perf_counter()
+        if start >= stop_at:
+            break
+        kind = rng.choices(kinds, weights)[0]
+        method, path, body = _request(kind, rng, n_songs, popular_queries)
+        ok = False
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+            headers = {'Content-Type': "application/json"} if body is not None else {}
+            connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = connection.getresponse()
+            response.read()
+            ok = 200 <= response.status < 300 or response.status == 304
+            if response.getheader("Connection", "").lower() == "close":
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            if connection is not None:
+                connection.close()
+            connection = None
+        if start >= warmup_until:
+            samples.append((kind, time.perf_counter() - start, ok))
+    if connection is not None:
+        connection.close()
+
+
+def summarize(samples, seconds):
+    """
+    Summarize request samples per kind and in total.
+
+    Args:
+        samples: List of (kind, seconds, ok) tuples.
+        seconds: Length of the measured period.
+
+    Returns:
+        Dict of kind (and 'total') to requests, rps, p50_ms, p95_ms, p99_ms and error_rate.
+    """
+    groups = {}
+    for kind, latency, ok in sorted(samples, key=lambda sample: sample[0]):
+        groups.setdefault(kind, []).append((latency, ok))
+    groups['total'] = [(latency, ok) for _, latency, ok in samples]
+    summary = {}
+    for kind, values in groups.items():
+        if not values:
+            continue
+        latencies = np.array([latency for latency, _ in values]) * 1000.0
+        summary[kind] = {
+            'requests': len(values),
+            'rps': len(values) / seconds,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'error_rate': sum(1 for _, ok in values if not ok) / len(values),
+        }
+    return summary
+
+
+def drive(url, mix, concurrency, duration, warmup, n_songs, timeout=30.0, seed=0):
+    """
+    Run `concurrency` clients against the server for `warmup` + `duration` seconds.
+
+    Returns:
+        The summary of the measured period, see `summarize`.
+    """
+    samples = []
+    warmup_until = time.perf_counter() + warmup
+    stop_at = warmup_until + duration
+    clients = [threading.Thread(target=_client, args=(url, MIXES[mix], n_songs, seed * 10007 + i, warmup_until,
+                                                      stop_at, timeout, samples), daemon=True)
+               for i in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    # Requests started before the end finish after it, measure until the last one did
+    return summarize(samples, max(time.perf_counter() - warmup_until, duration))
+
+
+def start_asgi_server(workers, bind, timeout, env):
+    """
+    Start uvicorn with the async app and wait until GET /ready succeeds.
+
+    Returns:
+        The uvicorn process.
+    """
+    host, port = bind.rsplit(":", 1)
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "--factory", "benchmarks.load_test_app:create_asgi_app",
+                                "--host", host, "--port", port, "--workers", str(workers), "--no-access-log"],
+                               env=dict(os.environ, **env), stderr=subprocess.PIPE, text=True)
+    drain(process.stderr)
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited before the app was ready")
+        if time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"App not ready after {timeout}s")
+        try:
+            connection = http.client.HTTPConnection(host, int(port), timeout=1)
+            connection.request("GET", "/ready")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+
+
+def run(configurations, mixes, concurrency_values, duration, warmup, n_songs, dims, n_trees, fixture_dir,
+        bind, url, model_ms, model_per_text_ms, timeout):
+    results = []
+    if url is not None:
+        targets = [({'label': "external"}, None)]
+    else:
+        fixture_env = prepare_fixture(fixture_dir, n_songs, dims, n_trees)
+        fixture_env.update(STUB_MODEL_BASE_MS=str(model_ms), STUB_MODEL_PER_TEXT_MS=str(model_per_text_ms))
+        targets = [(configuration, fixture_env) for configuration in configurations]
+
+    print(f"{'config':>16} {'mix':>8} {'clients':>7} {'kind':>13} {'requests':>8} {'rps':>8} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for configuration, fixture_env in targets:
+        process = None
+        if fixture_env is not None:
+            if configuration['asgi']:
+                process = start_asgi_server(configuration['workers'], bind, 600,
+                                            dict(fixture_env, INFERENCE_THREADS=str(configuration['threads'])))
+            else:
+                env = dict(fixture_env, GUNICORN_THREADS=str(configuration['threads']),
+                           QUERY_BATCHING="true" if configuration['batch'] else "false")
+                process, _ = start_server("benchmarks.load_test_app:create_app()", configuration['workers'],
+                                          configuration['preload'], bind, 600, env)
+        try:
+            target_url = url or f"http://{bind}"
+            for mix in mixes:
+                for concurrency in concurrency_values:
+                    summary = drive(target_url, mix, concurrency, duration, warmup, n_songs, timeout)
+                    for kind, stats in summary.items():
+                        print(f"{configuration['label']:>16} {mix:>8} {concurrency:>7} {kind:>13} "
+                              f"{stats['requests']:>8} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} "
+                              f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['error_rate']:>7.2%}")
+                    results.append({'config': configuration['label'], 'mix': mix, 'concurrency': concurrency,
+                                    'summary': summary})
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=30)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", type=parse_configuration, nargs="+",
+                        default=[parse_configuration(c) for c in ("1x1", "2x4", "2x4+batch")])
+    parser.add_argument("--mixes", nargs="+", choices=list(MIXES), default=["search", "browse"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=15, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before every run")
+    parser.add_argument("--songs", type=int, default=10000)
+    parser.add_argument("--dims", type=int, default=512)
+    parser.add_argument("--n-trees", type=int, default=50)
+    parser.add_argument("--model-ms", type=float, default=0, help="Simulated inference time per model call")
+    parser.add_argument("--model-per-text-ms", type=float, default=0, help="Simulated inference time per query")
+    parser.add_argument("--fixture-dir", default=os.path.join(tempfile.gettempdir(), "lyrics_load_test"))
+    parser.add_argument("--bind", default="127.0.0.1:5056")
+    parser.add_argument("--url", default=None, help="Test a running server instead of starting one")
+    parser.add_argument("--timeout", type=float, default=30, help="Client timeout per request in seconds")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+    load_results = run(args.configs, args.mixes, args.concurrency, args.duration, args.warmup, args.songs, args.dims,
+                       args.n_trees, args.fixture_dir, args.bind, args.url, args.model_ms, args.model_per_text_ms,
+                       args.timeout)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(load_results, f, indent=2)
@@ -0,0 +1,39 @@
+"""
+The web app with the embedding model replaced by `StubEmbeddingModel`, served by gunicorn
+(or uvicorn for the async app) in `benchmarks.load_test`. Everything else is the real app: routes, database queries, query cache,
+batcher and search backend, configured with the usual environment variables.
+
+The stub is configured with STUB_MODEL_DIMS (default 512), STUB_MODEL_BASE_MS and
+STUB_MODEL_PER_TEXT_MS (default 0), the simulated inference cost per call and per query.
+
+Usage:
+    gunicorn -c gunicorn.conf.py "benchmarks.load_test_app:create_app()"
+    uvicorn --factory benchmarks.load_test_app:create_asgi_app
+"""
+import os
+
+from benchmarks.synthetic import StubEmbeddingModel
+from web_app import create_app as create_web_app
+from web_app.lyrics_search import build_query_handle
+from web_app.lyrics_search.async_app import create_asgi_app as create_async_web_app
+
+
+def load_stub_model(model_url=None):
+    """
+    Replacement of `build_query_handle.load_embedding_model`, the model URL is ignored.
+    """
+    return StubEmbeddingModel(
+        dims=int(os.environ.get("STUB_MODEL_DIMS", "512")),
+        base_ms=float(os.environ.get("STUB_MODEL_BASE_MS", "0")),
+        per_text_ms=float(os.environ.get("STUB_MODEL_PER_TEXT_MS", "0")),
+    )
+
+
+def create_app():
+    build_query_handle.load_embedding_model = load_stub_model
+    return create_web_app()
+
+
+def create_asgi_app():
+    build_query_handle.load_embedding_model = load_stub_model
+    return create_async_web_app()
@@ -0,0 +1,176 @@
+"""
+Helpers shared by the benchmark scripts: synthetic embeddings and lyrics, a stub embedding model, index
+building and latency statistics.
+"""
+from typing import Dict, List, Sequence
+import csv
+import hashlib
+import random
+import time
+
+import numpy as np
+from annoy import AnnoyIndex
+
+WORDS = ("love", "night", "heart", "rain", "city", "fire", "dance", "dream", "road", "summer", "tears", "home",
+         "light", "baby", "money", "river", "gold", "ghost", "wild", "blue", "kochanie", "miasto", "noc", "serce")
+
+
+def random_unit_vectors(n: int, dims: int = 512, seed: int = 0, n_clusters: int = 64) -> np.ndarray:
+    """
+    Generate L2 normalized float32 vectors grouped around random centroids, which is closer to
+    real sentence embeddings than uniformly random vectors.
+
+    Args:
+        n (int): Number of vectors.
+        dims (int, optional): Dimensionality. Defaults to 512.
+        seed (int, optional): Random seed. Defaults to 0.
+        n_clusters (int, optional): Number of centroids. Defaults to 64.
+
+    Returns:
+        np.ndarray: Array of shape (n, dims).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(n_clusters, dims)).astype(np.float32)
+    vectors = centroids[rng.integers(0, n_clusters, size=n)] + rng.normal(scale=0.8, size=(n, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class StubEmbeddingModel:
+    def __init__(self, dims: int = 512, base_ms: float = 0.0, per_text_ms: float = 0.0, n_basis: int = 4096) -> None:
+        """
+        Deterministic stand-in for the embedding model: every text maps to a fixed unit vector derived
+        from its hash, so repeated queries get the same results in every process. Sleeps to emulate
+        inference, a fixed cost per call plus a cost per text, so batching pays off like with the real model.
+        Accepts lists of str or bytes and string tensors, like the TF Hub model.
+
+        Args:
+            dims (int, optional): Dimensionality. Defaults to 512.
+            base_ms (float, optional): Simulated cost of every call in milliseconds. Defaults to 0.
+            per_text_ms (float, optional): Simulated cost of every text in milliseconds. Defaults to 0.
+            n_basis (int, optional): Random vectors combined into the embeddings, two per text. Defaults to 4096.
+        """
+        self._dims = dims
+        self._base_ms = base_ms
+        self._per_text_ms = per_text_ms
+        self._basis = np.random.default_rng(0).normal(size=(n_basis, dims)).astype(np.float32)
+
+    def __call__(self, texts) -> np.ndarray:
+        if hasattr(texts, "numpy"):
+            texts = texts.numpy().tolist()
+        delay = self._base_ms + self._per_text_ms * len(texts)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        digests = [hashlib.sha256(t if isinstance(t, bytes) else str(t).encode()).digest() for t in texts]
+        rows = np.array([[int.from_bytes(d[:4], "little"), int.from_bytes(d[4:8], "little")] for d in digests],
+                        dtype=np.int64).reshape(-1, 2) % len(self._basis)
+        vectors = self._basis[rows[:, 0]] + 0.5 * self._basis[rows[:, 1]]
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_lyrics(rng: random.Random, n_lines: int = 12, words_per_line: int = 6) -> str:
+    """
+    Generate lyrics of random words, one verse line per text line.
+
+    Args:
+        rng (random.Random): Random generator.
+        n_lines (int, optional): Number of lines. Defaults to 12.
+        words_per_line (int, optional): Words per line. Defaults to 6.
+
+    Returns:
+        str: The lyrics.
+    """
+    return "\n".join(" ".join(rng.choices(WORDS, k=words_per_line)) for _ in range(n_lines))
+
+
+def write_synthetic_tsv(path: str, n_songs: int, seed: int = 0) -> None:
+    """
+    Write a corpus of random songs in the TSV format of `CorpusExporter`, with Artist, Title, Lyrics and Index columns.
+
+    Args:
+        path (str): Path to the TSV file.
+        n_songs (int): Number of songs.
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["Artist", "Title", "Lyrics", "Index"])
+        for i in range(n_songs):
+            writer.writerow([f"Artist {i % 500}", f"Song {i}", synthetic_lyrics(rng), i])
+
+
+def build_annoy_index(vectors: np.ndarray, n_trees: int = 100) -> AnnoyIndex:
+    """
+    Build an angular Annoy index over the given vectors.
+
+    Args:
+        vectors (np.ndarray): Vectors, one per row.
+        n_trees (int, optional): Number of trees. Defaults to 100.
+
+    Returns:
+        AnnoyIndex: The built index.
+    """
+    index = AnnoyIndex(vectors.shape[1], "angular")
+    for i, vector in enumerate(vectors):
+        index.add_item(i, vector)
+    index.build(n_trees)
+    return index
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Compute exact top-k neighbors by cosine similarity.
+
+    Args:
+        vectors (np.ndarray): Normalized corpus vectors.
+        queries (np.ndarray): Normalized query vectors.
+        k (int): Number of neighbors.
+
+    Returns:
+        np.ndarray: Array of shape (n_queries, k) with neighbor indices.
+    """
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(found: Sequence[Sequence[int]], expected: np.ndarray) -> float:
+    """
+    Compute mean recall@k of found neighbor lists against exact neighbors.
+
+    Args:
+        found (Sequence[Sequence[int]]): Found neighbors, one list per query.
+        expected (np.ndarray): Exact neighbors, one row per query.
+
+    Returns:
+        float: Mean recall.
+    """
+    k = expected.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(e.tolist())) / k for f, e in zip(found, expected)]))
+
+
+def time_calls(fn, args: List, repeat: int = 1) -> Dict[str, float]:
+    """
+    Call a function once per argument and summarize the latencies.
+
+    Args:
+        fn: Function taking a single argument.
+        args (List): Arguments, one per call.
+        repeat (int, optional): How many times to go over all arguments. Defaults to 1.
+
+    Returns:
+        Dict[str, float]: Mean, p50 and p99 latency in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        for arg in args:
+            start = time.perf_counter()
+            fn(arg)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    timings = np.array(timings)
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
@@ -1,3 +1,4 @@
 from .artists_fetcher_mb import ArtistsFetcherMB
 from .descriptors import NonEmptyString, PositiveInteger
-from .lyrics_fetcher import LyricsFetcher
\ No newline at end of file
+from .lyrics_fetcher import LyricsFetcher, RateLimitedGenius
+from .rate_limiter import TokenBucket
\ No newline at end of file
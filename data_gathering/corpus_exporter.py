@@ -0,0 +1,284 @@
+"""
+Streaming export of the lyrics corpus stored as `lyrics/<artist>/<title>.json`.
+
+The tree is walked once in a deterministic order (artists, then files, sorted by name) and every
+valid song gets the next index. All outputs are written row by row from that single pass, so the
+TSV row order used for the Annoy item ids, the `index` in JSON used by `Song.index` and the columnar
+rows always agree, and memory use does not depend on the size of the corpus.
+
+Usage:
+    python -m data_gathering.corpus_exporter lyrics --jsonl lyrics.jsonl --tsv all_lyrics.tsv --lexical index/lexical --workers 8
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
+from search_engine.embedding_store import TextColumnWriter
+from search_engine.lexical_index import LexicalIndexWriter
+
+TSV_FIELDNAMES = ["Artist", "Title", "Lyrics", "Index"]
+COLUMNAR_FORMAT = "lyrics-corpus"
+COLUMNAR_COLUMNS = ["artist", "title", "lyrics"]
+
+
+def iter_song_files(lyrics_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    Lists song files in a deterministic order.
+
+    Args:
+        lyrics_dir (str): Directory with one subfolder per artist.
+
+    Yields:
+        Tuple[str, str]: Artist name and path to the song file.
+    """
+    for artist_name in sorted(os.listdir(lyrics_dir)):
+        artist_dir = os.path.join(lyrics_dir, artist_name)
+        if not os.path.isdir(artist_dir):
+            continue
+        for filename in sorted(os.listdir(artist_dir)):
+            if filename.endswith('.json'):
+                yield artist_name, os.path.join(artist_dir, filename)
+
+
+def read_song(artist_name: str, json_file_path: str) -> Optional[Dict[str, str]]:
+    """
+    Reads one song file, logging and skipping files that are invalid.
+
+    Args:
+        artist_name (str): Name of the artist folder.
+        json_file_path (str): Path to the song file.
+
+    Returns:
+        Optional[Dict[str, str]]: Artist, title and lyrics, or None if the file is invalid.
+    """
+    filename = os.path.basename(json_file_path)
+    try:
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        logging.error(f"Error: Could not decode JSON from {filename}. Skipping.")
+        return None
+    except Exception as e:
+        logging.error(f"Error processing file {filename}: {e}. Skipping.")
+        return None
+    if not isinstance(data, dict) or 'title' not in data or 'lyrics' not in data:
+        logging.warning(f"Warning: Missing 'title' or 'lyrics' key in {filename}. Skipping.")
+        return None
+    return {"artist": artist_name, "title": data["title"], "lyrics": data["lyrics"]}
+
+
+class CorpusExporter:
+    def __init__(self, lyrics_dir: str, workers: int = 1, chunk_size: int = 256) -> None:
+        """
+        Single-pass exporter of the lyrics tree.
+
+        Args:
+            lyrics_dir (str): Directory with one subfolder per artist.
+            workers (int, optional): Threads reading song files. Defaults to 1.
+            chunk_size (int, optional): Files read concurrently before their songs are written,
+                which bounds memory use with several workers. Defaults to 256.
+        """
+        self._lyrics_dir = lyrics_dir
+        self._workers = workers
+        self._chunk_size = chunk_size
+
+    @property
+    def lyrics_dir(self) -> str:
+        """
+        Get the exported directory.
+
+        Returns:
+            str: The directory.
+        """
+        return self._lyrics_dir
+
+    def iter_songs(self) -> Iterator[Dict]:
+        """
+        Reads the songs in order and assigns consecutive indexes to the valid ones.
+
+        Yields:
+            Dict: Songs with index, artist, title and lyrics.
+        """
+        files = iter_song_files(self._lyrics_dir)
+        if self._workers <= 1:
+            songs = (read_song(artist, path) for artist, path in files)
+        else:
+            songs = self._read_parallel(files)
+        index = 0
+        for song in songs:
+            if song is None:
+                continue
+            yield {"index": index, **song}
+            index += 1
+
+    def _read_parallel(self, files: Iterator[Tuple[str, str]]) -> Iterator[Optional[Dict[str, str]]]:
+        """
+        Reads files with a thread pool, chunk by chunk, keeping the order of the files.
+        """
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while True:
+                chunk = list(itertools.islice(files, self._chunk_size))
+                if not chunk:
+                    return
+                yield from executor.map(lambda item: read_song(*item), chunk)
+
+    def export(self, json_path: Optional[str] = None, jsonl_path: Optional[str] = None,
+               tsv_path: Optional[str] = None, columnar_path: Optional[str] = None,
+               lexical_path: Optional[str] = None) -> int:
+        """
+        Writes the corpus to every requested output in one pass over the tree.
+
+        Args:
+            json_path (Optional[str], optional): JSON array as read by `populate_db`. Defaults to None.
+            jsonl_path (Optional[str], optional): JSON Lines, one song per line. Defaults to None.
+            tsv_path (Optional[str], optional): TSV with Artist, Title, Lyrics and Index columns,
+                as read by `DataPipeline.load_tsv`. Defaults to None.
+            columnar_path (Optional[str], optional): Directory with one text column per field, readable
+                with `search_engine.TextColumn.open`. Defaults to None.
+            lexical_path (Optional[str], optional): Directory of a BM25 index of the lyrics, readable with
+                `search_engine.LexicalIndex`. Defaults to None.
+
+        Returns:
+            int: Number of exported songs.
+        """
+        writers = []
+        try:
+            if json_path:
+                writers.append(_JsonArrayWriter(json_path))
+            if jsonl_path:
+                writers.append(_JsonLinesWriter(jsonl_path))
+            if tsv_path:
+                writers.append(_TsvWriter(tsv_path))
+            if columnar_path:
+                writers.append(_ColumnarWriter(columnar_path))
+            if lexical_path:
+                writers.append(_LexicalWriter(lexical_path))
+            count = 0
+            for song in self.iter_songs():
+                for writer in writers:
+                    writer.write(song)
+                count += 1
+            for writer in writers:
+                writer.finish(count)
+        finally:
+            for writer in writers:
+                writer.close()
+        return count
+
+
+class _JsonArrayWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write("[")
+        self._first = True
+
+    def write(self, song: Dict) -> None:
+        self._file.write("\n    " if self._first else ",\n    ")
+        self._file.write(json.dumps(_json_song(song), ensure_ascii=False, indent=4).replace("\n", "\n    "))
+        self._first = False
+
+    def finish(self, count: int) -> None:
+        self._file.write("]\n" if self._first else "\n]\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _JsonLinesWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, song: Dict) -> None:
+        self._file.write(json.dumps(_json_song(song), ensure_ascii=False) + "\n")
+
+    def finish(self, count: int) -> None:
+        pass
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _TsvWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=TSV_FIELDNAMES, delimiter='\t')
+        self._writer.writeheader()
+
+    def write(self, song: Dict) -> None:
+        self._writer.writerow({'Artist': song['artist'], 'Title': song['title'],
+                               'Lyrics': song['lyrics'], 'Index': song['index']})
+
+    def finish(self, count: int) -> None:
+        pass
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ColumnarWriter:
+    def __init__(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._columns = {
+            name: TextColumnWriter(os.path.join(path, f"{name}.bin"), os.path.join(path, f"{name}.offsets.npy"))
+            for name in COLUMNAR_COLUMNS
+        }
+
+    def write(self, song: Dict) -> None:
+        for name, column in self._columns.items():
+            column.append(song[name])
+
+    def finish(self, count: int) -> None:
+        self.close()
+        # Row i is the song with index i
+        with open(os.path.join(self._path, "schema.json"), 'w') as f:
+            json.dump({'format': COLUMNAR_FORMAT, 'columns': COLUMNAR_COLUMNS, 'count': count}, f)
+
+    def close(self) -> None:
+        for column in self._columns.values():
+            column.close()
+
+
+class _LexicalWriter:
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._writer = LexicalIndexWriter()
+
+    def write(self, song: Dict) -> None:
+        self._writer.add(song['lyrics'])
+
+    def finish(self, count: int) -> None:
+        # Document i is the song with index i
+        self._writer.save(self._path)
+
+    def close(self) -> None:
+        pass
+
+
+def _json_song(song: Dict) -> Dict:
+    """
+    Orders the keys as in the JSON written by earlier versions of `save_to_json`.
+    """
+    return {"artist": song["artist"], "title": song["title"], "lyrics": song["lyrics"], "index": song["index"]}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("lyrics_dir")
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--jsonl", dest="jsonl_path")
+    parser.add_argument("--tsv", dest="tsv_path")
+    parser.add_argument("--columnar", dest="columnar_path")
+    parser.add_argument("--lexical", dest="lexical_path")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    count = CorpusExporter(args.lyrics_dir, workers=args.workers).export(
+        json_path=args.json_path, jsonl_path=args.jsonl_path, tsv_path=args.tsv_path, columnar_path=args.columnar_path,
+        lexical_path=args.lexical_path,
+    )
+    logging.info(f"Exported {count} songs.")
@@ -1,23 +1,92 @@
 import json
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set
 from lyricsgenius import Genius
+from requests.exceptions import HTTPError, Timeout
+from .rate_limiter import TokenBucket
 import re
 import os
 
+
+class RateLimitedGenius(Genius):
+    def __init__(self, *args, rate_limiter: Optional[TokenBucket] = None, retry_after: float = 30.0, **kwargs) -> None:
+        """
+        Genius client that takes a token from a shared rate limiter before every HTTP request, so
+        clients in several threads together stay under the Genius rate limit. A 429 response pauses
+        the limiter for all of them and the request is retried.
+
+        Timeouts and 5xx responses are retried here as well, the retries of lyricsgenius itself are
+        turned off because they would send requests without taking a token.
+
+        Args:
+            rate_limiter (Optional[TokenBucket], optional): Shared limiter. Defaults to None, no limit.
+            retry_after (float, optional): Seconds to pause after a 429 response. Defaults to 30.
+        """
+        super().__init__(*args, **kwargs)
+        self._rate_limiter = rate_limiter
+        self._retry_after = retry_after
+        self._max_retries = self.retries
+        self.retries = 0
+
+    def _make_request(self, path, method="GET", params_=None, public_api=False, web=False, **kwargs):
+        attempts = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            try:
+                return super()._make_request(path, method, params_, public_api, web, **kwargs)
+            except Timeout:
+                attempts += 1
+                if attempts > self._max_retries:
+                    raise
+            except HTTPError as e:
+                attempts += 1
+                status = e.args[0] if e.args and isinstance(e.args[0], int) else None
+                if status is None or (status != 429 and status < 500) or attempts > self._max_retries:
+                    raise
+                if status == 429:
+                    if self._rate_limiter is not None:
+                        self._rate_limiter.pause(self._retry_after)
+                    else:
+                        time.sleep(self._retry_after)
+
+
 class LyricsFetcher:
-    def __init__(self, api_token:str, artists: None|List[str]) -> None:
+    def __init__(self, api_token:str, artists: None|List[str], requests_per_second: Optional[float] = 4.0) -> None:
         self._artists = artists or []
         self._api_token = api_token
+        # Shared by all clients, see RateLimitedGenius
+        self._rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self._local = threading.local()
+        self._checkpoint_lock = threading.Lock()
 
         self._genius = self._set_up()
 
+    @property
+    def rate_limiter(self) -> Optional[TokenBucket]:
+        return self._rate_limiter
+
     def _set_up(self):
-        genius = Genius(self._api_token,
-                        verbose=True,
-                        timeout=30,
-                        retries=3)
+        genius = RateLimitedGenius(self._api_token,
+                                   rate_limiter=self._rate_limiter,
+                                   verbose=True,
+                                   timeout=30,
+                                   retries=3,
+                                   # The rate limiter spaces requests instead of a fixed sleep per client
+                                   sleep_time=0 if self._rate_limiter else 0.2)
         return genius
 
+    def _client(self):
+        """
+        Client of the current worker thread, requests.Session is not thread-safe.
+        """
+        if not hasattr(self._local, "genius"):
+            self._local.genius = self._set_up()
+            self._local.genius.verbose = False  # Interleaved output of several workers is unreadable
+        return self._local.genius
+
     def _clean_lyrics(self, lyrics: str) -> str:
         cleaned_lines = [line for line in lyrics.split("\n") if not re.match(r"^\[.*\]", line) and line.strip()]
         return "\n".join(cleaned_lines)
@@ -35,28 +104,111 @@ class LyricsFetcher:
             print(f"An error occurred: {e}")
             return cls(api_token, None)
 
-    def fetch_songs(self, songs_per_artist: int=10, sort_by: str="popularity"):
-        for artist in self._artists:
-            artist_query = self._genius.search_artist(
-                artist_name=artist,
-                max_songs=songs_per_artist,
-                sort=sort_by,
-            )
-            if not artist_query:
-                continue  # Skip if no artist data is found
-            try:
-                for song in artist_query.songs:
-                    if not song.lyrics:
-                        continue  # Skip if lyrics are missing
-                    cleaned_lyrics = self._clean_lyrics(song.lyrics)
-                    os.makedirs(f'lyrics/{artist}', exist_ok=True)
-                    file_path = f"lyrics/{artist}/{song.title}.json"
-                    song_dict = {
-                        "title": song.title,
-                        "lyrics": cleaned_lyrics
-                    }
-                    with open(file_path, "w", encoding='utf-8') as f:
-                        json.dump(song_dict, f, indent=4, ensure_ascii=False)
-            except Exception as e:  # Log the error for debugging
-                print(f"Error processing artist {artist}: {e}")
-                continue
+    @staticmethod
+    def _load_checkpoint(checkpoint_path: Optional[str]) -> Set[str]:
+        """
+        Reads the artists completed by previous runs, one per line.
+        """
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return set()
+        with open(checkpoint_path, "r", encoding='utf-8') as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def _mark_done(self, checkpoint_path: Optional[str], artist: str) -> None:
+        if not checkpoint_path:
+            return
+        with self._checkpoint_lock:
+            with open(checkpoint_path, "a", encoding='utf-8') as f:
+                f.write(artist + "\n")
+
+    def _fetch_artist(self, genius, artist: str, songs_per_artist: int, sort_by: str, lyrics_dir: str) -> int:
+        """
+        Downloads songs of one artist and saves every song with lyrics to its own JSON file.
+
+        Returns:
+            int: Number of saved songs.
+        """
+        artist_query = genius.search_artist(
+            artist_name=artist,
+            max_songs=songs_per_artist,
+            sort=sort_by,
+        )
+        if not artist_query:
+            return 0  # Skip if no artist data is found
+        saved = 0
+        # Errors propagate, so an artist with unsaved songs is recorded as failed and not checkpointed
+        for song in artist_query.songs:
+            if not song.lyrics:
+                continue  # Skip if lyrics are missing
+            cleaned_lyrics = self._clean_lyrics(song.lyrics)
+            os.makedirs(f'{lyrics_dir}/{artist}', exist_ok=True)
+            file_path = f"{lyrics_dir}/{artist}/{song.title}.json"
+            song_dict = {
+                "title": song.title,
+                "lyrics": cleaned_lyrics
+            }
+            with open(file_path, "w", encoding='utf-8') as f:
+                json.dump(song_dict, f, indent=4, ensure_ascii=False)
+            saved += 1
+        return saved
+
+    def fetch_songs(self, songs_per_artist: int=10, sort_by: str="popularity", workers: int=1,
+                    checkpoint_path: Optional[str]=None, lyrics_dir: str="lyrics",
+                    report_every: int=10) -> Dict[str, object]:
+        """
+        Downloads lyrics of all artists into `lyrics_dir/<artist>/<title>.json`.
+
+        With several workers, artists are fetched concurrently by a thread pool. Each thread has its
+        own Genius client and all of them share the rate limiter. Completed artists are appended to
+        the checkpoint file and skipped when fetching is resumed, artists that failed are retried.
+
+        Args:
+            songs_per_artist (int, optional): Maximum number of songs per artist. Defaults to 10.
+            sort_by (str, optional): Genius sort order of the songs. Defaults to "popularity".
+            workers (int, optional): Number of concurrent workers. Defaults to 1.
+            checkpoint_path (Optional[str], optional): File listing completed artists. Defaults to None.
+            lyrics_dir (str, optional): Output directory. Defaults to "lyrics".
+            report_every (int, optional): Print progress after this many artists. Defaults to 10.
+
+        Returns:
+            Dict[str, object]: Numbers of fetched and skipped artists, saved songs, elapsed seconds
+                and the list of artists that failed.
+        """
+        completed = self._load_checkpoint(checkpoint_path)
+        pending = [artist for artist in dict.fromkeys(self._artists) if artist.strip() and artist not in completed]
+        stats = {'artists': 0, 'skipped': len(completed), 'songs': 0, 'failed': [], 'seconds': 0.0}
+        start = time.perf_counter()
+
+        def record(artist, saved=None, error=None):
+            if error is not None:
+                print(f"Error fetching artist {artist}: {error}")
+                stats['failed'].append(artist)
+            else:
+                self._mark_done(checkpoint_path, artist)
+                stats['artists'] += 1
+                stats['songs'] += saved
+            finished = stats['artists'] + len(stats['failed'])
+            if finished % report_every == 0 or finished == len(pending):
+                elapsed = time.perf_counter() - start
+                print(f"Fetched {finished}/{len(pending)} artists, {stats['songs']} songs, "
+                      f"{finished / elapsed:.2f} artists/s, {stats['songs'] / elapsed:.2f} songs/s")
+
+        if workers <= 1:
+            for artist in pending:
+                try:
+                    record(artist, self._fetch_artist(self._genius, artist, songs_per_artist, sort_by, lyrics_dir))
+                except Exception as e:
+                    record(artist, error=e)
+        else:
+            def work(artist):
+                return self._fetch_artist(self._client(), artist, songs_per_artist, sort_by, lyrics_dir)
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lyrics-fetcher") as executor:
+                futures = {executor.submit(work, artist): artist for artist in pending}
+                for future in as_completed(futures):
+                    try:
+                        record(futures[future], future.result())
+                    except Exception as e:
+                        record(futures[future], error=e)
+        stats['seconds'] = time.perf_counter() - start
+        return stats
@@ -0,0 +1,128 @@
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Thread-safe token bucket rate limiter shared by concurrent workers.
+
+        Tokens are added continuously at `rate` per second up to `capacity`. Every request takes one
+        token and waits when none are left, so bursts up to `capacity` are allowed while the long-run
+        rate never exceeds `rate`.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (Optional[float], optional): Maximum number of stored tokens. Defaults to None,
+                which allows a burst of one second worth of requests.
+            clock (Callable[[], float], optional): Monotonic clock in seconds. Defaults to time.monotonic.
+            sleep (Callable[[float], None], optional): Function used to wait. Defaults to time.sleep.
+        """
+        if rate <= 0:
+            raise ValueError("`rate` must be positive.")
+        self._rate = float(rate)
+        self._capacity = float(capacity) if capacity is not None else max(1.0, self._rate)
+        if self._capacity < 1:
+            raise ValueError("`capacity` must be at least 1.")
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self._capacity
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """
+        Get the number of tokens added per second.
+
+        Returns:
+            float: The rate.
+        """
+        return self._rate
+
+    @property
+    def capacity(self) -> float:
+        """
+        Get the maximum number of stored tokens.
+
+        Returns:
+            float: The capacity.
+        """
+        return self._capacity
+
+    def _refill(self, now: float) -> None:
+        start = max(self._updated_at, self._paused_until)
+        if now > start:
+            self._tokens = min(self._capacity, self._tokens + (now - start) * self._rate)
+        self._updated_at = max(now, self._updated_at)
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        """
+        Take the tokens if available, otherwise compute how long to wait for them.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds to wait.
+        """
+        with self._lock:
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now + (tokens - self._tokens) / self._rate
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self._rate
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take tokens without waiting.
+
+        Args:
+            tokens (float, optional): Number of tokens. Defaults to 1.
+
+        Returns:
+            bool: Whether the tokens were taken.
+        """
+        return self._wait_time(tokens, self._clock()) == 0.0
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Take tokens, waiting until they are available.
+
+        Args:
+            tokens (float, optional): Number of tokens. Defaults to 1.
+            timeout (Optional[float], optional): Maximum number of seconds to wait. Defaults to None,
+                which waits as long as needed.
+
+        Returns:
+            bool: Whether the tokens were taken before the timeout.
+        """
+        if tokens > self._capacity:
+            raise ValueError("Cannot acquire more tokens than the capacity.")
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            now = self._clock()
+            wait = self._wait_time(tokens, now)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            self._sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for a while, e.g. after the server answered 429 Too Many Requests.
+        Stored tokens are dropped, so workers resume at the regular rate afterwards.
+
+        Args:
+            seconds (float): Number of seconds to pause.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + seconds)
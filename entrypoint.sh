@@ -2,4 +2,8 @@
 flask db upgrade --directory "web_app/migrations"
 
 service ssh start
-exec gunicorn --bind 0.0.0.0:5000 "web_app.main:create_app()"
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    exec uvicorn --factory web_app.lyrics_search.async_app:create_asgi_app \
+        --host 0.0.0.0 --port 5000 --workers "${UVICORN_WORKERS:-1}"
+fi
+exec gunicorn -c gunicorn.conf.py "web_app.main:create_app()"
@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration, used by entrypoint.sh.
+
+With PRELOAD_APP=true the app is imported once in the master. The Annoy index, embedding stores
+and delta segment are memory-mapped there and shared copy-on-write by all forked workers.
+TensorFlow is not fork-safe once its thread pools are running, so the embedding model is loaded
+by every worker after forking, in `post_worker_init`, according to the WARM_UP setting.
+"""
+import os
+import sys
+import time
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+preload_app = os.environ.get("PRELOAD_APP", "False").lower() == 'true'
+# Workers load the embedding model before their first heartbeat, which can take a while
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+_started_at = time.monotonic()
+
+
+def when_ready(server):
+    # Runs in the master after the app has been imported and before workers are forked
+    routes = sys.modules.get("web_app.lyrics_search.routes")
+    if preload_app and routes is not None:
+        routes.preload_search_backend()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    routes = sys.modules.get("web_app.lyrics_search.routes")
+    if routes is not None:
+        routes.schedule_warm_up()
+    now = time.monotonic()
+    worker.log.info("Worker %s ready %.2fs after fork, %.2fs after master start",
+                    worker.pid, now - worker.forked_at, now - _started_at)
@@ -1,3 +1,52 @@
-from search_engine.data_pipeline import *
-from search_engine.index_builder import *
-from search_engine.query_interface import *
\ No newline at end of file
+"""
+Search engine package. Public classes are imported on first access, so importing the package, or only
+the query path, does not load TensorFlow.
+"""
+import importlib
+from typing import Any, List
+
+_EXPORTS = {
+    'QUANTIZATION_MODES': 'quantization',
+    'ScalarQuantizer': 'quantization',
+    'TextColumn': 'embedding_store',
+    'TextColumnWriter': 'embedding_store',
+    'FlatEmbeddingStore': 'embedding_store',
+    'EmbeddingCache': 'embedding_cache',
+    'normalize_text': 'embedding_cache',
+    'DataPipeline': 'data_pipeline',
+    'IndexBuilder': 'index_builder',
+    'LRUCache': 'query_cache',
+    'QueryCache': 'query_cache',
+    'normalize_query': 'query_cache',
+    'SearchBackend': 'search_backends',
+    'AnnoyBackend': 'search_backends',
+    'ExactBackend': 'search_backends',
+    'QuantizedBackend': 'search_backends',
+    'DeltaIndex': 'delta_index',
+    'DeltaBackend': 'delta_index',
+    'PassageMap': 'passages',
+    'PassageBackend': 'passages',
+    'LexicalIndex': 'lexical_index',
+    'LexicalIndexWriter': 'lexical_index',
+    'reciprocal_rank_fusion': 'lexical_index',
+    'tokenize': 'lexical_index',
+    'QueryInterface': 'query_interface',
+    'QueryBatcher': 'batcher',
+    'AsyncQueryInterface': 'async_query',
+    'LazyModule': 'lazy',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,281 @@
+"""
+Offline sweep of Annoy index parameters over a real embedding file.
+
+A sample of the embeddings is held out as queries and their exact top-k neighbors among the
+remaining items are computed with NumPy. An index is built for every `n_trees` value, in parallel
+processes, and searched with every `search_k` value. Latencies are measured one index at a time
+after all builds finished, so they are not distorted by concurrent builds. The report lists recall@k,
+p50/p99 latency, build time and index file size of every configuration, the Pareto-optimal ones and
+the fastest configuration reaching the target recall.
+
+Usage:
+    python -m search_engine.annoy_tuner index/embeddings --n-trees 10 25 50 100 200 \\
+        --search-k fast balanced 5000 20000 --k 10 --queries 500 --target-recall 0.95 --output tuning.json
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import tempfile
+import time
+from annoy import AnnoyIndex
+import numpy as np
+from search_engine.embedding_store import FlatEmbeddingStore
+from search_engine.index_builder import IndexBuilder, _read_embeddings
+from search_engine.search_backends import SEARCH_PRESETS, SearchK, annoy_search_k
+
+DEFAULT_N_TREES = (10, 25, 50, 100, 200)
+DEFAULT_SEARCH_K = ("fast", "balanced", 5000, 20000)
+
+
+def hold_out_queries(n_total: int, n_queries: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Randomly split item ids into corpus items and held out queries.
+
+    Args:
+        n_total (int): Number of items.
+        n_queries (int): Number of queries, at most half of the items.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Sorted corpus ids and sorted query ids.
+    """
+    if n_queries <= 0 or n_queries > n_total // 2:
+        raise ValueError(f"`n_queries` must be between 1 and half of the {n_total} items, got {n_queries}")
+    permutation = np.random.default_rng(seed).permutation(n_total)
+    return np.sort(permutation[n_queries:]), np.sort(permutation[:n_queries])
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int, batch_size: int = 256) -> np.ndarray:
+    """
+    Compute the exact top-k neighbors by cosine similarity, which orders items like Annoy's angular distance.
+    Queries are scored in batches, so memory stays at batch_size x corpus size scores.
+
+    Args:
+        corpus (np.ndarray): Corpus embeddings of shape (n, n_dims), e.g. memory-mapped.
+        queries (np.ndarray): Query embeddings of shape (n_queries, n_dims).
+        k (int): Number of neighbors, at most n.
+        batch_size (int, optional): Queries scored at once. Defaults to 256.
+
+    Returns:
+        np.ndarray: Neighbor rows of the corpus, shape (n_queries, k), best first.
+    """
+    if not 0 < k <= corpus.shape[0]:
+        raise ValueError(f"`k` must be between 1 and the corpus size {corpus.shape[0]}, got {k}")
+    corpus = np.asarray(corpus, dtype=np.float32)
+    corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    queries = np.asarray(queries, dtype=np.float32)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    neighbors = np.empty((queries.shape[0], k), dtype=np.int64)
+    for start in range(0, queries.shape[0], batch_size):
+        scores = queries[start:start + batch_size] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        neighbors[start:start + batch_size] = np.take_along_axis(top, order, axis=1)
+    return neighbors
+
+
+def recall_at_k(found: Sequence[Sequence[int]], expected: np.ndarray) -> float:
+    """
+    Compute the mean recall@k of found neighbor lists against the exact neighbors.
+
+    Args:
+        found (Sequence[Sequence[int]]): Found neighbors, one list per query.
+        expected (np.ndarray): Exact neighbors, one row of k items per query.
+
+    Returns:
+        float: Mean fraction of the exact neighbors that were found.
+    """
+    k = expected.shape[1]
+    hits = [len(set(f[:k]).intersection(e.tolist())) for f, e in zip(found, expected)]
+    return float(np.mean(hits)) / k if hits else 0.0
+
+
+def _dominates(a: Dict, b: Dict) -> bool:
+    no_worse = a['recall'] >= b['recall'] and a['p50_ms'] <= b['p50_ms'] and a['index_bytes'] <= b['index_bytes']
+    better = a['recall'] > b['recall'] or a['p50_ms'] < b['p50_ms'] or a['index_bytes'] < b['index_bytes']
+    return no_worse and better
+
+
+def pareto_frontier(results: Sequence[Dict]) -> List[Dict]:
+    """
+    Select the configurations no other configuration beats on recall, p50 latency and index size at once.
+
+    Args:
+        results (Sequence[Dict]): Results of `tune`, with 'recall', 'p50_ms' and 'index_bytes' keys.
+
+    Returns:
+        List[Dict]: The Pareto-optimal results, by descending recall.
+    """
+    frontier = [a for a in results if not any(_dominates(b, a) for b in results)]
+    return sorted(frontier, key=lambda r: (-r['recall'], r['p50_ms']))
+
+
+def recommend(results: Sequence[Dict], target_recall: float) -> Optional[Dict]:
+    """
+    Pick the configuration with the lowest p50 latency reaching the target recall, smaller indexes win ties.
+    If none does, the one with the highest recall.
+
+    Args:
+        results (Sequence[Dict]): Results of `tune`.
+        target_recall (float): Minimum recall@k.
+
+    Returns:
+        Optional[Dict]: The recommended result, None if there are no results.
+    """
+    frontier = pareto_frontier(results)
+    if not frontier:
+        return None
+    reaching = [r for r in frontier if r['recall'] >= target_recall]
+    if not reaching:
+        return frontier[0]
+    return min(reaching, key=lambda r: (r['p50_ms'], r['index_bytes']))
+
+
+def _build_candidate(store_path: str, n_trees: int, n_dims: int, index_path: str) -> Dict:
+    # Runs in a worker process, every build uses a single core
+    builder = IndexBuilder(n_trees=n_trees, n_dims=n_dims, n_jobs=1)
+    builder.build_index_from_files([store_path])
+    builder.save_to_file(index_path)
+    return {'n_trees': n_trees, 'build_seconds': builder.build_timings['build'],
+            'index_bytes': os.path.getsize(index_path), 'index_path': index_path}
+
+
+def _measure(index_path: str, n_dims: int, n_trees: int, queries: np.ndarray, expected: np.ndarray,
+             search_k: SearchK) -> Dict:
+    index = AnnoyIndex(n_dims, "angular")
+    index.load(index_path)
+    k = expected.shape[1]
+    resolved = annoy_search_k(search_k, k, n_trees, index.get_n_items())
+    rows = queries.tolist()
+    index.get_nns_by_vector(rows[0], k, resolved)  # warm-up, pages in the memory-mapped file
+    found, timings = [], []
+    for row in rows:
+        start = time.perf_counter()
+        found.append(index.get_nns_by_vector(row, k, resolved))
+        timings.append((time.perf_counter() - start) * 1000.0)
+    index.unload()
+    return {'search_k': search_k, 'annoy_search_k': resolved if resolved != -1 else k * n_trees,
+            'recall': recall_at_k(found, expected), 'p50_ms': float(np.percentile(timings, 50)),
+            'p99_ms': float(np.percentile(timings, 99))}
+
+
+def tune(embeddings_path: str, n_trees_values: Sequence[int] = DEFAULT_N_TREES,
+         search_k_values: Sequence[SearchK] = DEFAULT_SEARCH_K, k: int = 10, n_queries: int = 500,
+         n_dims: int = 512, n_jobs: Optional[int] = None, work_dir: Optional[str] = None,
+         seed: int = 0) -> List[Dict]:
+    """
+    Measure every n_trees x search_k configuration on an embedding file.
+
+    Args:
+        embeddings_path (str): TFRecord file or flat embedding store written by `DataPipeline.save_embeddings`.
+        n_trees_values (Sequence[int], optional): Numbers of trees to build. Defaults to DEFAULT_N_TREES.
+        search_k_values (Sequence[SearchK], optional): search_k values or presets, see `annoy_search_k`.
+            Defaults to DEFAULT_SEARCH_K.
+        k (int, optional): Number of neighbors per query. Defaults to 10.
+        n_queries (int, optional): Number of held out queries. Defaults to 500.
+        n_dims (int, optional): Dimensionality of the embeddings. Defaults to 512.
+        n_jobs (Optional[int], optional): Number of indexes built in parallel. Defaults to None, one per core.
+        work_dir (Optional[str], optional): Directory keeping the corpus and the built indexes. Defaults to None,
+            a temporary directory removed afterwards.
+        seed (int, optional): Random seed of the query sample. Defaults to 0.
+
+    Returns:
+        List[Dict]: One result per configuration, with n_trees, search_k, annoy_search_k (candidates inspected),
+        recall, p50_ms, p99_ms, build_seconds and index_bytes.
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return tune(embeddings_path, n_trees_values, search_k_values, k, n_queries, n_dims, n_jobs, tmp_dir, seed)
+
+    embeddings = _read_embeddings(embeddings_path, n_dims)
+    corpus_ids, query_ids = hold_out_queries(embeddings.shape[0], n_queries, seed)
+    queries = np.asarray(embeddings[query_ids], dtype=np.float32)
+    print(f"Holding out {len(query_ids)} of {embeddings.shape[0]} items as queries")
+
+    # Workers read the corpus from a memory-mapped store instead of receiving a pickled copy
+    os.makedirs(work_dir, exist_ok=True)
+    store_path = os.path.join(work_dir, "corpus")
+    store = FlatEmbeddingStore.write(store_path, embeddings[corpus_ids])
+    start = time.perf_counter()
+    expected = exact_neighbors(store.embeddings, queries, k)
+    print(f"Computed exact top-{k} neighbors in {time.perf_counter() - start:.2f}s")
+
+    builds = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(_build_candidate, store_path, n_trees, n_dims,
+                                   os.path.join(work_dir, f"trees_{n_trees}.ann"))
+                   for n_trees in n_trees_values]
+        for future in futures:
+            build = future.result()
+            print(f"Built {build['n_trees']} trees in {build['build_seconds']:.2f}s")
+            builds.append(build)
+
+    results = []
+    for build in builds:
+        for search_k in search_k_values:
+            measured = _measure(build['index_path'], n_dims, build['n_trees'], queries, expected, search_k)
+            results.append({'n_trees': build['n_trees'], **measured, 'build_seconds': build['build_seconds'],
+                            'index_bytes': build['index_bytes']})
+    return results
+
+
+def format_report(results: Sequence[Dict], target_recall: float) -> str:
+    """
+    Format tuning results as a table, Pareto-optimal rows are marked with *.
+
+    Args:
+        results (Sequence[Dict]): Results of `tune`.
+        target_recall (float): Minimum recall@k of the recommendation.
+
+    Returns:
+        str: The report.
+    """
+    frontier = {id(r) for r in pareto_frontier(results)}
+    lines = [f"  {'n_trees':>7} {'search_k':>10} {'candidates':>10} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} "
+             f"{'build s':>8} {'size MB':>8}"]
+    for r in results:
+        marker = "*" if id(r) in frontier else " "
+        lines.append(f"{marker} {r['n_trees']:>7} {str(r['search_k']):>10} {r['annoy_search_k']:>10} "
+                     f"{r['recall']:>7.3f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['build_seconds']:>8.2f} "
+                     f"{r['index_bytes'] / 2 ** 20:>8.1f}")
+    best = recommend(results, target_recall)
+    if best is not None:
+        reached = "reaches" if best['recall'] >= target_recall else "does not reach, highest recall"
+        lines.append(f"Recommended: n_trees={best['n_trees']} search_k={best['search_k']} "
+                     f"({reached} recall {target_recall})")
+    return "\n".join(lines)
+
+
+def _search_k_arg(value: str) -> SearchK:
+    if value in SEARCH_PRESETS:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer or one of {SEARCH_PRESETS}, got {value!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("embeddings_path", help="TFRecord file or flat embedding store")
+    parser.add_argument("--n-trees", type=int, nargs="+", default=list(DEFAULT_N_TREES))
+    parser.add_argument("--search-k", type=_search_k_arg, nargs="+", default=list(DEFAULT_SEARCH_K))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--n-dims", type=int, default=512)
+    parser.add_argument("--jobs", type=int, default=None, help="Indexes built in parallel, defaults to one per core")
+    parser.add_argument("--work-dir", default=None, help="Keep the corpus and the built indexes in this directory")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+    tuning = tune(args.embeddings_path, args.n_trees, args.search_k, args.k, args.queries, args.n_dims, args.jobs,
+                  args.work_dir, args.seed)
+    print(format_report(tuning, args.target_recall))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'results': tuning, 'pareto_frontier': pareto_frontier(tuning),
+                       'recommended': recommend(tuning, args.target_recall)}, f, indent=2)
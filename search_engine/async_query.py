@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import queue
+
+import numpy as np
+
+from search_engine.metrics import StageTimer
+from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import SearchK
+
+
+def _call(timer: Optional[StageTimer], fn: Callable[..., Any], args: Tuple[Any, ...]) -> Any:
+    # Runs in a pool thread, stages of the query path are recorded into the request's timer
+    if timer is None:
+        return fn(*args)
+    with timer.activate():
+        return fn(*args)
+
+
+class AsyncQueryInterface:
+    def __init__(self, query_interface: QueryInterface, max_workers: int = 4, max_pending: int = 256) -> None:
+        """
+        Awaitable wrapper of a QueryInterface for asyncio servers.
+
+        Embedding and search calls run on a bounded thread pool, so the event loop keeps serving other
+        requests meanwhile. TensorFlow and Annoy release the GIL in native code, so a few threads keep the
+        CPU busy while many requests are waiting for their database queries or their turn in the pool.
+
+        Args:
+            query_interface (QueryInterface): The query interface doing the work.
+            max_workers (int, optional): Threads running embedding and search calls. Defaults to 4.
+            max_pending (int, optional): Maximum number of calls running or waiting for a thread, further
+                calls raise queue.Full. Defaults to 256.
+        """
+        if max_workers <= 0:
+            raise ValueError("`max_workers` must be a positive integer")
+        if max_pending < max_workers:
+            raise ValueError("`max_pending` must be at least `max_workers`")
+        self._query_interface = query_interface
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        # Only changed from the event loop thread, so no lock is needed
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    @property
+    def query_interface(self) -> QueryInterface:
+        """
+        Get the wrapped query interface.
+
+        Returns:
+            QueryInterface: The query interface.
+        """
+        return self._query_interface
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Get a snapshot of the pool statistics.
+
+        Returns:
+            Dict[str, int]: Configuration, number of calls running or waiting, completed calls and rejected calls.
+        """
+        return {
+            'max_workers': self._max_workers,
+            'max_pending': self._max_pending,
+            'pending': self._pending,
+            'completed': self._completed,
+            'rejected': self._rejected,
+        }
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timer: Optional[StageTimer] = None) -> Any:
+        """
+        Run a blocking call on the pool.
+
+        Args:
+            fn (Callable[..., Any]): The function, e.g. a method of the query interface.
+            *args (Any): Its arguments.
+            timer (Optional[StageTimer], optional): Timer of the request, activated in the pool thread,
+                so `stage` blocks of the call record into it. Defaults to None.
+
+        Returns:
+            Any: The result of the call.
+        """
+        if self._pending >= self._max_pending:
+            self._rejected += 1
+            raise queue.Full
+        self._pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, _call, timer, fn, args)
+        finally:
+            self._pending -= 1
+        self._completed += 1
+        return result
+
+    async def embed(self, texts: List[str], timer: Optional[StageTimer] = None) -> np.ndarray:
+        """
+        Compute embeddings for several texts in a single model call, see `QueryInterface.embed`.
+        """
+        return await self.run(self._query_interface.embed, texts, timer=timer)
+
+    async def query_with_scores(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                                min_score: Optional[float] = None,
+                                timer: Optional[StageTimer] = None) -> Tuple[List[int], List[float]]:
+        """
+        Nearest neighbors with their cosine similarity, see `QueryInterface.query_with_scores`.
+        """
+        return await self.run(self._query_interface.query_with_scores, query, n_items, search_k, min_score,
+                              timer=timer)
+
+    async def query_with_passages(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                                  min_score: Optional[float] = None,
+                                  timer: Optional[StageTimer] = None) -> Tuple[List[int], List[float], List[str]]:
+        """
+        Nearest songs with their best matching passage, see `QueryInterface.query_with_passages`.
+        """
+        return await self.run(self._query_interface.query_with_passages, query, n_items, search_k, min_score,
+                              timer=timer)
+
+    async def query_hybrid(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                           min_score: Optional[float] = None,
+                           timer: Optional[StageTimer] = None) -> Tuple[List[int], List[float], List[str]]:
+        """
+        Fused embedding and lexical search, see `QueryInterface.query_hybrid`.
+        """
+        return await self.run(self._query_interface.query_hybrid, query, n_items, search_k, min_score, timer=timer)
+
+    async def query_batch_with_scores(self, queries: List[str], n_items: int = 5, search_k: SearchK = None,
+                                      min_score: Optional[float] = None,
+                                      timer: Optional[StageTimer] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Nearest neighbors of several queries embedded together, see `QueryInterface.query_batch_with_scores`.
+        """
+        return await self.run(self._query_interface.query_batch_with_scores, queries, n_items, search_k, min_score,
+                              timer=timer)
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Shut the thread pool down.
+
+        Args:
+            wait (bool, optional): Wait for running calls to finish. Defaults to True.
+        """
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,219 @@
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple, Union
+import queue
+import threading
+import time
+
+from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import SearchK
+
+
+class QueryBatcher:
+    def __init__(self, query_interface: QueryInterface, max_batch_size: int = 32,
+                 batch_window_ms: float = 5.0, max_queue_size: int = 256) -> None:
+        """
+        Initialize a dynamic batcher that groups concurrent queries into a single embedding call.
+
+        Queries submitted from different threads are queued and collected by one worker thread,
+        until either `max_batch_size` queries are waiting or `batch_window_ms` has passed since
+        the first one arrived. The whole batch is embedded at once, then every caller gets its
+        own nearest neighbors.
+
+        Args:
+            query_interface (QueryInterface): The query interface used for embedding and searching.
+            max_batch_size (int, optional): Maximum number of queries embedded together. Defaults to 32.
+            batch_window_ms (float, optional): How long to wait for more queries after the first one. Defaults to 5.0.
+            max_queue_size (int, optional): Maximum number of queries waiting to be batched. Defaults to 256.
+        """
+        if max_batch_size <= 0:
+            raise ValueError("`max_batch_size` must be a positive integer")
+        if batch_window_ms < 0:
+            raise ValueError("`batch_window_ms` must not be negative")
+        self._query_interface = query_interface
+        self._max_batch_size = max_batch_size
+        self._batch_window = batch_window_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)  # type: queue.Queue
+        self._stats_lock = threading.Lock()
+        self._batch_size_counts = [0] * (max_batch_size + 1)
+        self._rejected = 0
+        self._worker = None  # type: Optional[threading.Thread]
+        self._running = False
+        # Held while checking `_running` and queueing, so no query is queued behind the stop sentinel
+        self._state_lock = threading.Lock()
+
+    @property
+    def max_batch_size(self) -> int:
+        """
+        Get the maximum number of queries embedded together.
+
+        Returns:
+            int: The maximum batch size.
+        """
+        return self._max_batch_size
+
+    @property
+    def batch_window_ms(self) -> float:
+        """
+        Get the batching window in milliseconds.
+
+        Returns:
+            float: The batching window.
+        """
+        return self._batch_window * 1000.0
+
+    @property
+    def stats(self) -> Dict[str, object]:
+        """
+        Get a snapshot of the batcher statistics.
+
+        Returns:
+            Dict[str, object]: Configuration, current queue depth, number of processed batches and
+            queries, number of rejected queries and a histogram mapping batch size to batch count.
+        """
+        with self._stats_lock:
+            histogram = {size: count for size, count in enumerate(self._batch_size_counts) if count}
+            rejected = self._rejected
+        return {
+            'max_batch_size': self._max_batch_size,
+            'batch_window_ms': self.batch_window_ms,
+            'max_queue_size': self._queue.maxsize,
+            'queue_depth': self._queue.qsize(),
+            'batches': sum(histogram.values()),
+            'queries': sum(size * count for size, count in histogram.items()),
+            'rejected': rejected,
+            'batch_size_histogram': histogram,
+        }
+
+    def start(self) -> "QueryBatcher":
+        """
+        Start the background worker thread. Calling it on a running batcher does nothing.
+
+        Returns:
+            QueryBatcher: The batcher itself.
+        """
+        with self._state_lock:
+            if not self._running:
+                self._running = True
+                self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                self._worker.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the background worker thread after it finishes the queries already queued.
+
+        Args:
+            timeout (Optional[float], optional): Seconds to wait for the worker to finish. Defaults to None.
+        """
+        with self._state_lock:
+            if not self._running:
+                return
+            self._running = False
+            # Blocks at most until the worker takes a query, nothing is queued meanwhile
+            self._queue.put(None)
+        self._worker.join(timeout)
+        self._worker = None
+
+    def submit(self, query: str, n_items: int = 5, timeout: Optional[float] = None,
+               scored: bool = False, search_k: SearchK = None) -> Union[List[int], Tuple[List[int], List[float]]]:
+        """
+        Queue a query and block until its batch has been processed.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            timeout (Optional[float], optional): Seconds to wait for the result. Defaults to None.
+            scored (bool, optional): Also return the similarity scores. Defaults to False.
+            search_k (SearchK, optional): Recall/latency trade-off of the search, see `QueryInterface.query`.
+                Defaults to None.
+
+        Returns:
+            Union[List[int], Tuple[List[int], List[float]]]: List of indices of the nearest neighbors,
+            with `scored` a pair of indices and similarity scores.
+
+        Raises:
+            queue.Full: If the queue already holds `max_queue_size` queries.
+            RuntimeError: If the batcher has not been started.
+        """
+        if not self._running:
+            raise RuntimeError("QueryBatcher is not running, call start() first")
+        if scored:
+            cached = self._query_interface.get_cached_scored_results(query, n_items, search_k)
+        else:
+            cached = self._query_interface.get_cached_results(query, n_items, search_k)
+        if cached is not None:
+            return cached
+        future = Future()  # type: Future
+        with self._state_lock:
+            # Checked again, a concurrent stop() may have queued the sentinel since
+            if not self._running:
+                raise RuntimeError("QueryBatcher is not running, call start() first")
+            try:
+                self._queue.put_nowait((query, n_items, scored, search_k, future))
+            except queue.Full:
+                with self._stats_lock:
+                    self._rejected += 1
+                raise
+        return future.result(timeout)
+
+    def _collect_batch(self, first: Tuple[str, int, bool, SearchK, Future]) -> List[Tuple[str, int, bool, SearchK, Future]]:
+        """
+        Collect queued queries until the batch is full or the batching window has passed.
+
+        Args:
+            first (Tuple[str, int, bool, SearchK, Future]): The query that opened the batch.
+
+        Returns:
+            List[Tuple[str, int, bool, SearchK, Future]]: The queries in the batch.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self._batch_window
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop sentinel, put it back so the worker loop sees it after this batch.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _process_batch(self, batch: List[Tuple[str, int, bool, SearchK, Future]]) -> None:
+        """
+        Embed all queries of a batch in one call and resolve every caller's future.
+
+        Args:
+            batch (List[Tuple[str, int, bool, SearchK, Future]]): The queries in the batch.
+        """
+        with self._stats_lock:
+            self._batch_size_counts[len(batch)] += 1
+        try:
+            embeddings = self._query_interface.embed([query for query, _, _, _, _ in batch])
+        except Exception as e:
+            for _, _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (query, n_items, scored, search_k, future), embedding in zip(batch, embeddings):
+            try:
+                if scored:
+                    results = self._query_interface.search_with_scores(embedding, n_items, search_k)
+                    self._query_interface.store_scored_results(query, n_items, *results, search_k=search_k)
+                else:
+                    results = self._query_interface.search(embedding, n_items, search_k)
+                    self._query_interface.store_results(query, n_items, results, search_k)
+                future.set_result(results)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _run(self) -> None:
+        """
+        Worker loop, processes batches until the stop sentinel is received.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._process_batch(self._collect_batch(item))
@@ -1,27 +1,59 @@
+from __future__ import annotations
 from typing import Any, Dict, List, Optional
-import tensorflow_hub as hub
-import tensorflow as tf
+import itertools
+import json
+import os
+import shutil
 import numpy as np
 import pandas as pd
-import tensorflow_text
+from search_engine.embedding_cache import EmbeddingCache
+from search_engine.embedding_store import FlatEmbeddingStore
+from search_engine.passages import PassageMap, iter_passages
+from search_engine.lazy import LazyModule
+
+hub = LazyModule("tensorflow_hub")
+tf = LazyModule("tensorflow")
+
+_MANIFEST_FILE = "manifest.json"
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    """
+    Write a JSON file through a temporary file, so a crash never leaves it half written.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
 
 
 class DataPipeline:
     def __init__(self, model_url: str = "https://tfhub.dev/google/universal-sentence-encoder-multilingual/3",
-                 batch_size: int = 64) -> None:
+                 batch_size: int = 64, embedding_cache_path: Optional[str] = None) -> None:
         """
         Initialize the data pipeline with a TensorFlow Hub model and batch size.
 
         Args:
             model_url (str, optional): URL to the TensorFlow Hub model. Defaults to the multilingual USE.
             batch_size (int, optional): Batch size for dataset processing. Defaults to 64.
+            embedding_cache_path (Optional[str], optional): SQLite file of a persistent EmbeddingCache.
+                `compute_embeddings` then only runs the model on texts not embedded before. Defaults to None.
         """
+        import tensorflow_text  # registers the ops used by the multilingual USE model
         self._batch_size = batch_size
+        self._model_url = model_url
         self._model = hub.load(model_url)
+        self._embedding_cache = None  # type: Optional[EmbeddingCache]
+        if embedding_cache_path is not None:
+            self._embedding_cache = EmbeddingCache(embedding_cache_path, model_url)
         self._dataset = None  # type: Optional[tf.data.Dataset]
         self._embeddings = None  # type: Optional[np.ndarray]
         self._metadata = None  # type: Optional[pd.DataFrame]
         self._texts = None  # type: Optional[List[str]]
+        self._passage_map = None  # type: Optional[PassageMap]
+        self._passage_embeddings = None  # type: Optional[np.ndarray]
+        self._passage_window = (4, 2)
+        self._n_dims = None  # type: Optional[int]
 
     @property
     def embeddings(self) -> Optional[np.ndarray]:
@@ -33,6 +65,36 @@ class DataPipeline:
         """
         return self._embeddings
 
+    @property
+    def passage_map(self) -> Optional[PassageMap]:
+        """
+        Get the mapping of passages to songs computed by `compute_passage_embeddings`.
+
+        Returns:
+            Optional[PassageMap]: The passage map.
+        """
+        return self._passage_map
+
+    @property
+    def passage_embeddings(self) -> Optional[np.ndarray]:
+        """
+        Get the passage embeddings computed by `compute_passage_embeddings`.
+
+        Returns:
+            Optional[np.ndarray]: Array of shape (n_passages, n_dims).
+        """
+        return self._passage_embeddings
+
+    @property
+    def embedding_cache(self) -> Optional[EmbeddingCache]:
+        """
+        Get the persistent embedding cache.
+
+        Returns:
+            Optional[EmbeddingCache]: The cache, or None if not configured.
+        """
+        return self._embedding_cache
+
     @property
     def metadata(self) -> Optional[pd.DataFrame]:
         """
@@ -94,6 +156,9 @@ class DataPipeline:
         """
         if dataset is None:
             dataset = self._dataset
+        if self._embedding_cache is not None:
+            self._embeddings = self._compute_embeddings_cached(dataset, normalize)
+            return self._embeddings
         all_embeddings = []
         for batch in dataset:
             embeddings = self._model(batch)
@@ -103,17 +168,249 @@ class DataPipeline:
         self._embeddings = tf.concat(all_embeddings, axis=0).numpy()
         return self._embeddings
 
-    def save_embeddings(self, file_path: str) -> None:
+    def _compute_embeddings_cached(self, dataset: tf.data.Dataset, normalize: bool) -> np.ndarray:
         """
-        Save the computed embeddings to a TFRecord file along with a schema.
+        Compute embeddings, running the model only on texts missing from the embedding cache.
+        Missing texts are embedded in batches of `batch_size` and stored after every batch,
+        so an interrupted run keeps its progress.
 
         Args:
-            file_path (str): Path to save the TFRecord file.
+            dataset (tf.data.Dataset): Dataset of texts.
+            normalize (bool): Whether to L2 normalize the embeddings.
+
+        Returns:
+            np.ndarray: Array of computed embeddings.
+        """
+        texts = [text.decode() for batch in dataset for text in np.atleast_1d(batch.numpy())]
+        embeddings = self._embed_with_cache(texts)
+        if normalize and len(embeddings):
+            embeddings = tf.nn.l2_normalize(embeddings, axis=1).numpy()
+        return embeddings
+
+    def _embed_with_cache(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts, looking them up in the embedding cache first.
+
+        Args:
+            texts (List[str]): The texts.
+
+        Returns:
+            np.ndarray: Unnormalized embeddings, one row per text.
+        """
+        cached = self._embedding_cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+        computed = {}  # type: Dict[str, np.ndarray]
+        for start in range(0, len(missing), self._batch_size):
+            batch = missing[start:start + self._batch_size]
+            embeddings = np.asarray(self._model(tf.constant(batch)), dtype=np.float32)
+            self._embedding_cache.put_many(batch, embeddings)
+            computed.update(zip(batch, embeddings))
+        print(f"Embedded {len(missing)} new texts, reused {len(texts) - sum(e is None for e in cached)} cached embeddings")
+
+        if not texts:
+            return self._empty_embeddings()
+        return np.stack([computed[text] if embedding is None else embedding
+                         for text, embedding in zip(texts, cached)])
+
+    def _empty_embeddings(self) -> np.ndarray:
+        """
+        Embeddings of no texts, with as many columns as the model outputs, so empty inputs have the same
+        shape with and without the embedding cache. The model is run once on an empty text to find it out.
+
+        Returns:
+            np.ndarray: Empty float32 array of shape (0, n_dims).
+        """
+        if self._n_dims is None:
+            self._n_dims = int(np.asarray(self._model(tf.constant([""]))).shape[-1])
+        return np.empty((0, self._n_dims), dtype=np.float32)
+
+    def _embed_texts(self, texts: List[str], normalize: bool) -> np.ndarray:
+        """
+        Embed a list of texts in batches of `batch_size`, using the embedding cache when configured.
+
+        Args:
+            texts (List[str]): The texts.
+            normalize (bool): Whether to L2 normalize the embeddings.
+
+        Returns:
+            np.ndarray: float32 embeddings, one row per text.
+        """
+        if self._embedding_cache is not None:
+            embeddings = self._embed_with_cache(texts)
+        elif not texts:
+            return self._empty_embeddings()
+        else:
+            embeddings = np.concatenate([
+                np.asarray(self._model(tf.constant(texts[start:start + self._batch_size])), dtype=np.float32)
+                for start in range(0, len(texts), self._batch_size)
+            ])
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if normalize:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def compute_passage_embeddings(self, window_lines: int = 4, stride: int = 2, normalize: bool = True) -> np.ndarray:
+        """
+        Split the loaded lyrics into overlapping windows of lines and embed every window, so long
+        songs are also found by queries matching a single verse. Passages are generated and embedded
+        `batch_size` at a time into a preallocated matrix, only their song ids and line ranges are kept.
+
+        Args:
+            window_lines (int, optional): Lines per passage. Defaults to 4.
+            stride (int, optional): Lines between the starts of consecutive passages. Defaults to 2.
+            normalize (bool, optional): Whether to L2 normalize the embeddings. Defaults to True.
+
+        Returns:
+            np.ndarray: Passage embeddings of shape (n_passages, n_dims), row i belongs to song
+                `passage_map.song_ids[i]`.
+        """
+        if self._texts is None:
+            raise ValueError("No text data available")
+        self._passage_map = PassageMap.build(self._texts, window_lines, stride)
+        self._passage_window = (window_lines, stride)
+        embeddings = None
+        row = 0
+        passages = iter_passages(self._texts, window_lines, stride)
+        while True:
+            batch = [text for _, _, _, text in itertools.islice(passages, self._batch_size)]
+            if not batch:
+                break
+            batch_embeddings = self._embed_texts(batch, normalize)
+            if embeddings is None:
+                embeddings = np.empty((len(self._passage_map), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[row:row + len(batch)] = batch_embeddings
+            row += len(batch)
+        self._passage_embeddings = embeddings if embeddings is not None else self._empty_embeddings()
+        print(f"Embedded {row} passages of {len(self._texts)} songs")
+        return self._passage_embeddings
+
+    def save_passages(self, file_path: str, quantization: Optional[str] = None) -> None:
+        """
+        Save the passage embeddings as a flat embedding store, with the passage texts and the song id
+        and line range of every passage as metadata. Open it with `PassageBackend.from_store`.
+
+        Args:
+            file_path (str): Path to the store directory.
+            quantization (Optional[str], optional): Also store "int8" or "float16" quantized embeddings.
+                Defaults to None.
+        """
+        if self._passage_embeddings is None or self._passage_map is None:
+            raise ValueError("No passage embeddings to write")
+        metadata = pd.DataFrame({
+            'song_id': self._passage_map.song_ids,
+            'line_start': self._passage_map.line_starts,
+            'line_end': self._passage_map.line_ends,
+        })
+        # Passage texts are generated again instead of being kept in memory
+        texts = (text for _, _, _, text in iter_passages(self._texts, *self._passage_window))
+        FlatEmbeddingStore.write(file_path, self._passage_embeddings, texts, metadata, quantization)
+        print(f"Saved {len(self._passage_map)} passages to {file_path}")
+
+    def embed_tsv_in_chunks(self, file_path: str, output_path: str, text_column: str = "Lyrics",
+                            metadata_columns: Optional[List[str]] = None, chunk_size: int = 10000,
+                            normalize: bool = True, quantization: Optional[str] = None,
+                            keep_shards: bool = False) -> np.ndarray:
+        """
+        Embed a TSV file that does not fit in memory and write the result as a flat embedding store.
+
+        The file is read `chunk_size` rows at a time. Every chunk is embedded and written straight
+        to its own shard, a flat store in `output_path/shards`, and recorded in `output_path/manifest.json`.
+        Only one chunk is held in memory. An interrupted run resumes after the last written shard.
+        When all chunks are done the shards are merged block by block into the store at `output_path`,
+        which is then loaded like `load_embeddings` does.
+
+        Args:
+            file_path (str): Path to the TSV file.
+            output_path (str): Directory of the resulting flat embedding store.
+            text_column (str, optional): Column name for text. Defaults to "Lyrics".
+            metadata_columns (Optional[List[str]], optional): List of metadata column names. Defaults to None,
+                which stores the row number as the `index` column.
+            chunk_size (int, optional): Rows read, embedded and written at once. Defaults to 10000.
+            normalize (bool, optional): Whether to L2 normalize the embeddings. Defaults to True.
+            quantization (Optional[str], optional): Also store "int8" or "float16" quantized embeddings
+                in the merged store. Defaults to None.
+            keep_shards (bool, optional): Keep the shards after merging. Defaults to False.
+
+        Returns:
+            np.ndarray: The memory-mapped embeddings of the merged store.
+        """
+        metadata_columns = list(metadata_columns or [])
+        settings = {
+            'source': os.path.abspath(file_path),
+            'source_size': os.path.getsize(file_path),
+            'model_url': self._model_url,
+            'text_column': text_column,
+            'metadata_columns': metadata_columns,
+            'chunk_size': chunk_size,
+            'normalize': normalize,
+        }
+        manifest_path = os.path.join(output_path, _MANIFEST_FILE)
+        shards_dir = os.path.join(output_path, "shards")
+        manifest = {**settings, 'shards': [], 'rows': 0, 'merged': False}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                previous = json.load(f)
+            if {key: previous.get(key) for key in settings} != settings:
+                raise ValueError(f"{output_path} holds a run with different settings, remove it to start over")
+            manifest = previous
+            if manifest['merged'] and FlatEmbeddingStore.is_flat_store(output_path):
+                return self._load_flat_embeddings(output_path)
+            print(f"Resuming after {len(manifest['shards'])} chunks, {manifest['rows']} rows")
+        os.makedirs(shards_dir, exist_ok=True)
+
+        reader = pd.read_csv(file_path, sep="\t", usecols=[text_column] + metadata_columns, encoding="utf-8",
+                             chunksize=chunk_size)
+        for chunk_number, chunk in enumerate(reader):
+            if chunk_number < len(manifest['shards']):
+                continue  # Written by an earlier run
+            texts = chunk[text_column].astype(str).tolist()
+            if metadata_columns:
+                metadata = chunk[metadata_columns].reset_index(drop=True)
+            else:
+                metadata = pd.DataFrame({'index': np.arange(manifest['rows'], manifest['rows'] + len(texts))})
+            embeddings = self._embed_texts(texts, normalize)
+            shard_name = f"shard-{chunk_number:06d}"
+            FlatEmbeddingStore.write(os.path.join(shards_dir, shard_name), embeddings, texts, metadata)
+            manifest['shards'].append(shard_name)
+            manifest['rows'] += len(texts)
+            _write_json_atomic(manifest_path, manifest)
+            print(f"Embedded chunk {chunk_number}, {manifest['rows']} rows so far")
+
+        if not manifest['shards']:
+            raise ValueError(f"No rows in {file_path}")
+        FlatEmbeddingStore.merge(output_path, [os.path.join(shards_dir, name) for name in manifest['shards']],
+                                 quantization=quantization)
+        manifest['merged'] = True
+        _write_json_atomic(manifest_path, manifest)
+        if not keep_shards:
+            shutil.rmtree(shards_dir)
+        print(f"Merged {len(manifest['shards'])} chunks into {output_path}")
+        return self._load_flat_embeddings(output_path)
+
+    def save_embeddings(self, file_path: str, fmt: str = "tfrecord", quantization: Optional[str] = None) -> None:
+        """
+        Save the computed embeddings to a TFRecord file along with a schema, or to a flat
+        embedding store directory that can be loaded back with memory mapping.
+
+        Args:
+            file_path (str): Path to save the TFRecord file, or the store directory for the flat format.
+            fmt (str, optional): Either "tfrecord" or "flat". Defaults to "tfrecord".
+            quantization (Optional[str], optional): For the flat format, also store "int8" or "float16"
+                quantized embeddings. Defaults to None.
         """
         if self._embeddings is None:
             raise ValueError("No embeddings to write")
         if self._texts is None:
             raise ValueError("No text data available")
+        if fmt not in ("tfrecord", "flat"):
+            raise ValueError(f"Unknown embeddings format: {fmt}")
+        if quantization is not None and fmt != "flat":
+            raise ValueError("Quantization is only supported by the flat format")
+
+        if fmt == "flat":
+            FlatEmbeddingStore.write(file_path, self._embeddings, self._texts, self._metadata, quantization)
+            print(f"Saved embedding to {file_path} in flat format")
+            return
 
         import os
         os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
@@ -154,13 +451,17 @@ class DataPipeline:
     def load_embeddings(self, file_path: str) -> np.ndarray:
         """
         Load embeddings and metadata from a TFRecord file using the associated schema.
+        Flat embedding store directories are memory-mapped instead of parsed.
 
         Args:
-            file_path (str): Path to the TFRecord file.
+            file_path (str): Path to the TFRecord file or flat embedding store directory.
 
         Returns:
             np.ndarray: The loaded embeddings array.
         """
+        if FlatEmbeddingStore.is_flat_store(file_path):
+            return self._load_flat_embeddings(file_path)
+
         import json
         schema_path = file_path + '.schema.json'
         with open(schema_path, 'r') as f:
@@ -215,6 +516,24 @@ class DataPipeline:
 
         return self._embeddings
 
+    def _load_flat_embeddings(self, store_path: str) -> np.ndarray:
+        """
+        Load embeddings, texts and metadata from a flat embedding store. The embeddings
+        are a read-only memory map and texts are decoded lazily on access.
+
+        Args:
+            store_path (str): Path to the store directory.
+
+        Returns:
+            np.ndarray: The memory-mapped embeddings array.
+        """
+        store = FlatEmbeddingStore(store_path)
+        self._embeddings = store.embeddings
+        self._metadata = store.metadata
+        self._texts = store.texts
+        print(f"Loaded embeddings of shape: {self._embeddings.shape}")
+        return self._embeddings
+
     def _create_example(self, text: str, embedding: np.ndarray, metadata_row: Any) -> bytes:
         """
         Create a serialized tf.Example for a single record.
@@ -0,0 +1,550 @@
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple
+import os
+import threading
+from annoy import AnnoyIndex
+import numpy as np
+from search_engine.passages import PassageBackend
+from search_engine.search_backends import (AnnoyBackend, ExactBackend, QuantizedBackend, SearchBackend, SearchK,
+                                          _normalize, _top_k)
+
+
+class DeltaIndex:
+    def __init__(self, n_dims: int = 512, capacity: int = 1024) -> None:
+        """
+        Initialize a small mutable segment of embeddings searched exactly, next to an immutable main index.
+
+        Items are added or replaced by id and can be marked as removed with tombstones. Embeddings are kept
+        in one preallocated float32 matrix that doubles when full, so adding an item does not copy the segment.
+
+        Args:
+            n_dims (int, optional): Dimensionality of the embeddings. Defaults to 512.
+            capacity (int, optional): Initial number of preallocated rows. Defaults to 1024.
+        """
+        self._n_dims = n_dims
+        self._embeddings = np.empty((max(capacity, 1), n_dims), dtype=np.float32)
+        self._ids = np.empty(max(capacity, 1), dtype=np.int64)
+        self._size = 0
+        self._rows = {}  # type: dict
+        self._tombstones = frozenset()  # type: FrozenSet[int]
+        self._lock = threading.Lock()
+
+    @property
+    def n_dims(self) -> int:
+        """
+        Get the dimensionality of the embeddings.
+
+        Returns:
+            int: The dimensionality.
+        """
+        return self._n_dims
+
+    @property
+    def tombstones(self) -> FrozenSet[int]:
+        """
+        Get the ids of removed items.
+
+        Returns:
+            FrozenSet[int]: The removed ids.
+        """
+        return self._tombstones
+
+    def add(self, item_ids: Iterable[int], embeddings: np.ndarray) -> None:
+        """
+        Add items to the segment. Items already in the segment are replaced, and re-added items
+        lose their tombstone.
+
+        Args:
+            item_ids (Iterable[int]): Ids of the items, e.g. `Song.index`.
+            embeddings (np.ndarray): Embeddings of shape (len(item_ids), n_dims), normalized on insertion.
+        """
+        item_ids = [int(item_id) for item_id in item_ids]
+        embeddings = _normalize(np.asarray(embeddings).reshape(-1, self._n_dims))
+        if len(item_ids) != embeddings.shape[0]:
+            raise ValueError("Expected one embedding per item id")
+        with self._lock:
+            for item_id, embedding in zip(item_ids, embeddings):
+                row = self._rows.get(item_id)
+                if row is None:
+                    if self._size == self._ids.shape[0]:
+                        self._grow()
+                    row = self._size
+                    self._ids[row] = item_id
+                    self._rows[item_id] = row
+                    self._size += 1
+                self._embeddings[row] = embedding
+            self._tombstones = self._tombstones.difference(item_ids)
+
+    def _grow(self) -> None:
+        """
+        Double the preallocated capacity. Searches running on the old arrays are not affected.
+        """
+        embeddings = np.empty((2 * self._ids.shape[0], self._n_dims), dtype=np.float32)
+        embeddings[:self._size] = self._embeddings[:self._size]
+        ids = np.empty(2 * self._ids.shape[0], dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._embeddings, self._ids = embeddings, ids
+
+    def remove(self, item_ids: Iterable[int]) -> None:
+        """
+        Mark items as removed. Removed items are filtered from search results of the main index and the segment.
+
+        Args:
+            item_ids (Iterable[int]): Ids of the removed items.
+        """
+        with self._lock:
+            self._tombstones = self._tombstones.union(int(item_id) for item_id in item_ids)
+
+    def set_tombstones(self, item_ids: Iterable[int]) -> bool:
+        """
+        Replace all tombstones, e.g. with the ids of songs flagged as removed in the database.
+
+        Args:
+            item_ids (Iterable[int]): Ids of all removed items.
+
+        Returns:
+            bool: True if the tombstones changed.
+        """
+        tombstones = frozenset(int(item_id) for item_id in item_ids)
+        with self._lock:
+            changed = tombstones != self._tombstones
+            self._tombstones = tombstones
+        return changed
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Copy the items currently in the segment.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Item ids and their embeddings.
+        """
+        with self._lock:
+            return self._ids[:self._size].copy(), self._embeddings[:self._size].copy()
+
+    def discard(self, item_ids: np.ndarray, embeddings: np.ndarray) -> int:
+        """
+        Drop items that have been moved to the main index. Items replaced since `embeddings`
+        were taken are kept, so updates made during a compaction are not lost.
+
+        Args:
+            item_ids (np.ndarray): Ids returned by `snapshot`.
+            embeddings (np.ndarray): Embeddings returned by `snapshot`.
+
+        Returns:
+            int: Number of dropped items.
+        """
+        with self._lock:
+            dropped = set()
+            for item_id, embedding in zip(item_ids.tolist(), embeddings):
+                row = self._rows.get(item_id)
+                if row is not None and np.array_equal(self._embeddings[row], embedding):
+                    dropped.add(row)
+            if not dropped:
+                return 0
+            keep = np.array([row for row in range(self._size) if row not in dropped], dtype=np.int64)
+            capacity = max(self._ids.shape[0], 1)
+            ids = np.empty(capacity, dtype=np.int64)
+            ids[:len(keep)] = self._ids[keep]
+            embeddings = np.empty((capacity, self._n_dims), dtype=np.float32)
+            embeddings[:len(keep)] = self._embeddings[keep]
+            # New arrays instead of compacting in place, searches may still read the old ones.
+            self._ids, self._embeddings, self._size = ids, embeddings, len(keep)
+            self._rows = {item_id: row for row, item_id in enumerate(ids[:len(keep)].tolist())}
+            return len(dropped)
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5) -> Tuple[List[int], List[float]]:
+        """
+        Find the items of the segment closest to a query embedding. Tombstones are not applied.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+
+        Returns:
+            Tuple[List[int], List[float]]: Ids of the nearest items, closest first, and their cosine similarities.
+        """
+        with self._lock:
+            ids, embeddings = self._ids[:self._size], self._embeddings[:self._size]
+        if ids.shape[0] == 0:
+            return [], []
+        scores = embeddings @ _normalize(query_embedding)
+        top = _top_k(scores, n_items)
+        return ids[top].tolist(), scores[top].tolist()
+
+    def save(self, path: str) -> None:
+        """
+        Save the items and tombstones to a .npz file. The file is replaced atomically.
+
+        Args:
+            path (str): Path to the .npz file.
+        """
+        ids, embeddings = self.snapshot()
+        tombstones = np.array(sorted(self._tombstones), dtype=np.int64)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, ids=ids, embeddings=embeddings, tombstones=tombstones)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DeltaIndex":
+        """
+        Load a segment saved with `save`.
+
+        Args:
+            path (str): Path to the .npz file.
+
+        Returns:
+            DeltaIndex: The loaded segment.
+        """
+        with np.load(path) as data:
+            delta = cls(n_dims=data['embeddings'].shape[1], capacity=max(1024, 2 * data['ids'].shape[0]))
+            delta.add(data['ids'], data['embeddings'])
+            delta.remove(data['tombstones'])
+        return delta
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._rows
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class DeltaBackend(SearchBackend):
+    def __init__(self, main: SearchBackend, delta: Optional[DeltaIndex] = None, compaction_threshold: int = 1000,
+                 n_trees: int = 100, n_jobs: Optional[int] = None, index_path: Optional[str] = None,
+                 delta_path: Optional[str] = None, max_overfetch: int = 100) -> None:
+        """
+        Search backend merging an immutable main backend with a mutable DeltaIndex.
+
+        Both are searched for every query and the results are merged by cosine similarity. Items in the
+        delta replace the main index items with the same id, and tombstoned items are filtered from both.
+        Once the delta holds `compaction_threshold` items, a background thread rebuilds the main index with
+        them and swaps it in, while queries keep being served by the old one.
+
+        Args:
+            main (SearchBackend): The main backend. Compaction is supported for Annoy and exact backends.
+            delta (Optional[DeltaIndex], optional): The mutable segment. Defaults to an empty one.
+            compaction_threshold (int, optional): Delta size that triggers a compaction, 0 disables
+                automatic compaction. Defaults to 1000.
+            n_trees (int, optional): Number of trees of a rebuilt Annoy index. Defaults to 100.
+            n_jobs (Optional[int], optional): Threads used to build a rebuilt Annoy index. Defaults to None.
+            index_path (Optional[str], optional): Where a rebuilt Annoy index is saved. Defaults to None.
+            delta_path (Optional[str], optional): Where the delta is saved after every change. Defaults to None.
+            max_overfetch (int, optional): Maximum number of extra main index results fetched to make up
+                for filtered items. Defaults to 100.
+        """
+        if delta is None:
+            delta = DeltaIndex(n_dims=_backend_dims(main))
+        elif delta.n_dims != _backend_dims(main):
+            raise ValueError(f"Delta has {delta.n_dims} dimensions, the main backend {_backend_dims(main)}")
+        self._main = main
+        self._delta = delta
+        self._compaction_threshold = compaction_threshold
+        self._n_trees = n_trees
+        self._n_jobs = n_jobs
+        self._index_path = index_path
+        self._delta_path = delta_path
+        self._max_overfetch = max_overfetch
+        self._update_listeners = []  # type: List[Callable[[], None]]
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None  # type: Optional[threading.Thread]
+        self._compactions = 0
+
+    @property
+    def main(self) -> SearchBackend:
+        """
+        Get the current main backend, replaced by every compaction.
+
+        Returns:
+            SearchBackend: The main backend.
+        """
+        return self._main
+
+    @property
+    def delta(self) -> DeltaIndex:
+        """
+        Get the mutable segment.
+
+        Returns:
+            DeltaIndex: The delta index.
+        """
+        return self._delta
+
+    @property
+    def compactions(self) -> int:
+        """
+        Get the number of finished compactions.
+
+        Returns:
+            int: The number of compactions.
+        """
+        return self._compactions
+
+    @property
+    def next_item_id(self) -> int:
+        """
+        Get the smallest id larger than every id of the main index and the delta.
+
+        Returns:
+            int: The next free item id.
+        """
+        ids, _ = self._delta.snapshot()
+        return max(len(self._main), int(ids.max()) + 1 if len(ids) else 0)
+
+    def add_update_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a callback invoked whenever search results may change, e.g. to invalidate cached results.
+
+        Args:
+            listener (Callable[[], None]): Callback without arguments.
+        """
+        self._update_listeners.append(listener)
+
+    def _notify_update(self) -> None:
+        for listener in self._update_listeners:
+            listener()
+
+    def add(self, item_ids: Iterable[int], embeddings: np.ndarray) -> None:
+        """
+        Add or replace items, starting a background compaction once the delta is large enough.
+
+        Args:
+            item_ids (Iterable[int]): Ids of the items.
+            embeddings (np.ndarray): Embeddings of shape (len(item_ids), n_dims).
+        """
+        self._delta.add(item_ids, embeddings)
+        self._save_delta()
+        self._notify_update()
+        if 0 < self._compaction_threshold <= len(self._delta) and self.can_compact:
+            self.start_compaction()
+
+    def remove(self, item_ids: Iterable[int]) -> None:
+        """
+        Mark items as removed.
+
+        Args:
+            item_ids (Iterable[int]): Ids of the removed items.
+        """
+        self._delta.remove(item_ids)
+        self._save_delta()
+        self._notify_update()
+
+    def set_tombstones(self, item_ids: Iterable[int]) -> None:
+        """
+        Replace all tombstones, e.g. with the ids of songs flagged as removed in the database.
+        The delta file is not written, the tombstones are reloaded from their source anyway and
+        other processes may read the file.
+
+        Args:
+            item_ids (Iterable[int]): Ids of all removed items.
+        """
+        if self._delta.set_tombstones(item_ids):
+            self._notify_update()
+
+    def _save_delta(self) -> None:
+        if self._delta_path is not None:
+            self._delta.save(self._delta_path)
+
+    def _overfetch(self) -> int:
+        # Extra main index results fetched to make up for tombstoned and shadowed items
+        return min(len(self._delta.tombstones) + len(self._delta), self._max_overfetch)
+
+    def _merge(self, query_embedding: np.ndarray, n_items: int, main_ids: List[int], main_scores: List[float],
+               main_passages: List[int]) -> Tuple[List[int], List[float], List[int]]:
+        """
+        Merge the main index results of a query with the delta by cosine similarity, dropping tombstoned items.
+
+        Returns:
+            Tuple[List[int], List[float], List[int]]: Indices, similarities and passage ids of the best items.
+        """
+        tombstones = self._delta.tombstones
+        delta_ids, delta_scores = self._delta.search_with_scores(query_embedding, n_items + len(tombstones))
+        # Songs in the delta are embedded whole, they have no passage
+        candidates = [(score, item_id, -1) for item_id, score in zip(delta_ids, delta_scores)
+                      if item_id not in tombstones]
+        candidates.extend((score, item_id, passage_id)
+                          for item_id, score, passage_id in zip(main_ids, main_scores, main_passages)
+                          if item_id not in tombstones and item_id not in self._delta)
+        candidates.sort(key=lambda candidate: -candidate[0])
+        candidates = candidates[:n_items]
+        return ([item_id for _, item_id, _ in candidates], [score for score, _, _ in candidates],
+                [passage_id for _, _, passage_id in candidates])
+
+    def search_with_passages(self, query_embedding: np.ndarray, n_items: int = 5,
+                             search_k: SearchK = None) -> Tuple[List[int], List[float], List[int]]:
+        if len(self._delta) == 0 and not self._delta.tombstones:
+            return self._main.search_with_passages(query_embedding, n_items, search_k)
+        main_ids, main_scores, main_passages = self._main.search_with_passages(
+            query_embedding, n_items + self._overfetch(), search_k)
+        return self._merge(query_embedding, n_items, main_ids, main_scores, main_passages)
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        if len(self._delta) == 0 and not self._delta.tombstones:
+            return self._main.search_with_scores(query_embedding, n_items, search_k)
+        item_ids, scores, _ = self.search_with_passages(query_embedding, n_items, search_k)
+        return item_ids, scores
+
+    def resolve_search_k(self, search_k: SearchK, n_items: int = 5) -> SearchK:
+        # The main backend may be searched for more items than requested, presets are kept unresolved
+        return None if self._main.resolve_search_k(search_k, n_items) is None else search_k
+
+    def passage_text(self, passage_id: int) -> Optional[str]:
+        return self._main.passage_text(passage_id)
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        return self.search_with_scores(query_embedding, n_items, search_k)[0]
+
+    def search_batch_with_scores(self, query_embeddings: np.ndarray, n_items: int = 5,
+                                 search_k: SearchK = None) -> List[Tuple[List[int], List[float]]]:
+        if len(self._delta) == 0 and not self._delta.tombstones:
+            return self._main.search_batch_with_scores(query_embeddings, n_items, search_k)
+        # One batched search of the main index, the small delta is merged query by query
+        main_results = self._main.search_batch_with_scores(query_embeddings, n_items + self._overfetch(), search_k)
+        merged = []
+        for query_embedding, (main_ids, main_scores) in zip(query_embeddings, main_results):
+            item_ids, scores, _ = self._merge(query_embedding, n_items, main_ids, main_scores, [-1] * len(main_ids))
+            merged.append((item_ids, scores))
+        return merged
+
+    def search_batch(self, query_embeddings: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[List[int]]:
+        if len(self._delta) == 0 and not self._delta.tombstones:
+            return self._main.search_batch(query_embeddings, n_items, search_k)
+        return [item_ids for item_ids, _ in self.search_batch_with_scores(query_embeddings, n_items, search_k)]
+
+    @property
+    def can_compact(self) -> bool:
+        """
+        Check whether the main backend can be rebuilt with the delta.
+
+        Returns:
+            bool: True for Annoy and exact main backends.
+        """
+        return isinstance(self._main, (AnnoyBackend, ExactBackend))
+
+    def start_compaction(self) -> bool:
+        """
+        Start a compaction in a background thread, unless one is already running.
+
+        Returns:
+            bool: True if a new compaction was started.
+        """
+        with self._compaction_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(target=self._compact_in_background,
+                                                       name="delta-compaction", daemon=True)
+            self._compaction_thread.start()
+            return True
+
+    def wait_for_compaction(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a running background compaction to finish.
+
+        Args:
+            timeout (Optional[float], optional): Seconds to wait. Defaults to None.
+        """
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Delta compaction failed: {e}")
+
+    def compact(self) -> int:
+        """
+        Rebuild the main index with the items of the delta and swap it in. Tombstoned items stay
+        in the rebuilt index, so item ids keep matching `Song.index`, and remain filtered.
+
+        Returns:
+            int: Number of items moved from the delta to the main index.
+        """
+        if not self.can_compact:
+            raise TypeError(f"Compaction is not supported for {type(self._main).__name__}")
+        item_ids, embeddings = self._delta.snapshot()
+        if len(item_ids) == 0:
+            return 0
+        print(f"Compacting {len(item_ids)} items into the main index")
+        if isinstance(self._main, AnnoyBackend):
+            main = self._rebuild_annoy(self._main.annoy_index, item_ids, embeddings)
+        else:
+            main = self._rebuild_exact(self._main.embeddings, item_ids, embeddings)
+        # Until the delta is discarded, its items shadow the identical ones of the new main index.
+        self._main = main
+        moved = self._delta.discard(item_ids, embeddings)
+        self._save_delta()
+        self._compactions += 1
+        self._notify_update()
+        return moved
+
+    def _rebuild_annoy(self, index: AnnoyIndex, item_ids: np.ndarray, embeddings: np.ndarray) -> AnnoyBackend:
+        """
+        Build a new Annoy index from the vectors of the old one and the delta.
+
+        Args:
+            index (AnnoyIndex): The current main index.
+            item_ids (np.ndarray): Ids of the delta items.
+            embeddings (np.ndarray): Embeddings of the delta items.
+
+        Returns:
+            AnnoyBackend: Backend over the new index, saved to `index_path` if set.
+        """
+        rebuilt = AnnoyIndex(index.f, "angular")
+        replaced = set(item_ids.tolist())
+        for item_id in range(index.get_n_items()):
+            if item_id not in replaced:
+                rebuilt.add_item(item_id, index.get_item_vector(item_id))
+        for item_id, embedding in zip(item_ids.tolist(), embeddings):
+            rebuilt.add_item(item_id, embedding.tolist())
+        if self._n_jobs is None:
+            rebuilt.build(self._n_trees)
+        else:
+            rebuilt.build(self._n_trees, n_jobs=self._n_jobs)
+        if self._index_path is not None:
+            tmp_path = self._index_path + ".tmp"
+            rebuilt.save(tmp_path)
+            os.replace(tmp_path, self._index_path)
+        return AnnoyBackend(rebuilt)
+
+    @staticmethod
+    def _rebuild_exact(matrix: np.ndarray, item_ids: np.ndarray, embeddings: np.ndarray) -> ExactBackend:
+        """
+        Build a new embedding matrix with the delta rows written at their ids. Missing rows are zero.
+
+        Args:
+            matrix (np.ndarray): The current embedding matrix.
+            item_ids (np.ndarray): Ids of the delta items.
+            embeddings (np.ndarray): Normalized embeddings of the delta items.
+
+        Returns:
+            ExactBackend: Backend over the new matrix.
+        """
+        rebuilt = np.zeros((max(matrix.shape[0], int(item_ids.max()) + 1), matrix.shape[1]), dtype=np.float32)
+        rebuilt[:matrix.shape[0]] = matrix
+        rebuilt[item_ids] = embeddings
+        return ExactBackend(rebuilt)
+
+    def __len__(self) -> int:
+        return len(self._main) + len(self._delta)
+
+
+def _backend_dims(backend: SearchBackend) -> int:
+    """
+    Get the embedding dimensionality of a backend.
+
+    Args:
+        backend (SearchBackend): The backend.
+
+    Returns:
+        int: The dimensionality.
+    """
+    if isinstance(backend, AnnoyBackend):
+        return backend.annoy_index.f
+    if isinstance(backend, ExactBackend):
+        return int(backend.embeddings.shape[1])
+    if isinstance(backend, QuantizedBackend):
+        return int(backend.codes.shape[1])
+    if isinstance(backend, PassageBackend):
+        return _backend_dims(backend.passage_backend)
+    raise ValueError(f"Cannot determine the dimensionality of {type(backend).__name__}, pass a DeltaIndex")
@@ -0,0 +1,152 @@
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before hashing, so equivalent encodings of the same lyrics share a cache entry.
+    Applies Unicode NFC normalization, unifies line endings and strips surrounding whitespace.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_url: str, chunk_size: int = 500) -> None:
+        """
+        Open a persistent, content-addressed cache of text embeddings stored in an SQLite file.
+
+        Entries are keyed by the SHA-256 of the model URL and the normalized text, so a text is embedded
+        only once per model, no matter where it appears in the corpus or how often the corpus is rebuilt.
+
+        Args:
+            path (str): Path to the SQLite file, created if missing.
+            model_url (str): URL of the model the embeddings are computed with.
+            chunk_size (int, optional): Maximum number of keys per SQL statement. Defaults to 500.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._path = path
+        self._model_url = model_url
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._connection.commit()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def path(self) -> str:
+        """
+        Get the path to the SQLite file.
+
+        Returns:
+            str: The path.
+        """
+        return self._path
+
+    @property
+    def model_url(self) -> str:
+        """
+        Get the model URL that is part of every key.
+
+        Returns:
+            str: The model URL.
+        """
+        return self._model_url
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the number of lookups that found or missed an embedding.
+
+        Returns:
+            Dict[str, int]: Hits, misses and the number of stored embeddings.
+        """
+        with self._lock:
+            hits, misses = self._hits, self._misses
+        return {'hits': hits, 'misses': misses, 'size': len(self)}
+
+    def key(self, text: str) -> bytes:
+        """
+        Compute the cache key of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            bytes: SHA-256 digest of the model URL and the normalized text.
+        """
+        digest = hashlib.sha256(self._model_url.encode())
+        digest.update(b"\0")
+        digest.update(normalize_text(text).encode())
+        return digest.digest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up the embeddings of several texts.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            List[Optional[np.ndarray]]: float32 embedding per text, or None where it is not cached.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}  # type: Dict[bytes, np.ndarray]
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), self._chunk_size):
+                chunk = unique_keys[start:start + self._chunk_size]
+                rows = self._connection.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for key, embedding in rows:
+                    found[key] = np.frombuffer(embedding, dtype=np.float32)
+            results = [found.get(key) for key in keys]
+            hits = sum(result is not None for result in results)
+            self._hits += hits
+            self._misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: Sequence[str], embeddings: np.ndarray) -> None:
+        """
+        Store the embeddings of several texts in one transaction.
+
+        Args:
+            texts (Sequence[str]): The texts.
+            embeddings (np.ndarray): Embeddings of shape (len(texts), n_dims).
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(texts) != len(embeddings):
+            raise ValueError("Expected one embedding per text")
+        rows = [(self.key(text), embedding.tobytes()) for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+
+    def close(self) -> None:
+        """
+        Close the SQLite connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
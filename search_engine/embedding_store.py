@@ -0,0 +1,426 @@
+from __future__ import annotations
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence, Union
+import json
+import os
+import shutil
+
+import numpy as np
+from search_engine.lazy import LazyModule
+from search_engine.quantization import ScalarQuantizer
+
+# Only needed for the metadata DataFrame, the search path never imports pandas.
+pd = LazyModule("pandas")
+
+_SCHEMA_FILE = "schema.json"
+_EMBEDDINGS_FILE = "embeddings.npy"
+_TEXTS_FILE = "texts.bin"
+_TEXT_OFFSETS_FILE = "texts.offsets.npy"
+_QUANTIZATION_SCALE_FILE = "quantization.scale.npy"
+_STORE_FORMAT = "flat"
+
+
+class TextColumn(Sequence):
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        """
+        Read-only sequence of strings stored as one UTF-8 blob and an array of offsets.
+        Strings are decoded only when accessed, so opening a memory-mapped column costs nothing.
+
+        Args:
+            data (np.ndarray): Array of uint8 holding all strings encoded one after another.
+            offsets (np.ndarray): Array of n + 1 int64 offsets, string i is data[offsets[i]:offsets[i + 1]].
+        """
+        self._data = data
+        self._offsets = offsets
+
+    @classmethod
+    def open(cls, data_path: str, offsets_path: str) -> "TextColumn":
+        """
+        Memory-map a text column written by `TextColumn.write`.
+
+        Args:
+            data_path (str): Path to the UTF-8 blob.
+            offsets_path (str): Path to the .npy file with offsets.
+
+        Returns:
+            TextColumn: The memory-mapped column.
+        """
+        offsets = np.load(offsets_path, mmap_mode='r')
+        if os.path.getsize(data_path) == 0:
+            data = np.empty(0, dtype=np.uint8)
+        else:
+            data = np.memmap(data_path, dtype=np.uint8, mode='r')
+        return cls(data, offsets)
+
+    @staticmethod
+    def write(texts: Iterable[str], data_path: str, offsets_path: str) -> int:
+        """
+        Write strings as a UTF-8 blob and an offsets array, one string at a time.
+
+        Args:
+            texts (Iterable[str]): Strings to write.
+            data_path (str): Path to the UTF-8 blob.
+            offsets_path (str): Path to the .npy file with offsets.
+
+        Returns:
+            int: Number of written strings.
+        """
+        with TextColumnWriter(data_path, offsets_path) as writer:
+            for text in texts:
+                writer.append(text)
+        return len(writer)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("TextColumn index out of range")
+        start, end = self._offsets[item], self._offsets[item + 1]
+        return bytes(self._data[start:end]).decode()
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class TextColumnWriter:
+    def __init__(self, data_path: str, offsets_path: str) -> None:
+        """
+        Incrementally write a text column readable with `TextColumn.open`. Strings are appended to
+        the blob as they come, only the offsets are kept in memory until the writer is closed.
+
+        Args:
+            data_path (str): Path to the UTF-8 blob.
+            offsets_path (str): Path to the .npy file with offsets.
+        """
+        self._offsets_path = offsets_path
+        self._offsets = array('q', [0])
+        self._file = open(data_path, 'wb')
+
+    def append(self, text: str) -> None:
+        """
+        Append one string.
+
+        Args:
+            text (str): The string.
+        """
+        encoded = str(text).encode()
+        self._file.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+
+    def close(self) -> None:
+        """
+        Close the blob and save the offsets.
+        """
+        if not self._file.closed:
+            self._file.close()
+            np.save(self._offsets_path, np.frombuffer(self._offsets, dtype=np.int64))
+
+    def __enter__(self) -> "TextColumnWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+class FlatEmbeddingStore:
+    def __init__(self, path: str) -> None:
+        """
+        Open a flat embedding store written by `FlatEmbeddingStore.write`.
+
+        The store is a directory with a contiguous float32 embedding matrix saved as .npy,
+        the texts as a UTF-8 blob with offsets, one .npy file per metadata column and a schema.
+        Everything is memory-mapped, so opening a store does not read the data.
+
+        Args:
+            path (str): Path to the store directory.
+        """
+        self._path = path
+        with open(os.path.join(path, _SCHEMA_FILE), 'r') as f:
+            self._schema = json.load(f)
+        if self._schema.get('format') != _STORE_FORMAT:
+            raise ValueError(f"{path} is not a flat embedding store")
+        self._embeddings = np.load(os.path.join(path, _EMBEDDINGS_FILE), mmap_mode='r')
+        self._texts = None  # type: Optional[TextColumn]
+        if self._schema.get('has_text', False):
+            self._texts = TextColumn.open(os.path.join(path, _TEXTS_FILE), os.path.join(path, _TEXT_OFFSETS_FILE))
+        self._quantizer = None  # type: Optional[ScalarQuantizer]
+        self._quantized_embeddings = None  # type: Optional[np.ndarray]
+        mode = self._schema.get('quantization')
+        if mode is not None:
+            scale = None
+            if mode == "int8":
+                scale = np.load(os.path.join(path, _QUANTIZATION_SCALE_FILE))
+            self._quantizer = ScalarQuantizer(mode, scale)
+            self._quantized_embeddings = np.load(os.path.join(path, f'embeddings.{mode}.npy'), mmap_mode='r')
+
+    @staticmethod
+    def is_flat_store(path: str) -> bool:
+        """
+        Check whether a path points to a flat embedding store.
+
+        Args:
+            path (str): Path to check.
+
+        Returns:
+            bool: True if the path is a store directory.
+        """
+        return os.path.isdir(path) and os.path.exists(os.path.join(path, _SCHEMA_FILE))
+
+    @classmethod
+    def write(cls, path: str, embeddings: np.ndarray, texts: Optional[Iterable[str]] = None,
+              metadata: Optional[pd.DataFrame] = None, quantization: Optional[str] = None) -> "FlatEmbeddingStore":
+        """
+        Write embeddings, texts and metadata as a flat embedding store.
+
+        Args:
+            path (str): Path to the store directory, created if missing.
+            embeddings (np.ndarray): Embedding matrix of shape (n, n_dims), saved as float32.
+            texts (Optional[Iterable[str]], optional): Texts, one per embedding. Defaults to None.
+            metadata (Optional[pd.DataFrame], optional): Metadata, one row per embedding. Defaults to None.
+            quantization (Optional[str], optional): Also store scalar quantized embeddings, "int8" or "float16",
+                together with the quantization parameters. Defaults to None.
+
+        Returns:
+            FlatEmbeddingStore: The written store, opened for reading.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2:
+            raise ValueError("Embeddings must be a 2D matrix")
+        if metadata is not None and len(metadata) != len(embeddings):
+            raise ValueError("Metadata must have one row per embedding")
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, _SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+
+        np.save(os.path.join(path, _EMBEDDINGS_FILE), embeddings)
+        schema = {
+            'format': _STORE_FORMAT,
+            'version': 1,
+            'count': int(embeddings.shape[0]),
+            'embedding_size': int(embeddings.shape[1]),
+            'has_text': texts is not None,
+            'metadata_columns': [],
+        }
+        if quantization is not None:
+            quantizer = ScalarQuantizer(quantization).fit(embeddings)
+            np.save(os.path.join(path, f'embeddings.{quantization}.npy'), quantizer.encode(embeddings))
+            if quantizer.scale is not None:
+                np.save(os.path.join(path, _QUANTIZATION_SCALE_FILE), quantizer.scale)
+            schema['quantization'] = quantization
+        if texts is not None:
+            n_texts = TextColumn.write(texts, os.path.join(path, _TEXTS_FILE), os.path.join(path, _TEXT_OFFSETS_FILE))
+            if n_texts != len(embeddings):
+                raise ValueError("Texts must have one entry per embedding")
+        if metadata is not None:
+            schema['metadata_columns'] = [str(col) for col in metadata.columns]
+            for col in metadata.columns:
+                values = metadata[col].to_numpy()
+                if np.issubdtype(values.dtype, np.integer):
+                    schema[f'dtype_{col}'] = 'int'
+                    values = values.astype(np.int64)
+                elif np.issubdtype(values.dtype, np.floating):
+                    schema[f'dtype_{col}'] = 'float'
+                    values = values.astype(np.float64)
+                else:
+                    schema[f'dtype_{col}'] = 'string'
+                    values = values.astype(str)
+                np.save(os.path.join(path, f'meta.{col}.npy'), values)
+
+        # The schema is written last, so an interrupted write never looks like a valid store.
+        with open(schema_path, 'w') as f:
+            json.dump(schema, f)
+        return cls(path)
+
+    @classmethod
+    def merge(cls, path: str, shard_paths: Sequence[str], quantization: Optional[str] = None,
+              block_size: int = 65536) -> "FlatEmbeddingStore":
+        """
+        Concatenate flat embedding stores into one store, block by block, so the merged embeddings
+        never have to fit in memory. Rows keep the order of the shards.
+
+        Args:
+            path (str): Path to the merged store directory, created if missing.
+            shard_paths (Sequence[str]): Stores written by `FlatEmbeddingStore.write`, with the same
+                embedding size, metadata columns and presence of texts.
+            quantization (Optional[str], optional): Also store "int8" or "float16" quantized embeddings,
+                fitted on all rows. Defaults to None.
+            block_size (int, optional): Rows copied or encoded at once. Defaults to 65536.
+
+        Returns:
+            FlatEmbeddingStore: The merged store, opened for reading.
+        """
+        shards = [cls(shard_path) for shard_path in shard_paths]
+        if not shards:
+            raise ValueError("No shards to merge")
+        first = shards[0].schema
+        for shard in shards[1:]:
+            if (shard.schema['embedding_size'] != first['embedding_size']
+                    or shard.metadata_columns != first['metadata_columns']
+                    or shard.schema.get('has_text', False) != first.get('has_text', False)):
+                raise ValueError(f"Shard {shard.path} does not match {shards[0].path}")
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, _SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+
+        count = sum(len(shard) for shard in shards)
+        embeddings = np.lib.format.open_memmap(os.path.join(path, _EMBEDDINGS_FILE), mode='w+', dtype=np.float32,
+                                               shape=(count, first['embedding_size']))
+        start = 0
+        for shard in shards:
+            for block in range(0, len(shard), block_size):
+                rows = shard.embeddings[block:block + block_size]
+                embeddings[start:start + len(rows)] = rows
+                start += len(rows)
+        embeddings.flush()
+
+        schema = dict(first, count=count)
+        schema.pop('quantization', None)
+        if quantization is not None:
+            quantizer = ScalarQuantizer(quantization).fit(embeddings, chunk_size=block_size)
+            codes = np.lib.format.open_memmap(os.path.join(path, f'embeddings.{quantization}.npy'), mode='w+',
+                                              dtype=quantizer.dtype, shape=embeddings.shape)
+            for block in range(0, count, block_size):
+                codes[block:block + block_size] = quantizer.encode(embeddings[block:block + block_size])
+            codes.flush()
+            del codes
+            if quantizer.scale is not None:
+                np.save(os.path.join(path, _QUANTIZATION_SCALE_FILE), quantizer.scale)
+            schema['quantization'] = quantization
+        del embeddings
+
+        if first.get('has_text', False):
+            offsets = [np.zeros(1, dtype=np.int64)]
+            with open(os.path.join(path, _TEXTS_FILE), 'wb') as out:
+                for shard in shards:
+                    base = offsets[-1][-1]
+                    with open(os.path.join(shard.path, _TEXTS_FILE), 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                    shard_offsets = np.load(os.path.join(shard.path, _TEXT_OFFSETS_FILE), mmap_mode='r')
+                    offsets.append(np.asarray(shard_offsets[1:], dtype=np.int64) + base)
+            np.save(os.path.join(path, _TEXT_OFFSETS_FILE), np.concatenate(offsets))
+        for col in first['metadata_columns']:
+            columns = [shard.metadata_column(col) for shard in shards]
+            merged = np.lib.format.open_memmap(os.path.join(path, f'meta.{col}.npy'), mode='w+',
+                                               dtype=np.result_type(*columns), shape=(count,))
+            start = 0
+            for column in columns:
+                merged[start:start + len(column)] = column
+                start += len(column)
+            merged.flush()
+            del merged
+
+        # The schema is written last, so an interrupted merge never looks like a valid store.
+        with open(schema_path, 'w') as f:
+            json.dump(schema, f)
+        return cls(path)
+
+    @property
+    def path(self) -> str:
+        """
+        Get the store directory.
+
+        Returns:
+            str: The store directory.
+        """
+        return self._path
+
+    @property
+    def schema(self) -> dict:
+        """
+        Get the store schema.
+
+        Returns:
+            dict: The schema.
+        """
+        return self._schema
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        Get the memory-mapped, read-only embedding matrix.
+
+        Returns:
+            np.ndarray: Embedding matrix of shape (n, n_dims).
+        """
+        return self._embeddings
+
+    @property
+    def quantizer(self) -> Optional[ScalarQuantizer]:
+        """
+        Get the quantizer of the stored quantized embeddings.
+
+        Returns:
+            Optional[ScalarQuantizer]: The quantizer, or None if the store is not quantized.
+        """
+        return self._quantizer
+
+    @property
+    def quantized_embeddings(self) -> Optional[np.ndarray]:
+        """
+        Get the memory-mapped quantized embeddings.
+
+        Returns:
+            Optional[np.ndarray]: Codes of shape (n, n_dims), or None if the store is not quantized.
+        """
+        return self._quantized_embeddings
+
+    @property
+    def texts(self) -> Optional[TextColumn]:
+        """
+        Get the lazily decoded texts.
+
+        Returns:
+            Optional[TextColumn]: The texts, or None if the store has no text.
+        """
+        return self._texts
+
+    @property
+    def metadata_columns(self) -> List[str]:
+        """
+        Get the names of the metadata columns.
+
+        Returns:
+            List[str]: The metadata column names.
+        """
+        return list(self._schema.get('metadata_columns', []))
+
+    def metadata_column(self, col: str) -> np.ndarray:
+        """
+        Get a single memory-mapped metadata column.
+
+        Args:
+            col (str): The column name.
+
+        Returns:
+            np.ndarray: The column values.
+        """
+        if col not in self.metadata_columns:
+            raise KeyError(f"No metadata column {col!r}")
+        return np.load(os.path.join(self._path, f'meta.{col}.npy'), mmap_mode='r')
+
+    @property
+    def metadata(self) -> pd.DataFrame:
+        """
+        Get the metadata as a DataFrame. Without metadata columns a single `index` column is returned,
+        same as in `DataPipeline.load_tsv`.
+
+        Returns:
+            pd.DataFrame: The metadata.
+        """
+        if not self.metadata_columns:
+            return pd.DataFrame({'index': range(len(self))})
+        return pd.DataFrame({col: self.metadata_column(col) for col in self.metadata_columns})
+
+    def __len__(self) -> int:
+        return int(self._embeddings.shape[0])
@@ -1,8 +1,14 @@
-from typing import Any, Dict, List
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import time
 from annoy import AnnoyIndex
-import tensorflow as tf
-from search_engine import DataPipeline
-import pickle
+import numpy as np
+from search_engine.embedding_store import FlatEmbeddingStore
+from search_engine.lazy import LazyModule
+
+# Only needed to read TFRecord files, loading an index file does not import TensorFlow.
+tf = LazyModule("tensorflow")
 
 def _parse_example(example: tf.Tensor) -> Dict[str, tf.Tensor]:
     """
@@ -20,18 +26,51 @@ def _parse_example(example: tf.Tensor) -> Dict[str, tf.Tensor]:
     }
     return tf.io.parse_single_example(example, feature_description)
 
+def _read_embeddings(embed_file: str, n_dims: int, batch_size: int = 1024) -> np.ndarray:
+    """
+    Read only the embeddings from a TFRecord file or flat embedding store. TFRecord records are
+    parsed in batches and all other features, such as the text, are skipped.
+
+    Args:
+        embed_file (str): Path to a TFRecord file or flat embedding store directory.
+        n_dims (int): Dimensionality of the embeddings.
+        batch_size (int, optional): Number of records parsed at once. Defaults to 1024.
+
+    Returns:
+        np.ndarray: Embedding matrix of shape (n, n_dims), memory-mapped for flat stores.
+    """
+    if FlatEmbeddingStore.is_flat_store(embed_file):
+        embeddings = FlatEmbeddingStore(embed_file).embeddings
+        if embeddings.shape[1] != n_dims:
+            raise ValueError(f"Expected {n_dims}-dimensional embeddings, got {embeddings.shape[1]}")
+        return embeddings
+
+    feature_description = {'embedding': tf.io.FixedLenFeature([n_dims], tf.float32)}
+    dataset = tf.data.TFRecordDataset(embed_file).batch(batch_size).map(
+        lambda batch: tf.io.parse_example(batch, feature_description)['embedding'],
+        num_parallel_calls=tf.data.AUTOTUNE,
+    ).prefetch(tf.data.AUTOTUNE)
+    chunks = [chunk.numpy() for chunk in dataset]
+    if not chunks:
+        return np.empty((0, n_dims), dtype=np.float32)
+    return np.concatenate(chunks)
+
 class IndexBuilder:
-    def __init__(self, n_trees: int = 100, n_dims: int = 512) -> None:
+    def __init__(self, n_trees: int = 100, n_dims: int = 512, n_jobs: Optional[int] = None) -> None:
         """
         Initialize an IndexBuilder for building an Annoy index.
 
         Args:
             n_trees (int, optional): Number of trees to use in the Annoy index. Defaults to 100.
             n_dims (int, optional): Dimensionality of the embeddings. Defaults to 512.
+            n_jobs (Optional[int], optional): Number of threads Annoy uses to build the trees, -1 uses all cores.
+                Defaults to None, which keeps Annoy's default.
         """
         self._n_trees = n_trees
         self._n_dims = n_dims
+        self._n_jobs = n_jobs
         self._index = AnnoyIndex(self._n_dims, "angular")
+        self._build_timings = {}  # type: Dict[str, float]
 
     @property
     def annoy_index(self) -> AnnoyIndex:
@@ -43,24 +82,121 @@ class IndexBuilder:
         """
         return self._index
 
-    def build_index_from_files(self, embed_files_paths: List[str]) -> None:
+    @property
+    def build_timings(self) -> Dict[str, float]:
+        """
+        Get the timings of the last `build_index_from_files` call.
+
+        Returns:
+            Dict[str, float]: Seconds spent reading files ('read'), adding items ('add') and building
+            the trees ('build'), plus the number of added items ('items').
+        """
+        return dict(self._build_timings)
+
+    def build_index_from_files(self, embed_files_paths: List[str], num_parallel_reads: Optional[int] = None) -> None:
+        """
+        Build the Annoy index from TFRecord files or flat embedding stores containing embeddings.
+        Items are numbered in file order, in both the sequential and the parallel mode.
+
+        Args:
+            embed_files_paths (List[str]): List of paths to TFRecord files or flat embedding store directories.
+            num_parallel_reads (Optional[int], optional): Number of files read concurrently. Files are then
+                parsed in batches, skipping the text, while the previous ones are added to the index.
+                Defaults to None, which reads the files one record at a time.
+        """
+        if num_parallel_reads is None:
+            item_counter, read_time, add_time = self._add_items_sequentially(embed_files_paths)
+        else:
+            item_counter, read_time, add_time = self._add_items_in_parallel(embed_files_paths, num_parallel_reads)
+        print(f"A total of {item_counter} items added to the index")
+
+        start = time.perf_counter()
+        if self._n_jobs is None:
+            self._index.build(self._n_trees)
+        else:
+            self._index.build(self._n_trees, n_jobs=self._n_jobs)
+        build_time = time.perf_counter() - start
+
+        self._build_timings = {'read': read_time, 'add': add_time, 'build': build_time, 'items': item_counter}
+        print(f"Index built in {read_time + add_time + build_time:.2f}s "
+              f"(read {read_time:.2f}s, add {add_time:.2f}s, build {build_time:.2f}s)")
+
+    def _add_items_sequentially(self, embed_files_paths: List[str]) -> tuple:
         """
-        Build the Annoy index from TFRecord files containing embeddings.
+        Add items from the files one record at a time.
 
         Args:
-            embed_files_paths (List[str]): List of file paths to TFRecord files.
+            embed_files_paths (List[str]): List of paths to TFRecord files or flat embedding store directories.
+
+        Returns:
+            tuple: Number of added items, seconds spent reading and seconds spent adding.
         """
         item_counter = 0
+        add_time = 0.0
+        start = time.perf_counter()
         for i, embed_file in enumerate(embed_files_paths):
             print('Loading embeddings in file {} of {}...'.format(i + 1, len(embed_files_paths)))
+            if FlatEmbeddingStore.is_flat_store(embed_file):
+                embeddings = _read_embeddings(embed_file, self._n_dims)
+                add_start = time.perf_counter()
+                item_counter = self._add_embeddings(embeddings, item_counter)
+                add_time += time.perf_counter() - add_start
+                continue
             dataset = tf.data.TFRecordDataset(embed_file)
             for record in dataset.map(_parse_example):
-                text = record['text'].numpy().decode("utf-8")
                 embedding = record['embedding'].numpy()
+                add_start = time.perf_counter()
                 self._index.add_item(item_counter, embedding)
+                add_time += time.perf_counter() - add_start
                 item_counter += 1
-        print(f"A total of {item_counter} items added to the index")
-        self._index.build(self._n_trees)
+        return item_counter, time.perf_counter() - start - add_time, add_time
+
+    def _add_items_in_parallel(self, embed_files_paths: List[str], num_parallel_reads: int) -> tuple:
+        """
+        Read the files concurrently with a thread pool and add their embeddings in file order.
+
+        Args:
+            embed_files_paths (List[str]): List of paths to TFRecord files or flat embedding store directories.
+            num_parallel_reads (int): Number of files read concurrently.
+
+        Returns:
+            tuple: Number of added items, seconds spent waiting for reads and seconds spent adding.
+        """
+        item_counter = 0
+        read_time = 0.0
+        add_time = 0.0
+        with ThreadPoolExecutor(max_workers=max(1, num_parallel_reads)) as executor:
+            results = executor.map(lambda path: _read_embeddings(path, self._n_dims), embed_files_paths)
+            for i in range(len(embed_files_paths)):
+                start = time.perf_counter()
+                embeddings = next(results)
+                read_time += time.perf_counter() - start
+                print('Adding embeddings from file {} of {}...'.format(i + 1, len(embed_files_paths)))
+
+                start = time.perf_counter()
+                item_counter = self._add_embeddings(embeddings, item_counter)
+                add_time += time.perf_counter() - start
+        return item_counter, read_time, add_time
+
+    def _add_embeddings(self, embeddings: np.ndarray, first_item: int, chunk_size: int = 4096) -> int:
+        """
+        Add an embedding matrix to the index. Rows are converted to Python lists a chunk at a time,
+        which Annoy reads faster than NumPy rows.
+
+        Args:
+            embeddings (np.ndarray): Embedding matrix of shape (n, n_dims).
+            first_item (int): Item id of the first row.
+            chunk_size (int, optional): Rows converted at once. Defaults to 4096.
+
+        Returns:
+            int: Item id following the last added row.
+        """
+        item_counter = first_item
+        for start in range(0, embeddings.shape[0], chunk_size):
+            for embedding in embeddings[start:start + chunk_size].tolist():
+                self._index.add_item(item_counter, embedding)
+                item_counter += 1
+        return item_counter
 
     def save_to_file(self, file_path: str) -> None:
         """
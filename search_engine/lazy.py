@@ -0,0 +1,32 @@
+import importlib
+import types
+from typing import Any, List
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name: str) -> None:
+        """
+        Stand-in for a heavy module such as tensorflow, imported on first attribute access.
+
+        Modules that only need TensorFlow on some code paths bind it as `tf = LazyModule("tensorflow")`,
+        so importing them stays cheap and code that never touches `tf` never pays for the import.
+
+        Args:
+            name (str): Fully qualified name of the module.
+        """
+        super().__init__(name)
+
+    def _load(self) -> types.ModuleType:
+        """
+        Import the module, returns the cached module after the first call.
+
+        Returns:
+            types.ModuleType: The real module.
+        """
+        return importlib.import_module(self.__name__)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self) -> List[str]:
+        return dir(self._load())
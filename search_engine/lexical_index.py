@@ -0,0 +1,435 @@
+"""
+BM25 inverted index over the lyrics, searched together with the embeddings to recall exact lines.
+
+The index is a directory of NumPy arrays in CSR layout: the postings of term t are
+`doc_ids[indptr[t]:indptr[t + 1]]` with their term frequencies at the same positions, and the
+vocabulary is a sorted text column searched by bisection. The token positions of posting p are
+`positions[position_indptr[p]:position_indptr[p + 1]]`, they verify exact phrase matches. Everything is memory-mapped, so opening
+an index reads nothing and workers forked after loading it share its pages.
+
+Usage:
+    python -m search_engine.lexical_index all_lyrics.tsv index/lexical
+"""
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import unicodedata
+
+import numpy as np
+from search_engine.embedding_store import TextColumn
+from search_engine.search_backends import _top_k
+
+_SCHEMA_FILE = "schema.json"
+_TERMS_FILE = "terms.bin"
+_TERM_OFFSETS_FILE = "terms.offsets.npy"
+_INDPTR_FILE = "indptr.npy"
+_DOC_IDS_FILE = "doc_ids.npy"
+_TERM_FREQS_FILE = "term_freqs.npy"
+_DOC_LENGTHS_FILE = "doc_lengths.npy"
+_POSITIONS_FILE = "positions.npy"
+_POSITION_INDPTR_FILE = "position_indptr.npy"
+_INDEX_FORMAT = "bm25"
+
+# Polish letters are folded to ASCII, so queries typed without diacritics still match.
+# "ł" has no Unicode decomposition and needs its own entry.
+_POLISH_FOLDING = str.maketrans("ąćęłńóśźż", "acelnoszz")
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into normalized terms. The text is NFKC normalized and case-folded, Polish
+    diacritics are folded to ASCII and other combining marks are dropped. Words are not stemmed,
+    a remembered line is searched with the same inflected forms as in the lyrics.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms in order of appearance.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_POLISH_FOLDING)
+    text = "".join(char for char in unicodedata.normalize("NFD", text) if not unicodedata.combining(char))
+    return _TOKEN_PATTERN.findall(text)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], n_items: int = 5, k: float = 60.0,
+                           weights: Optional[Sequence[float]] = None) -> Tuple[List[int], List[float]]:
+    """
+    Fuse ranked result lists with reciprocal rank fusion. An item at rank r (starting at 1) of a list
+    scores weight / (k + r) and its scores from all lists are summed, so only the ranks matter and
+    BM25 scores need not be comparable to cosine similarities.
+
+    Args:
+        rankings (Sequence[Sequence[int]]): Result lists, best item first.
+        n_items (int, optional): Number of fused items to return. Defaults to 5.
+        k (float, optional): Damping of the top ranks. Defaults to 60, the value of the original paper.
+        weights (Optional[Sequence[float]], optional): Weight of every list. Defaults to 1 for all lists.
+
+    Returns:
+        Tuple[List[int], List[float]]: Fused items and their scores, best item first. Ties keep the
+            order in which items were first seen.
+    """
+    if weights is None:
+        weights = [1.0] * len(rankings)
+    if len(weights) != len(rankings):
+        raise ValueError("Expected one weight per ranking")
+    scores = {}  # type: Dict[int, float]
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    fused = sorted(scores.items(), key=lambda entry: -entry[1])[:n_items]
+    return [item for item, _ in fused], [score for _, score in fused]
+
+
+class LexicalIndexWriter:
+    def __init__(self) -> None:
+        """
+        Builds a lexical index one document at a time. Document i is the i-th added text, which has
+        to match the item ids of the embedding index, i.e. the row order of the TSV.
+        Postings are collected as compact arrays of term ids and frequencies and sorted into CSR
+        layout by `save`.
+        """
+        self._vocabulary = {}  # type: Dict[str, int]
+        self._term_ids = array('i')
+        self._term_freqs = array('i')
+        self._doc_lengths = array('i')
+        self._doc_terms = array('q')  # number of distinct terms of every document
+        self._positions = array('i')  # token positions of every posting, in the order of `_term_ids`
+
+    def add(self, text: str) -> None:
+        """
+        Add the next document.
+
+        Args:
+            text (str): The document text.
+        """
+        terms = tokenize(str(text))
+        positions = {}  # type: Dict[str, List[int]]
+        for position, term in enumerate(terms):
+            positions.setdefault(term, []).append(position)
+        for term, term_positions in positions.items():
+            term_id = self._vocabulary.setdefault(term, len(self._vocabulary))
+            self._term_ids.append(term_id)
+            self._term_freqs.append(len(term_positions))
+            self._positions.extend(term_positions)
+        self._doc_lengths.append(len(terms))
+        self._doc_terms.append(len(positions))
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def save(self, path: str, k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """
+        Write the index as a directory of arrays.
+
+        Args:
+            path (str): Path to the index directory, created if missing.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 document length normalization. Defaults to 0.75.
+
+        Returns:
+            LexicalIndex: The written index, opened for reading.
+        """
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, _SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+
+        # Term ids are renumbered in sorted order, so the vocabulary can be searched by bisection
+        terms = sorted(self._vocabulary)
+        new_ids = np.empty(len(terms), dtype=np.int32)
+        new_ids[[self._vocabulary[term] for term in terms]] = np.arange(len(terms), dtype=np.int32)
+        term_ids = new_ids[np.frombuffer(self._term_ids, dtype=np.int32)]
+        doc_ids = np.repeat(np.arange(len(self), dtype=np.int32), np.frombuffer(self._doc_terms, dtype=np.int64))
+        # A stable sort keeps the documents of every term in ascending order
+        order = np.argsort(term_ids, kind='stable')
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=indptr[1:])
+        term_freqs = np.frombuffer(self._term_freqs, dtype=np.int32)
+        # The positions of every posting move with it, as one gather over the concatenated runs
+        position_starts = np.concatenate(([0], np.cumsum(term_freqs[:-1], dtype=np.int64)))[order]
+        position_indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(term_freqs[order], out=position_indptr[1:])
+        gather = (np.repeat(position_starts - position_indptr[:-1], term_freqs[order])
+                  + np.arange(position_indptr[-1], dtype=np.int64))
+        positions = np.frombuffer(self._positions, dtype=np.int32)[gather]
+        term_freqs = np.minimum(term_freqs, np.iinfo(np.uint16).max)
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.int32)
+
+        TextColumn.write(terms, os.path.join(path, _TERMS_FILE), os.path.join(path, _TERM_OFFSETS_FILE))
+        np.save(os.path.join(path, _INDPTR_FILE), indptr)
+        np.save(os.path.join(path, _DOC_IDS_FILE), doc_ids[order])
+        np.save(os.path.join(path, _TERM_FREQS_FILE), term_freqs[order].astype(np.uint16))
+        np.save(os.path.join(path, _DOC_LENGTHS_FILE), doc_lengths)
+        np.save(os.path.join(path, _POSITIONS_FILE), positions)
+        np.save(os.path.join(path, _POSITION_INDPTR_FILE), position_indptr)
+        schema = {
+            'format': _INDEX_FORMAT,
+            'version': 2,
+            'count': len(self),
+            'n_terms': len(terms),
+            'n_postings': int(indptr[-1]),
+            'avg_doc_length': float(doc_lengths.mean()) if len(self) else 0.0,
+            'k1': k1,
+            'b': b,
+        }
+        # The schema is written last, so an interrupted write never looks like a valid index.
+        with open(schema_path, 'w') as f:
+            json.dump(schema, f)
+        return LexicalIndex(path)
+
+
+class LexicalIndex:
+    def __init__(self, path: str) -> None:
+        """
+        Open a lexical index written by `LexicalIndex.build` or `LexicalIndexWriter.save`.
+        All arrays are memory-mapped.
+
+        Args:
+            path (str): Path to the index directory.
+        """
+        self._path = path
+        with open(os.path.join(path, _SCHEMA_FILE), 'r') as f:
+            self._schema = json.load(f)
+        if self._schema.get('format') != _INDEX_FORMAT:
+            raise ValueError(f"{path} is not a lexical index")
+        self._terms = TextColumn.open(os.path.join(path, _TERMS_FILE), os.path.join(path, _TERM_OFFSETS_FILE))
+        self._indptr = np.load(os.path.join(path, _INDPTR_FILE), mmap_mode='r')
+        self._doc_ids = np.load(os.path.join(path, _DOC_IDS_FILE), mmap_mode='r')
+        self._term_freqs = np.load(os.path.join(path, _TERM_FREQS_FILE), mmap_mode='r')
+        self._doc_lengths = np.load(os.path.join(path, _DOC_LENGTHS_FILE), mmap_mode='r')
+        # Version 1 indexes have no positions, phrase matching is skipped for them
+        self._positions = None  # type: Optional[np.ndarray]
+        self._position_indptr = None  # type: Optional[np.ndarray]
+        if self._schema.get('version', 1) >= 2:
+            self._positions = np.load(os.path.join(path, _POSITIONS_FILE), mmap_mode='r')
+            self._position_indptr = np.load(os.path.join(path, _POSITION_INDPTR_FILE), mmap_mode='r')
+        self._k1 = float(self._schema['k1'])
+        self._b = float(self._schema['b'])
+        self._avg_doc_length = max(float(self._schema['avg_doc_length']), 1e-12)
+        self._length_norm = None  # type: Optional[np.ndarray]
+
+    @classmethod
+    def build(cls, path: str, texts: Iterable[str], k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """
+        Build and write the index of a corpus, e.g. `DataPipeline.texts` or the lyrics column of the
+        TSV the embedding index was built from, so item ids agree.
+
+        Args:
+            path (str): Path to the index directory, created if missing.
+            texts (Iterable[str]): Documents, the position of a document is its item id.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 document length normalization. Defaults to 0.75.
+
+        Returns:
+            LexicalIndex: The written index, opened for reading.
+        """
+        writer = LexicalIndexWriter()
+        for text in texts:
+            writer.add(text)
+        return writer.save(path, k1, b)
+
+    @staticmethod
+    def is_lexical_index(path: str) -> bool:
+        """
+        Check whether a path points to a lexical index.
+
+        Args:
+            path (str): Path to check.
+
+        Returns:
+            bool: True if the path is an index directory.
+        """
+        return os.path.isdir(path) and os.path.exists(os.path.join(path, _SCHEMA_FILE))
+
+    @property
+    def path(self) -> str:
+        """
+        Get the index directory.
+
+        Returns:
+            str: The path.
+        """
+        return self._path
+
+    @property
+    def n_terms(self) -> int:
+        """
+        Get the size of the vocabulary.
+
+        Returns:
+            int: Number of distinct terms.
+        """
+        return len(self._terms)
+
+    def _term_id(self, term: str) -> int:
+        """
+        Find a term in the sorted vocabulary.
+
+        Returns:
+            int: The term id, or -1 if the term does not occur in the corpus.
+        """
+        position = bisect_left(self._terms, term)
+        if position < len(self._terms) and self._terms[position] == term:
+            return position
+        return -1
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the documents containing a term.
+
+        Args:
+            term (str): A normalized term, as returned by `tokenize`.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Ascending document ids and the term frequency in each of them.
+        """
+        term_id = self._term_id(term)
+        if term_id < 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+        start, end = int(self._indptr[term_id]), int(self._indptr[term_id + 1])
+        return self._doc_ids[start:end], self._term_freqs[start:end]
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Compute the BM25 score of every document. Every distinct query term contributes
+        idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length)).
+
+        Args:
+            query (str): The query text.
+
+        Returns:
+            np.ndarray: Scores of shape (n,), 0 for documents without any query term.
+        """
+        if self._length_norm is None:
+            self._length_norm = (self._k1 * (1.0 - self._b + self._b * self._doc_lengths / self._avg_doc_length)
+                                 ).astype(np.float32)
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in dict.fromkeys(tokenize(query)):
+            doc_ids, term_freqs = self.postings(term)
+            if doc_ids.size == 0:
+                continue
+            idf = np.log1p((len(self) - doc_ids.size + 0.5) / (doc_ids.size + 0.5))
+            term_freqs = term_freqs.astype(np.float32)
+            # Every document appears once in the postings of a term, so fancy indexing accumulates correctly
+            scores[doc_ids] += idf * term_freqs * (self._k1 + 1.0) / (term_freqs + self._length_norm[doc_ids])
+        return scores
+
+    @property
+    def has_positions(self) -> bool:
+        """
+        Check whether the index stores token positions, which phrase matching requires.
+
+        Returns:
+            bool: False for indexes written before positions were stored.
+        """
+        return self._positions is not None
+
+    def _positions_in(self, term_id: int, doc_id: int) -> np.ndarray:
+        """
+        Get the token positions of a term in a document that contains it.
+        """
+        start, end = int(self._indptr[term_id]), int(self._indptr[term_id + 1])
+        posting = start + int(np.searchsorted(self._doc_ids[start:end], doc_id))
+        return self._positions[self._position_indptr[posting]:self._position_indptr[posting + 1]]
+
+    def phrase_search(self, query: str, scores: Optional[np.ndarray] = None,
+                      max_candidates: int = 1000) -> List[int]:
+        """
+        Find the documents containing all terms of the query consecutively and in order. Documents
+        containing every term are candidates, the positions of the best scoring ones are compared.
+
+        Args:
+            query (str): The phrase.
+            scores (Optional[np.ndarray], optional): BM25 scores of the query that rank the candidates.
+                Defaults to computing them.
+            max_candidates (int, optional): Maximum number of candidates verified. Defaults to 1000.
+
+        Returns:
+            List[int]: Matching document ids, highest BM25 score first. Empty for queries with fewer
+                than two terms or indexes without positions.
+        """
+        terms = tokenize(query)
+        if len(terms) < 2 or not self.has_positions:
+            return []
+        term_ids = [self._term_id(term) for term in terms]
+        if min(term_ids) < 0:
+            return []
+        # Intersecting from the rarest term keeps the intermediate arrays small
+        distinct = sorted(set(term_ids), key=lambda term_id: self._indptr[term_id + 1] - self._indptr[term_id])
+        candidates = None  # type: Optional[np.ndarray]
+        for term_id in distinct:
+            doc_ids = self._doc_ids[self._indptr[term_id]:self._indptr[term_id + 1]]
+            candidates = np.asarray(doc_ids) if candidates is None else np.intersect1d(candidates, doc_ids,
+                                                                                      assume_unique=True)
+            if candidates.size == 0:
+                return []
+        if scores is None:
+            scores = self.scores(query)
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')[:max_candidates]]
+        matches = []
+        for doc_id in candidates.tolist():
+            # A phrase starts at p if term i occurs at p + i for every i
+            starts = self._positions_in(term_ids[0], doc_id)
+            for offset, term_id in enumerate(term_ids[1:], start=1):
+                starts = np.intersect1d(starts, self._positions_in(term_id, doc_id) - offset)
+                if starts.size == 0:
+                    break
+            else:
+                matches.append(doc_id)
+        return matches
+
+    def search(self, query: str, n_items: int = 5) -> Tuple[List[int], List[float]]:
+        """
+        Find the documents with the highest BM25 score. Documents containing the query as an exact
+        phrase are ranked first, so a remembered line finds its song even when other songs repeat
+        its words more often.
+
+        Args:
+            query (str): The query text.
+            n_items (int, optional): Maximum number of documents to return. Defaults to 5.
+
+        Returns:
+            Tuple[List[int], List[float]]: Document ids and their BM25 scores, phrase matches first and
+                best first within both groups. Documents without any query term are never returned.
+        """
+        scores = self.scores(query)
+        indices = _top_k(scores, min(n_items, int(np.count_nonzero(scores)))).tolist()
+        phrase_matches = self.phrase_search(query, scores)[:n_items]
+        if phrase_matches:
+            matched = set(phrase_matches)
+            indices = (phrase_matches + [index for index in indices if index not in matched])[:n_items]
+        return indices, scores[indices].tolist()
+
+    def __len__(self) -> int:
+        return int(self._schema['count'])
+
+
+def _iter_tsv_texts(file_path: str, text_column: str) -> Iterable[str]:
+    """
+    Read one column of a TSV written by `CorpusExporter`, row by row.
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            yield row[text_column]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tsv_path", help="TSV the embedding index was built from, rows are item ids")
+    parser.add_argument("index_path")
+    parser.add_argument("--text-column", default="Lyrics")
+    parser.add_argument("--k1", type=float, default=1.2)
+    parser.add_argument("-b", type=float, default=0.75)
+    args = parser.parse_args()
+    index = LexicalIndex.build(args.index_path, _iter_tsv_texts(args.tsv_path, args.text_column), args.k1, args.b)
+    print(f"Indexed {len(index)} documents, {index.n_terms} terms.")
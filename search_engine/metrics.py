@@ -0,0 +1,373 @@
+"""
+Counters, histograms and per-request stage timings, exposed in the Prometheus text format.
+
+Stages are timed with `stage("embed")` blocks. They are recorded into the StageTimer activated
+in the current thread, if any, so the query path can be instrumented without passing a timer
+through every call, and costs only a thread-local lookup when nothing is measured.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+_local = threading.local()
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        self._name = name
+        self._documentation = documentation
+        self._label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """
+        Get the metric name.
+
+        Returns:
+            str: The name.
+        """
+        return self._name
+
+    @property
+    def documentation(self) -> str:
+        """
+        Get the help text.
+
+        Returns:
+            str: The help text.
+        """
+        return self._documentation
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self._label_names):
+            raise ValueError(f"{self._name} expects labels {self._label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self._label_names)
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        """
+        Monotonically increasing count, e.g. of requests or errors.
+
+        Args:
+            name (str): Metric name, by convention ending in `_total`.
+            documentation (str): Help text.
+            label_names (Sequence[str], optional): Names of the labels every increment has to set. Defaults to none.
+        """
+        super().__init__(name, documentation, label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increase the count.
+
+        Args:
+            amount (float, optional): Non-negative increment. Defaults to 1.
+            **labels (str): Values of all labels.
+        """
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        Get the current count.
+
+        Args:
+            **labels (str): Values of all labels.
+
+        Returns:
+            float: The count, 0 if never increased.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self._name, dict(zip(self._label_names, key)), value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Distribution of observed values in cumulative buckets, e.g. of latencies in seconds.
+
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text.
+            label_names (Sequence[str], optional): Names of the labels every observation has to set. Defaults to none.
+            buckets (Sequence[float], optional): Increasing upper bounds, +Inf is added. Defaults to DEFAULT_BUCKETS,
+                1 ms to 10 s.
+        """
+        super().__init__(name, documentation, label_names)
+        buckets = [float(bound) for bound in buckets]
+        if buckets != sorted(buckets) or len(set(buckets)) != len(buckets):
+            raise ValueError("Buckets must be strictly increasing")
+        if not buckets or not math.isinf(buckets[-1]):
+            buckets.append(math.inf)
+        self._buckets = tuple(buckets)
+        # Per label values: count per bucket (not cumulative), sum and count
+        self._values = {}  # type: Dict[Tuple[str, ...], Tuple[List[int], List[float]]]
+
+    @property
+    def buckets(self) -> Tuple[float, ...]:
+        """
+        Get the bucket upper bounds.
+
+        Returns:
+            Tuple[float, ...]: Increasing bounds, the last one is +Inf.
+        """
+        return self._buckets
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record a value.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): Values of all labels.
+        """
+        key = self._key(labels)
+        # Bisection is not worth it for a dozen buckets
+        bucket = next(i for i, bound in enumerate(self._buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self._buckets), [0.0]))
+            counts[bucket] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        """
+        Get the number of observations.
+
+        Args:
+            **labels (str): Values of all labels.
+
+        Returns:
+            int: The number of observed values.
+        """
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return sum(values[0]) if values else 0
+
+    def sum(self, **labels: str) -> float:
+        """
+        Get the sum of observations.
+
+        Args:
+            **labels (str): Values of all labels.
+
+        Returns:
+            float: The sum of observed values.
+        """
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return values[1][0] if values else 0.0
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = dict(zip(self._label_names, key))
+            cumulative = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                yield f"{self._name}_bucket", {**labels, 'le': _format_value(bound)}, cumulative
+            yield f"{self._name}_sum", labels, total
+            yield f"{self._name}_count", labels, cumulative
+
+
+class _CallbackMetric(_Metric):
+    def __init__(self, name: str, documentation: str, type_name: str,
+                 callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]]) -> None:
+        super().__init__(name, documentation)
+        self.type_name = type_name
+        self._callback = callback
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, value in self._callback():
+            yield self._name, labels, value
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """
+        Collection of metrics rendered together, e.g. by a /metrics endpoint.
+        """
+        self._metrics = {}  # type: Dict[str, _Metric]
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        """
+        Create and register a counter, see `Counter`.
+        """
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Create and register a histogram, see `Histogram`.
+        """
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def add_callback(self, name: str, documentation: str, callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+                     type_name: str = "gauge") -> None:
+        """
+        Register a metric read when rendering, e.g. from the counters of an existing component.
+
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text.
+            callback (Callable[[], Iterable[Tuple[Dict[str, str], float]]]): Returns the current labels and value
+                of every sample, may return nothing.
+            type_name (str, optional): "gauge" or "counter". Defaults to "gauge".
+        """
+        self._register(_CallbackMetric(name, documentation, type_name, callback))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format, version 0.0.4.
+
+        Returns:
+            str: The metrics page.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        """
+        Wall-clock durations of the stages of one request, e.g. parse, embed, search and serialize.
+        A stage entered several times accumulates its durations.
+
+        Args:
+            clock (Callable[[], float], optional): Time source, used in tests. Defaults to time.perf_counter.
+        """
+        self._clock = clock
+        self._started = clock()
+        self._stages = {}  # type: Dict[str, float]
+
+    @property
+    def stages(self) -> Dict[str, float]:
+        """
+        Get the recorded stages.
+
+        Returns:
+            Dict[str, float]: Seconds spent in every stage, in order of first entry.
+        """
+        return dict(self._stages)
+
+    def elapsed(self) -> float:
+        """
+        Get the time since the timer was created.
+
+        Returns:
+            float: Elapsed seconds.
+        """
+        return self._clock() - self._started
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a block as the given stage.
+
+        Args:
+            name (str): The stage name.
+        """
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self._stages[name] = self._stages.get(name, 0.0) + self._clock() - start
+
+    @contextmanager
+    def activate(self) -> Iterator["StageTimer"]:
+        """
+        Make this the timer that `stage` blocks of the current thread record into.
+        """
+        previous = getattr(_local, 'timer', None)
+        _local.timer = self
+        try:
+            yield self
+        finally:
+            _local.timer = previous
+
+
+def current_timer() -> Optional[StageTimer]:
+    """
+    Get the timer activated in the current thread.
+
+    Returns:
+        Optional[StageTimer]: The timer, or None if nothing is measured.
+    """
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the timer activated in the current thread, does nothing without one.
+
+    Args:
+        name (str): The stage name.
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
@@ -0,0 +1,239 @@
+from __future__ import annotations
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from search_engine.embedding_store import FlatEmbeddingStore
+from search_engine.search_backends import ExactBackend, SearchBackend, SearchK
+
+
+def passage_bounds(n_lines: int, window_lines: int = 4, stride: int = 2) -> List[Tuple[int, int]]:
+    """
+    Split a song into overlapping windows of lines. Consecutive windows start `stride` lines apart
+    and the last window always ends at the last line. Songs shorter than a window are one passage.
+
+    Args:
+        n_lines (int): Number of lines of the song.
+        window_lines (int, optional): Lines per passage. Defaults to 4.
+        stride (int, optional): Lines between the starts of consecutive passages. Defaults to 2.
+
+    Returns:
+        List[Tuple[int, int]]: Start and end line of every passage, the end is exclusive.
+    """
+    if window_lines <= 0 or stride <= 0:
+        raise ValueError("`window_lines` and `stride` must be positive")
+    if n_lines <= window_lines:
+        return [(0, n_lines)]
+    bounds = [(start, start + window_lines) for start in range(0, n_lines - window_lines + 1, stride)]
+    if bounds[-1][1] < n_lines:
+        bounds.append((n_lines - window_lines, n_lines))
+    return bounds
+
+
+def iter_passages(texts: Iterable[str], window_lines: int = 4, stride: int = 2) -> Iterator[Tuple[int, int, int, str]]:
+    """
+    Split texts into passages, one song at a time. Lyrics are expected to be cleaned by
+    `LyricsFetcher._clean_lyrics`, one non-empty line per verse line.
+
+    Args:
+        texts (Iterable[str]): Song lyrics, the position of a song is its item id.
+        window_lines (int, optional): Lines per passage. Defaults to 4.
+        stride (int, optional): Lines between the starts of consecutive passages. Defaults to 2.
+
+    Yields:
+        Tuple[int, int, int, str]: Song id, start line, end line and text of every passage.
+    """
+    for song_id, text in enumerate(texts):
+        lines = [line for line in str(text).split("\n") if line.strip()]
+        for start, end in passage_bounds(len(lines), window_lines, stride):
+            yield song_id, start, end, "\n".join(lines[start:end])
+
+
+class PassageMap:
+    def __init__(self, song_ids: np.ndarray, line_starts: Optional[np.ndarray] = None,
+                 line_ends: Optional[np.ndarray] = None) -> None:
+        """
+        Compact mapping of passages to the songs they were cut from, backed by NumPy arrays
+        instead of one Python object per passage.
+
+        Args:
+            song_ids (np.ndarray): Song id of every passage.
+            line_starts (Optional[np.ndarray], optional): First line of every passage. Defaults to None.
+            line_ends (Optional[np.ndarray], optional): Line after the last line of every passage. Defaults to None.
+        """
+        self._song_ids = np.asarray(song_ids)
+        self._line_starts = line_starts
+        self._line_ends = line_ends
+
+    @classmethod
+    def build(cls, texts: Iterable[str], window_lines: int = 4, stride: int = 2) -> "PassageMap":
+        """
+        Compute the passages of every song without keeping their texts.
+
+        Args:
+            texts (Iterable[str]): Song lyrics, the position of a song is its item id.
+            window_lines (int, optional): Lines per passage. Defaults to 4.
+            stride (int, optional): Lines between the starts of consecutive passages. Defaults to 2.
+
+        Returns:
+            PassageMap: The mapping.
+        """
+        song_ids, line_starts, line_ends = array('q'), array('i'), array('i')
+        for song_id, text in enumerate(texts):
+            n_lines = sum(1 for line in str(text).split("\n") if line.strip())
+            for start, end in passage_bounds(n_lines, window_lines, stride):
+                song_ids.append(song_id)
+                line_starts.append(start)
+                line_ends.append(end)
+        return cls(np.frombuffer(song_ids, dtype=np.int64), np.frombuffer(line_starts, dtype=np.int32),
+                   np.frombuffer(line_ends, dtype=np.int32))
+
+    @property
+    def song_ids(self) -> np.ndarray:
+        """
+        Get the song id of every passage.
+
+        Returns:
+            np.ndarray: Array of song ids, one per passage.
+        """
+        return self._song_ids
+
+    @property
+    def line_starts(self) -> Optional[np.ndarray]:
+        """
+        Get the first line of every passage.
+
+        Returns:
+            Optional[np.ndarray]: Array of line numbers, or None if not known.
+        """
+        return self._line_starts
+
+    @property
+    def line_ends(self) -> Optional[np.ndarray]:
+        """
+        Get the line after the last line of every passage.
+
+        Returns:
+            Optional[np.ndarray]: Array of line numbers, or None if not known.
+        """
+        return self._line_ends
+
+    def aggregate(self, passage_ids: Sequence[int], scores: Sequence[float],
+                  n_items: int) -> Tuple[List[int], List[float], List[int]]:
+        """
+        Max-pool passage hits per song. Every song gets the score of its best passage.
+
+        Args:
+            passage_ids (Sequence[int]): Passage hits sorted by descending score.
+            scores (Sequence[float]): Their scores.
+            n_items (int): Maximum number of songs to return.
+
+        Returns:
+            Tuple[List[int], List[float], List[int]]: Song ids, scores and best passage ids, best song first.
+        """
+        passage_ids = np.asarray(passage_ids, dtype=np.int64)
+        if passage_ids.size == 0:
+            return [], [], []
+        scores = np.asarray(scores, dtype=np.float32)
+        # Hits are sorted, so the first hit of a song is its best passage
+        _, first = np.unique(self._song_ids[passage_ids], return_index=True)
+        best = np.sort(first)[:n_items]
+        return (self._song_ids[passage_ids[best]].tolist(), scores[best].tolist(), passage_ids[best].tolist())
+
+    def __len__(self) -> int:
+        return int(self._song_ids.shape[0])
+
+
+class PassageBackend(SearchBackend):
+    def __init__(self, passage_backend: SearchBackend, passage_map: PassageMap,
+                 passage_texts: Optional[Sequence[str]] = None, overfetch: int = 4) -> None:
+        """
+        Song search over a passage-level index. The nearest passages are fetched from `passage_backend`
+        and max-pooled per song, so a query matching a single verse of a long song still ranks it high.
+
+        Args:
+            passage_backend (SearchBackend): Backend searching passage embeddings, item i is passage i.
+            passage_map (PassageMap): Song of every passage.
+            passage_texts (Optional[Sequence[str]], optional): Text of every passage, returned as the
+                matching passage, e.g. the memory-mapped `FlatEmbeddingStore.texts`. Defaults to None.
+            overfetch (int, optional): Passages fetched per requested song, doubled until enough distinct
+                songs are found. Defaults to 4.
+        """
+        if len(passage_backend) != len(passage_map):
+            raise ValueError("The passage backend and the passage map must have the same number of passages")
+        self._passage_backend = passage_backend
+        self._passage_map = passage_map
+        self._passage_texts = passage_texts
+        self._overfetch = overfetch
+        self._n_songs = int(np.unique(passage_map.song_ids).shape[0])
+
+    @classmethod
+    def from_store(cls, store: FlatEmbeddingStore, passage_backend: Optional[SearchBackend] = None,
+                   overfetch: int = 4) -> "PassageBackend":
+        """
+        Open a passage store written by `DataPipeline.save_passages`.
+
+        Args:
+            store (FlatEmbeddingStore): Store of passage embeddings with a `song_id` metadata column.
+            passage_backend (Optional[SearchBackend], optional): Backend over the passage embeddings, e.g. an
+                AnnoyBackend built from the store. Defaults to an ExactBackend over the memory-mapped embeddings.
+            overfetch (int, optional): Passages fetched per requested song. Defaults to 4.
+
+        Returns:
+            PassageBackend: The backend.
+        """
+        passage_map = PassageMap(store.metadata_column('song_id'), store.metadata_column('line_start'),
+                                 store.metadata_column('line_end'))
+        if passage_backend is None:
+            passage_backend = ExactBackend(store.embeddings)
+        return cls(passage_backend, passage_map, store.texts, overfetch)
+
+    @property
+    def passage_backend(self) -> SearchBackend:
+        """
+        Get the backend searching passage embeddings.
+
+        Returns:
+            SearchBackend: The passage backend.
+        """
+        return self._passage_backend
+
+    @property
+    def passage_map(self) -> PassageMap:
+        """
+        Get the mapping of passages to songs.
+
+        Returns:
+            PassageMap: The passage map.
+        """
+        return self._passage_map
+
+    def search_with_passages(self, query_embedding: np.ndarray, n_items: int = 5,
+                             search_k: SearchK = None) -> Tuple[List[int], List[float], List[int]]:
+        n_passages = len(self._passage_map)
+        k = min(n_items * self._overfetch, n_passages)
+        while True:
+            passage_ids, scores = self._passage_backend.search_with_scores(query_embedding, k, search_k)
+            results = self._passage_map.aggregate(passage_ids, scores, n_items)
+            if len(results[0]) >= n_items or k >= n_passages:
+                return results
+            k = min(k * 2, n_passages)
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        song_ids, scores, _ = self.search_with_passages(query_embedding, n_items, search_k)
+        return song_ids, scores
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        return self.search_with_passages(query_embedding, n_items, search_k)[0]
+
+    def resolve_search_k(self, search_k: SearchK, n_items: int = 5) -> SearchK:
+        # Presets are resolved for the number of fetched passages, which is only known while searching
+        return None if self._passage_backend.resolve_search_k(search_k, n_items) is None else search_k
+
+    def passage_text(self, passage_id: int) -> Optional[str]:
+        if self._passage_texts is None or passage_id < 0:
+            return None
+        return self._passage_texts[passage_id]
+
+    def __len__(self) -> int:
+        return self._n_songs
@@ -0,0 +1,125 @@
+from typing import Optional
+import numpy as np
+
+QUANTIZATION_MODES = ("int8", "float16")
+
+
+class ScalarQuantizer:
+    def __init__(self, mode: str = "int8", scale: Optional[np.ndarray] = None) -> None:
+        """
+        Initialize a scalar quantizer storing embeddings as int8 or float16.
+
+        In int8 mode every dimension is quantized symmetrically with its own scale,
+        `code = round(value / scale)` with `scale = max(|value|) / 127`. Dot products can then be
+        computed on the codes directly, `query . value ~= (query * scale) . code`.
+        In float16 mode values are only cast and no parameters are needed.
+
+        Args:
+            mode (str, optional): Either "int8" or "float16". Defaults to "int8".
+            scale (Optional[np.ndarray], optional): Per-dimension scale of a fitted int8 quantizer. Defaults to None.
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self._mode = mode
+        self._scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+
+    @property
+    def mode(self) -> str:
+        """
+        Get the quantization mode.
+
+        Returns:
+            str: Either "int8" or "float16".
+        """
+        return self._mode
+
+    @property
+    def scale(self) -> Optional[np.ndarray]:
+        """
+        Get the per-dimension scale, only used in int8 mode.
+
+        Returns:
+            Optional[np.ndarray]: The scale, or None if not fitted or in float16 mode.
+        """
+        return self._scale
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        Get the dtype of the codes.
+
+        Returns:
+            np.dtype: np.int8 or np.float16.
+        """
+        return np.dtype(np.int8) if self._mode == "int8" else np.dtype(np.float16)
+
+    def fit(self, embeddings: np.ndarray, chunk_size: int = 65536) -> "ScalarQuantizer":
+        """
+        Compute the per-dimension scale from the embeddings. Does nothing in float16 mode.
+
+        Args:
+            embeddings (np.ndarray): Embedding matrix of shape (n, n_dims).
+            chunk_size (int, optional): Rows processed at once, bounds temporary memory. Defaults to 65536.
+
+        Returns:
+            ScalarQuantizer: The fitted quantizer.
+        """
+        if self._mode == "int8":
+            max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+            for start in range(0, embeddings.shape[0], chunk_size):
+                chunk = np.abs(np.asarray(embeddings[start:start + chunk_size], dtype=np.float32))
+                np.maximum(max_abs, chunk.max(axis=0), out=max_abs)
+            self._scale = np.maximum(max_abs, 1e-12) / 127.0
+        return self
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Quantize embeddings.
+
+        Args:
+            embeddings (np.ndarray): Embeddings of shape (n, n_dims) or (n_dims,).
+
+        Returns:
+            np.ndarray: The codes, with the same shape.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self._mode == "float16":
+            return embeddings.astype(np.float16)
+        self._check_fitted()
+        return np.clip(np.rint(embeddings / self._scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Reconstruct approximate float32 embeddings from codes.
+
+        Args:
+            codes (np.ndarray): The codes.
+
+        Returns:
+            np.ndarray: Approximate embeddings.
+        """
+        if self._mode == "float16":
+            return np.asarray(codes, dtype=np.float32)
+        self._check_fitted()
+        return np.asarray(codes, dtype=np.float32) * self._scale
+
+    def prepare_query(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Transform query embeddings so that a dot product with the codes approximates
+        the dot product with the original embeddings.
+
+        Args:
+            query_embeddings (np.ndarray): Query embeddings of shape (n_dims,) or (n_queries, n_dims).
+
+        Returns:
+            np.ndarray: Transformed float32 query embeddings.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if self._mode == "float16":
+            return query_embeddings
+        self._check_fitted()
+        return query_embeddings * self._scale
+
+    def _check_fitted(self) -> None:
+        if self._scale is None:
+            raise ValueError("The int8 quantizer has to be fitted first")
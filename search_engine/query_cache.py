@@ -0,0 +1,276 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from search_engine.search_backends import SearchK
+
+
+def _result_key(query: str, n_items: int, kind: Optional[str], search_k: SearchK) -> Tuple:
+    """
+    Key of a neighbor list. `search_k` is the value resolved by `SearchBackend.resolve_search_k`, lists
+    searched with the default search_k keep their original keys.
+    """
+    key = (normalize_query(query), n_items) if kind is None else (normalize_query(query), n_items, kind)
+    return key if search_k is None else key + (search_k,)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query string so that trivially different spellings share a cache entry.
+    The text is NFKC normalized, Unicode case-folded and all whitespace runs are collapsed.
+
+    Args:
+        query (str): The raw query text.
+
+    Returns:
+        str: The normalized query text.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initialize a thread-safe least-recently-used cache with optional time-to-live.
+
+        Args:
+            max_size (int, optional): Maximum number of entries. Defaults to 1024.
+            ttl_seconds (Optional[float], optional): Entry lifetime in seconds, None keeps entries forever. Defaults to None.
+            clock (Callable[[], float], optional): Time source, used in tests. Defaults to time.monotonic.
+        """
+        if max_size <= 0:
+            raise ValueError("`max_size` must be a positive integer")
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+
+        Returns:
+            Dict[str, int]: Current size, hits, misses, size evictions and TTL expirations.
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value and mark it as recently used.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            Optional[Any]: The cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None and self._clock() - entry[0] > self._ttl:
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value to store.
+        """
+        with self._lock:
+            self._entries[key] = (self._clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        """
+        Remove all entries. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class QueryCache:
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = 3600.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initialize a cache of query embeddings and nearest neighbor lists.
+
+        Embeddings are keyed on the normalized query text, neighbor lists on the normalized
+        text and the number of requested items. Neighbor lists depend on the loaded index and
+        are dropped by `invalidate_results`, embeddings only depend on the model and are kept.
+
+        Args:
+            max_size (int, optional): Maximum number of entries in each of the two caches. Defaults to 1024.
+            ttl_seconds (Optional[float], optional): Entry lifetime in seconds, None keeps entries forever. Defaults to 3600.
+            clock (Callable[[], float], optional): Time source, used in tests. Defaults to time.monotonic.
+        """
+        self._embeddings = LRUCache(max_size, ttl_seconds, clock)
+        self._results = LRUCache(max_size, ttl_seconds, clock)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the counters of both caches.
+
+        Returns:
+            Dict[str, Dict[str, int]]: Counters of the embedding and the result cache.
+        """
+        return {'embeddings': self._embeddings.stats, 'results': self._results.stats}
+
+    def get_embedding(self, query: str) -> Optional[np.ndarray]:
+        """
+        Get the cached embedding of a query.
+
+        Args:
+            query (str): The query text.
+
+        Returns:
+            Optional[np.ndarray]: The embedding, or None if not cached.
+        """
+        return self._embeddings.get(normalize_query(query))
+
+    def put_embedding(self, query: str, embedding: np.ndarray) -> None:
+        """
+        Cache the embedding of a query. A read-only copy is stored.
+
+        Args:
+            query (str): The query text.
+            embedding (np.ndarray): The query embedding.
+        """
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        self._embeddings.put(normalize_query(query), embedding)
+
+    def get_results(self, query: str, n_items: int, search_k: SearchK = None) -> Optional[List[int]]:
+        """
+        Get the cached nearest neighbors of a query.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            search_k (SearchK, optional): The search_k or preset the neighbors were searched with. Defaults to None.
+
+        Returns:
+            Optional[List[int]]: Indices of the nearest neighbors, or None if not cached.
+        """
+        results = self._results.get(_result_key(query, n_items, None, search_k))
+        return list(results) if results is not None else None
+
+    def put_results(self, query: str, n_items: int, results: List[int], search_k: SearchK = None) -> None:
+        """
+        Cache the nearest neighbors of a query.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            results (List[int]): Indices of the nearest neighbors.
+            search_k (SearchK, optional): The search_k or preset they were searched with. Defaults to None.
+        """
+        self._results.put(_result_key(query, n_items, None, search_k), tuple(results))
+
+    def get_scored_results(self, query: str, n_items: int,
+                           search_k: SearchK = None) -> Optional[Tuple[List[int], List[float]]]:
+        """
+        Get the cached nearest neighbors of a query together with their similarity scores.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            search_k (SearchK, optional): The search_k or preset the neighbors were searched with. Defaults to None.
+
+        Returns:
+            Optional[Tuple[List[int], List[float]]]: Indices and scores of the nearest neighbors, or None if not cached.
+        """
+        results = self._results.get(_result_key(query, n_items, 'scored', search_k))
+        return (list(results[0]), list(results[1])) if results is not None else None
+
+    def put_scored_results(self, query: str, n_items: int, results: List[int], scores: List[float],
+                           search_k: SearchK = None) -> None:
+        """
+        Cache the nearest neighbors of a query together with their similarity scores.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            results (List[int]): Indices of the nearest neighbors.
+            scores (List[float]): Similarity scores of the nearest neighbors.
+            search_k (SearchK, optional): The search_k or preset they were searched with. Defaults to None.
+        """
+        self._results.put(_result_key(query, n_items, 'scored', search_k), (tuple(results), tuple(scores)))
+
+    def get_passage_results(self, query: str, n_items: int,
+                            search_k: SearchK = None) -> Optional[Tuple[List[int], List[float], List[int]]]:
+        """
+        Get the cached nearest neighbors of a query with their similarity scores and best passages.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            search_k (SearchK, optional): The search_k or preset the neighbors were searched with. Defaults to None.
+
+        Returns:
+            Optional[Tuple[List[int], List[float], List[int]]]: Indices, scores and passage ids, or None if not cached.
+        """
+        results = self._results.get(_result_key(query, n_items, 'passages', search_k))
+        return tuple(list(values) for values in results) if results is not None else None
+
+    def put_passage_results(self, query: str, n_items: int, results: List[int], scores: List[float],
+                            passage_ids: List[int], search_k: SearchK = None) -> None:
+        """
+        Cache the nearest neighbors of a query with their similarity scores and best passages.
+
+        Args:
+            query (str): The query text.
+            n_items (int): Number of requested items.
+            results (List[int]): Indices of the nearest neighbors.
+            scores (List[float]): Similarity scores of the nearest neighbors.
+            passage_ids (List[int]): Ids of the best passages, -1 for items without passages.
+            search_k (SearchK, optional): The search_k or preset they were searched with. Defaults to None.
+        """
+        self._results.put(_result_key(query, n_items, 'passages', search_k),
+                          (tuple(results), tuple(scores), tuple(passage_ids)))
+
+    def invalidate_results(self) -> None:
+        """
+        Drop all cached neighbor lists, e.g. after a new index has been loaded.
+        """
+        self._results.clear()
+
+    def clear(self) -> None:
+        """
+        Drop all cached embeddings and neighbor lists.
+        """
+        self._embeddings.clear()
+        self._results.clear()
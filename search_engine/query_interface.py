@@ -1,18 +1,63 @@
-from typing import List, Any
+from typing import List, Any, Optional, Tuple
 from annoy import AnnoyIndex
-import tensorflow as tf
+import numpy as np
+from search_engine.lazy import LazyModule
+from search_engine.delta_index import DeltaBackend
+from search_engine.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from search_engine.metrics import stage
+from search_engine.query_cache import QueryCache
+from search_engine.search_backends import AnnoyBackend, SearchBackend, SearchK
+
+tf = LazyModule("tensorflow")
+
+
+def _apply_min_score(results: Tuple[List, ...], min_score: Optional[float]) -> Tuple[List, ...]:
+    """
+    Cut results, sorted by descending score, before the first one scoring below `min_score`.
+
+    Args:
+        results (Tuple[List, ...]): Indices, scores and optionally further columns, one entry per result.
+        min_score (Optional[float]): The cutoff, None keeps all results.
+
+    Returns:
+        Tuple[List, ...]: The kept results.
+    """
+    if min_score is None:
+        return results
+    scores = results[1]
+    end = next((i for i, score in enumerate(scores) if score < min_score), len(scores))
+    return tuple(list(column[:end]) for column in results)
 
 class QueryInterface:
-    def __init__(self, annoy_index: AnnoyIndex, model: Any) -> None:
+    def __init__(self, annoy_index: Optional[AnnoyIndex], model: Any, cache: Optional[QueryCache] = None,
+                 backend: Optional[SearchBackend] = None, lexical_index: Optional[LexicalIndex] = None,
+                 hybrid_candidates: int = 50, rrf_k: float = 60.0) -> None:
         """
         Initialize the QueryInterface with an Annoy index and a model for generating embeddings.
 
         Args:
-            annoy_index (AnnoyIndex): The prebuilt Annoy index.
+            annoy_index (Optional[AnnoyIndex]): The prebuilt Annoy index, may be None if `backend` is given.
             model (Any): The model used to compute embeddings for queries.
+            cache (Optional[QueryCache], optional): Cache of query embeddings and results. Defaults to None.
+            backend (Optional[SearchBackend], optional): Search backend used instead of the Annoy index,
+                e.g. an ExactBackend. Defaults to an AnnoyBackend over `annoy_index`.
+            lexical_index (Optional[LexicalIndex], optional): BM25 index of the same songs, enables
+                `query_hybrid`. Defaults to None.
+            hybrid_candidates (int, optional): Results taken from each of the semantic and the lexical search
+                before they are fused. Defaults to 50.
+            rrf_k (float, optional): Rank damping of reciprocal rank fusion. Defaults to 60.
         """
+        if backend is None:
+            if annoy_index is None:
+                raise ValueError("Either `annoy_index` or `backend` is required")
+            backend = AnnoyBackend(annoy_index)
         self._model = model
         self._annoy_index = annoy_index
+        self._backend = backend
+        self._cache = cache
+        self._lexical_index = lexical_index
+        self._hybrid_candidates = hybrid_candidates
+        self._rrf_k = rrf_k
 
     @property
     def annoy_index(self) -> AnnoyIndex:
@@ -34,16 +79,321 @@ class QueryInterface:
         """
         return self._model
 
-    def query(self, query: str, n_items: int = 5) -> List[int]:
+    @property
+    def backend(self) -> SearchBackend:
+        """
+        Get the search backend.
+
+        Returns:
+            SearchBackend: The backend used for nearest neighbor search.
+        """
+        return self._backend
+
+    @property
+    def cache(self) -> Optional[QueryCache]:
         """
-        Query the Annoy index based on the input string and return the indices of nearest neighbors.
+        Get the query cache.
+
+        Returns:
+            Optional[QueryCache]: The query cache, or None if caching is disabled.
+        """
+        return self._cache
+
+    @property
+    def lexical_index(self) -> Optional[LexicalIndex]:
+        """
+        Get the lexical index.
+
+        Returns:
+            Optional[LexicalIndex]: The BM25 index, or None if hybrid search is disabled.
+        """
+        return self._lexical_index
+
+    def _cache_search_k(self, search_k: SearchK, n_items: int) -> SearchK:
+        """
+        search_k part of the cache keys, resolved by the backend so equivalent values share entries.
+        """
+        return self._backend.resolve_search_k(search_k, n_items)
+
+    def query(self, query: str, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        """
+        Query the search backend based on the input string and return the indices of nearest neighbors.
 
         Args:
             query (str): The input query text.
             n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off of approximate backends, a number of
+                candidates or a name from SEARCH_PRESETS. Defaults to None, the backend's default.
 
         Returns:
             List[int]: List of indices of the nearest neighbors.
         """
-        query_embedding = self._model([query])
-        return self._annoy_index.get_nns_by_vector(tf.squeeze(query_embedding), n=n_items)
+        if self._cache is None:
+            with stage("embed"):
+                query_embedding = tf.squeeze(self._model([query]))
+            with stage("search"):
+                return self._backend.search(query_embedding, n_items, search_k)
+
+        results = self._cache.get_results(query, n_items, self._cache_search_k(search_k, n_items))
+        if results is None:
+            results = self.search(self.embed([query])[0], n_items, search_k)
+            self._cache.put_results(query, n_items, results, self._cache_search_k(search_k, n_items))
+        return results
+
+    def query_with_scores(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                          min_score: Optional[float] = None) -> Tuple[List[int], List[float]]:
+        """
+        Query the search backend and return the nearest neighbors with their cosine similarity.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+            min_score (Optional[float], optional): Drop neighbors with a lower cosine similarity, so fewer than
+                `n_items` may be returned. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float]]: Indices of the nearest neighbors and their similarity scores.
+        """
+        results = self.get_cached_scored_results(query, n_items, search_k)
+        if results is None:
+            results = self.search_with_scores(self.embed([query])[0], n_items, search_k)
+            self.store_scored_results(query, n_items, *results, search_k=search_k)
+        return _apply_min_score(results, min_score)
+
+    def query_with_passages(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                            min_score: Optional[float] = None) -> Tuple[List[int], List[float], List[Optional[str]]]:
+        """
+        Query the search backend and return the nearest neighbors with their similarity and the passage
+        that matched best. Passage backends aggregate hits per song, other backends return no passages.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+            min_score (Optional[float], optional): Drop neighbors with a lower cosine similarity. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float], List[Optional[str]]]: Indices of the nearest neighbors, their similarity
+                scores and the text of their best passage, None where there is none.
+        """
+        results = None
+        if self._cache is not None:
+            results = self._cache.get_passage_results(query, n_items, self._cache_search_k(search_k, n_items))
+        if results is None:
+            query_embedding = self.embed([query])[0]
+            with stage("search"):
+                results = self._backend.search_with_passages(query_embedding, n_items, search_k)
+            if self._cache is not None:
+                self._cache.put_passage_results(query, n_items, *results,
+                                                search_k=self._cache_search_k(search_k, n_items))
+        indices, scores, passage_ids = _apply_min_score(results, min_score)
+        return indices, scores, [self._backend.passage_text(passage_id) for passage_id in passage_ids]
+
+    def query_hybrid(self, query: str, n_items: int = 5, search_k: SearchK = None,
+                     min_score: Optional[float] = None) -> Tuple[List[int], List[float], List[Optional[str]]]:
+        """
+        Query both the search backend and the lexical index and fuse the two rankings with reciprocal
+        rank fusion, so songs containing the exact words of the query are found even when their
+        embedding is not among the nearest neighbors.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off of the semantic search, see `query`.
+                Defaults to None.
+            min_score (Optional[float], optional): Minimum cosine similarity of semantic candidates, lexical
+                matches are kept. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float], List[Optional[str]]]: Indices of the best items, their fused scores
+                and the text of their best passage, None where there is none.
+        """
+        if self._lexical_index is None:
+            raise ValueError("Hybrid search requires a lexical index")
+        candidates = max(n_items, self._hybrid_candidates)
+        semantic, _, passages = self.query_with_passages(query, candidates, search_k, min_score)
+        # The lexical index is rebuilt offline, removed songs stay in it and are dropped here
+        tombstones = self._backend.delta.tombstones if isinstance(self._backend, DeltaBackend) else frozenset()
+        with stage("lexical"):
+            lexical, _ = self._lexical_index.search(query, candidates + len(tombstones))
+        lexical = [index for index in lexical if index not in tombstones][:candidates]
+        indices, scores = reciprocal_rank_fusion([semantic, lexical], n_items, k=self._rrf_k)
+        passage_by_index = dict(zip(semantic, passages))
+        return indices, scores, [passage_by_index.get(index) for index in indices]
+
+    def embed(self, queries: List[str]) -> np.ndarray:
+        """
+        Compute embeddings for several query strings in a single model call.
+        With a cache, only queries without a cached embedding are passed to the model.
+
+        Args:
+            queries (List[str]): The input query texts.
+
+        Returns:
+            np.ndarray: Array of shape (len(queries), n_dims) with one embedding per query.
+        """
+        if self._cache is None:
+            with stage("embed"):
+                return np.asarray(self._model(list(queries)), dtype=np.float32)
+
+        cached = [self._cache.get_embedding(query) for query in queries]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        if missing:
+            with stage("embed"):
+                computed = np.asarray(self._model([queries[i] for i in missing]), dtype=np.float32)
+            for i, embedding in zip(missing, computed):
+                self._cache.put_embedding(queries[i], embedding)
+                cached[i] = embedding
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        """
+        Search the backend with an already computed query embedding.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+
+        Returns:
+            List[int]: List of indices of the nearest neighbors.
+        """
+        with stage("search"):
+            return self._backend.search(query_embedding, n_items, search_k)
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        """
+        Search the backend with an already computed query embedding and return similarity scores.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float]]: Indices of the nearest neighbors and their similarity scores.
+        """
+        with stage("search"):
+            return self._backend.search_with_scores(query_embedding, n_items, search_k)
+
+    def query_batch(self, queries: List[str], n_items: int = 5, search_k: SearchK = None) -> List[List[int]]:
+        """
+        Query the search backend with several strings at once. All queries are embedded
+        in a single model call and searched with one backend call.
+
+        Args:
+            queries (List[str]): The input query texts.
+            n_items (int, optional): Number of nearest items to return per query. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+
+        Returns:
+            List[List[int]]: Indices of the nearest neighbors, one list per query, in input order.
+        """
+        if not queries:
+            return []
+        if self._cache is None:
+            query_embeddings = self.embed(queries)
+            with stage("search"):
+                return self._backend.search_batch(query_embeddings, n_items, search_k)
+
+        cache_search_k = self._cache_search_k(search_k, n_items)
+        results = [self._cache.get_results(query, n_items, cache_search_k) for query in queries]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            query_embeddings = self.embed([queries[i] for i in missing])
+            with stage("search"):
+                found = self._backend.search_batch(query_embeddings, n_items, search_k)
+            for i, result in zip(missing, found):
+                results[i] = result
+                self._cache.put_results(queries[i], n_items, result, cache_search_k)
+        return results
+
+    def query_batch_with_scores(self, queries: List[str], n_items: int = 5, search_k: SearchK = None,
+                                min_score: Optional[float] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Query the search backend with several strings at once and return similarity scores.
+        All queries missing from the cache are embedded in a single model call and searched with one backend call.
+
+        Args:
+            queries (List[str]): The input query texts.
+            n_items (int, optional): Number of nearest items to return per query. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `query`. Defaults to None.
+            min_score (Optional[float], optional): Drop neighbors with a lower cosine similarity. Defaults to None.
+
+        Returns:
+            List[Tuple[List[int], List[float]]]: Indices and scores of the nearest neighbors, one pair per query.
+        """
+        results = [self.get_cached_scored_results(query, n_items, search_k) for query in queries]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            embeddings = self.embed([queries[i] for i in missing])
+            with stage("search"):
+                found = self._backend.search_batch_with_scores(embeddings, n_items, search_k)
+            for i, result in zip(missing, found):
+                results[i] = result
+                self.store_scored_results(queries[i], n_items, *results[i], search_k=search_k)
+        return [_apply_min_score(result, min_score) for result in results]
+
+    def get_cached_results(self, query: str, n_items: int = 5, search_k: SearchK = None) -> Optional[List[int]]:
+        """
+        Get the cached nearest neighbors of a query without computing anything.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of nearest items. Defaults to 5.
+            search_k (SearchK, optional): The search_k or preset of the search. Defaults to None.
+
+        Returns:
+            Optional[List[int]]: Indices of the nearest neighbors, or None if not cached or caching is disabled.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.get_results(query, n_items, self._cache_search_k(search_k, n_items))
+
+    def store_results(self, query: str, n_items: int, results: List[int], search_k: SearchK = None) -> None:
+        """
+        Store nearest neighbors computed outside of `query`, e.g. by a batcher. Does nothing without a cache.
+
+        Args:
+            query (str): The input query text.
+            n_items (int): Number of nearest items.
+            results (List[int]): Indices of the nearest neighbors.
+            search_k (SearchK, optional): The search_k or preset of the search. Defaults to None.
+        """
+        if self._cache is not None:
+            self._cache.put_results(query, n_items, results, self._cache_search_k(search_k, n_items))
+
+    def get_cached_scored_results(self, query: str, n_items: int = 5,
+                                  search_k: SearchK = None) -> Optional[Tuple[List[int], List[float]]]:
+        """
+        Get the cached nearest neighbors of a query with their similarity scores without computing anything.
+
+        Args:
+            query (str): The input query text.
+            n_items (int, optional): Number of nearest items. Defaults to 5.
+            search_k (SearchK, optional): The search_k or preset of the search. Defaults to None.
+
+        Returns:
+            Optional[Tuple[List[int], List[float]]]: Indices and scores, or None if not cached or caching is disabled.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.get_scored_results(query, n_items, self._cache_search_k(search_k, n_items))
+
+    def store_scored_results(self, query: str, n_items: int, results: List[int], scores: List[float],
+                             search_k: SearchK = None) -> None:
+        """
+        Store nearest neighbors and their similarity scores computed outside of `query_with_scores`.
+        Does nothing without a cache.
+
+        Args:
+            query (str): The input query text.
+            n_items (int): Number of nearest items.
+            results (List[int]): Indices of the nearest neighbors.
+            scores (List[float]): Similarity scores of the nearest neighbors.
+            search_k (SearchK, optional): The search_k or preset of the search. Defaults to None.
+        """
+        if self._cache is not None:
+            self._cache.put_scored_results(query, n_items, results, scores, self._cache_search_k(search_k, n_items))
@@ -0,0 +1,408 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple, Union
+from annoy import AnnoyIndex
+import numpy as np
+from search_engine.quantization import ScalarQuantizer
+
+# Named recall/latency trade-offs accepted wherever a `search_k` is, see `annoy_search_k`
+SEARCH_PRESETS = ("fast", "balanced", "exact")
+# Annoy's default search_k is n_items * n_trees, the fast preset inspects this fraction of it
+FAST_SEARCH_K_FRACTION = 0.25
+
+SearchK = Optional[Union[int, str]]
+
+
+def annoy_search_k(search_k: SearchK, n_items: int, n_trees: int, n_total: int) -> int:
+    """
+    Resolve a search_k or preset to the `search_k` argument of Annoy, the number of candidate items
+    collected from the trees before they are ranked exactly. "balanced" is Annoy's default of
+    n_items * n_trees, "fast" a quarter of it and "exact" collects every item of every tree.
+
+    Args:
+        search_k (SearchK): A positive number, -1 or None for Annoy's default, or a name from SEARCH_PRESETS.
+        n_items (int): Number of requested items.
+        n_trees (int): Number of trees of the index.
+        n_total (int): Number of items of the index.
+
+    Returns:
+        int: The Annoy search_k, -1 for Annoy's default.
+    """
+    if search_k is None or search_k == "balanced":
+        return -1
+    if search_k == "fast":
+        return max(n_items, int(n_items * n_trees * FAST_SEARCH_K_FRACTION))
+    if search_k == "exact":
+        return max(n_items, n_trees * n_total)
+    if isinstance(search_k, str):
+        raise ValueError(f"Unknown search preset: {search_k}, expected one of {SEARCH_PRESETS}")
+    if isinstance(search_k, bool) or not isinstance(search_k, (int, np.integer)) or (search_k <= 0 and search_k != -1):
+        raise ValueError(f"`search_k` must be a positive integer, -1 or a preset, got {search_k!r}")
+    return int(search_k)
+
+
+def _normalize(query_embeddings: np.ndarray) -> np.ndarray:
+    """
+    L2 normalize query embeddings along the last axis.
+
+    Args:
+        query_embeddings (np.ndarray): Embeddings of shape (n_dims,) or (n_queries, n_dims).
+
+    Returns:
+        np.ndarray: Normalized float32 embeddings.
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    norms = np.linalg.norm(query_embeddings, axis=-1, keepdims=True)
+    return query_embeddings / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, n_items: int) -> np.ndarray:
+    """
+    Select indices of the highest scores along the last axis, sorted by descending score.
+
+    Args:
+        scores (np.ndarray): Scores of shape (n,) or (n_queries, n).
+        n_items (int): Number of indices to select.
+
+    Returns:
+        np.ndarray: Selected indices.
+    """
+    n_items = min(n_items, scores.shape[-1])
+    if n_items <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if n_items < scores.shape[-1]:
+        candidates = np.argpartition(-scores, n_items - 1, axis=-1)[..., :n_items]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class SearchBackend(ABC):
+    """
+    Nearest neighbor search over a fixed set of embeddings, used by QueryInterface.
+    """
+
+    @abstractmethod
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        """
+        Find the items closest to a query embedding.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off of approximate backends, a number of
+                candidates or a name from SEARCH_PRESETS. Brute-force backends ignore it. Defaults to None,
+                the backend's default.
+
+        Returns:
+            List[int]: Indices of the nearest items, closest first.
+        """
+
+    @abstractmethod
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        """
+        Find the items closest to a query embedding together with their cosine similarity.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `search`. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float]]: Indices of the nearest items, closest first, and their cosine similarities.
+        """
+
+    def search_batch(self, query_embeddings: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[List[int]]:
+        """
+        Find the items closest to each of several query embeddings.
+
+        Args:
+            query_embeddings (np.ndarray): Query embeddings, one per row.
+            n_items (int, optional): Number of nearest items to return per query. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `search`. Defaults to None.
+
+        Returns:
+            List[List[int]]: Indices of the nearest items, one list per query.
+        """
+        return [self.search(query_embedding, n_items, search_k) for query_embedding in query_embeddings]
+
+    def search_batch_with_scores(self, query_embeddings: np.ndarray, n_items: int = 5,
+                                 search_k: SearchK = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Find the items closest to each of several query embeddings together with their cosine similarities.
+
+        Args:
+            query_embeddings (np.ndarray): Query embeddings, one per row.
+            n_items (int, optional): Number of nearest items to return per query. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `search`. Defaults to None.
+
+        Returns:
+            List[Tuple[List[int], List[float]]]: Indices and similarities of the nearest items, one pair per query.
+        """
+        return [self.search_with_scores(query_embedding, n_items, search_k) for query_embedding in query_embeddings]
+
+    def search_with_passages(self, query_embedding: np.ndarray, n_items: int = 5,
+                             search_k: SearchK = None) -> Tuple[List[int], List[float], List[int]]:
+        """
+        Find the items closest to a query embedding together with their best matching passage.
+        Backends that index whole songs return -1 as the passage of every item.
+
+        Args:
+            query_embedding (np.ndarray): A single query embedding.
+            n_items (int, optional): Number of nearest items to return. Defaults to 5.
+            search_k (SearchK, optional): Recall/latency trade-off, see `search`. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float], List[int]]: Indices of the nearest items, their cosine similarities
+                and the ids of their best passages.
+        """
+        indices, scores = self.search_with_scores(query_embedding, n_items, search_k)
+        return indices, scores, [-1] * len(indices)
+
+    def resolve_search_k(self, search_k: SearchK, n_items: int = 5) -> SearchK:
+        """
+        Resolve a search_k or preset to the value the backend searches with, so cached results are shared
+        by requests that search the same way, e.g. "balanced", -1 and None.
+
+        Args:
+            search_k (SearchK): The search_k or preset of a request.
+            n_items (int, optional): Number of requested items. Defaults to 5.
+
+        Returns:
+            SearchK: None if the backend searches with its default, the resolved search_k otherwise.
+                Brute-force backends ignore search_k and always return None.
+        """
+        return None
+
+    def passage_text(self, passage_id: int) -> Optional[str]:
+        """
+        Get the text of a passage returned by `search_with_passages`.
+
+        Args:
+            passage_id (int): The passage id.
+
+        Returns:
+            Optional[str]: The passage text, or None if the backend does not index passages.
+        """
+        return None
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Get the number of searchable items.
+        """
+
+
+class AnnoyBackend(SearchBackend):
+    def __init__(self, annoy_index: AnnoyIndex) -> None:
+        """
+        Approximate search backend using an Annoy index.
+
+        Args:
+            annoy_index (AnnoyIndex): The prebuilt Annoy index.
+        """
+        self._annoy_index = annoy_index
+
+    @property
+    def annoy_index(self) -> AnnoyIndex:
+        """
+        Get the Annoy index.
+
+        Returns:
+            AnnoyIndex: The Annoy index.
+        """
+        return self._annoy_index
+
+    def _nns_by_vector(self, query_embedding: np.ndarray, n_items: int, search_k: SearchK,
+                       include_distances: bool = False):
+        search_k = annoy_search_k(search_k, n_items, self._annoy_index.get_n_trees(), self._annoy_index.get_n_items())
+        if not isinstance(query_embedding, (list, np.ndarray)):
+            # Annoy reads the vector element by element, which costs a TensorFlow op per element of a tensor
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        kwargs = {'include_distances': True} if include_distances else {}
+        if search_k != -1:
+            kwargs['search_k'] = search_k
+        return self._annoy_index.get_nns_by_vector(query_embedding, n=n_items, **kwargs)
+
+    def resolve_search_k(self, search_k: SearchK, n_items: int = 5) -> SearchK:
+        search_k = annoy_search_k(search_k, n_items, self._annoy_index.get_n_trees(), self._annoy_index.get_n_items())
+        return None if search_k == -1 else search_k
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        return self._nns_by_vector(query_embedding, n_items, search_k)
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        indices, distances = self._nns_by_vector(query_embedding, n_items, search_k, include_distances=True)
+        # Annoy's angular distance is sqrt(2 - 2 * cos) of the normalized vectors.
+        return indices, [1.0 - distance * distance / 2.0 for distance in distances]
+
+    def __len__(self) -> int:
+        return self._annoy_index.get_n_items()
+
+
+class ExactBackend(SearchBackend):
+    def __init__(self, embeddings: np.ndarray, normalized: bool = True) -> None:
+        """
+        Exact brute-force search backend. Cosine similarity to every item is computed with a single
+        matrix-vector product and the top items are selected with `np.argpartition`, so results have
+        no recall loss. Suited to corpora small enough to keep the embedding matrix in memory.
+
+        Args:
+            embeddings (np.ndarray): Embedding matrix of shape (n, n_dims), e.g. `DataPipeline.embeddings`
+                or a memory-mapped `FlatEmbeddingStore.embeddings`.
+            normalized (bool, optional): Whether rows are already L2 normalized, as produced by
+                `DataPipeline.compute_embeddings`. Otherwise a normalized copy is made. Defaults to True.
+        """
+        if embeddings.ndim != 2:
+            raise ValueError("Embeddings must be a 2D matrix")
+        if embeddings.dtype != np.float32:
+            embeddings = embeddings.astype(np.float32)
+        if not normalized:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        self._embeddings = embeddings
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        Get the searched embedding matrix.
+
+        Returns:
+            np.ndarray: The embedding matrix.
+        """
+        return self._embeddings
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        scores = self._embeddings @ _normalize(query_embedding)
+        return _top_k(scores, n_items).tolist()
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        scores = self._embeddings @ _normalize(query_embedding)
+        indices = _top_k(scores, n_items)
+        return indices.tolist(), scores[indices].tolist()
+
+    def search_batch(self, query_embeddings: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[List[int]]:
+        query_embeddings = _normalize(query_embeddings)
+        if query_embeddings.shape[0] == 0:
+            return []
+        scores = query_embeddings @ self._embeddings.T
+        return _top_k(scores, n_items).tolist()
+
+    def search_batch_with_scores(self, query_embeddings: np.ndarray, n_items: int = 5,
+                                 search_k: SearchK = None) -> List[Tuple[List[int], List[float]]]:
+        query_embeddings = _normalize(query_embeddings)
+        if query_embeddings.shape[0] == 0:
+            return []
+        scores = query_embeddings @ self._embeddings.T
+        indices = _top_k(scores, n_items)
+        return [(row.tolist(), row_scores[row].tolist()) for row, row_scores in zip(indices, scores)]
+
+    def __len__(self) -> int:
+        return int(self._embeddings.shape[0])
+
+
+class QuantizedBackend(SearchBackend):
+    def __init__(self, codes: np.ndarray, quantizer: ScalarQuantizer, rerank_embeddings: Optional[np.ndarray] = None,
+                 rerank_candidates: int = 50, block_size: int = 512) -> None:
+        """
+        Brute-force search backend over scalar quantized embeddings. Candidates are scored on the
+        int8 or float16 codes, which take 4x or 2x less memory than float32. Optionally the best
+        candidates are rescored with the exact float32 embeddings, which are only read for those rows.
+
+        Args:
+            codes (np.ndarray): Quantized embeddings of shape (n, n_dims), e.g. `FlatEmbeddingStore.quantized_embeddings`.
+            quantizer (ScalarQuantizer): The quantizer that produced the codes.
+            rerank_embeddings (Optional[np.ndarray], optional): Normalized float32 embeddings used for reranking,
+                typically memory-mapped. Defaults to None, which disables reranking.
+            rerank_candidates (int, optional): Number of candidates rescored exactly. Defaults to 50.
+            block_size (int, optional): Rows converted to float32 and scored at once. Small blocks keep the
+                converted rows in CPU cache. Defaults to 512.
+        """
+        if codes.ndim != 2:
+            raise ValueError("Codes must be a 2D matrix")
+        if rerank_embeddings is not None and rerank_embeddings.shape != codes.shape:
+            raise ValueError("Rerank embeddings must have the same shape as the codes")
+        self._codes = codes
+        self._quantizer = quantizer
+        self._rerank_embeddings = rerank_embeddings
+        self._rerank_candidates = rerank_candidates
+        self._block_size = block_size
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+        Get the quantized embeddings.
+
+        Returns:
+            np.ndarray: The codes.
+        """
+        return self._codes
+
+    def _approximate_scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Score all items on the codes, block by block.
+
+        Args:
+            query_embeddings (np.ndarray): Normalized queries of shape (n_queries, n_dims).
+
+        Returns:
+            np.ndarray: Scores of shape (n_queries, n).
+        """
+        prepared = self._quantizer.prepare_query(query_embeddings)
+        scores = np.empty((prepared.shape[0], self._codes.shape[0]), dtype=np.float32)
+        buffer = np.empty((min(self._block_size, self._codes.shape[0]), self._codes.shape[1]), dtype=np.float32)
+        for start in range(0, self._codes.shape[0], self._block_size):
+            codes = self._codes[start:start + self._block_size]
+            block = buffer[:codes.shape[0]]
+            np.copyto(block, codes, casting='unsafe')
+            np.matmul(prepared, block.T, out=scores[:, start:start + codes.shape[0]])
+        return scores
+
+    def search(self, query_embedding: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[int]:
+        return self.search_batch(np.asarray(query_embedding)[None, :], n_items)[0]
+
+    def search_with_scores(self, query_embedding: np.ndarray, n_items: int = 5,
+                           search_k: SearchK = None) -> Tuple[List[int], List[float]]:
+        return self._search_batch_with_scores(np.asarray(query_embedding)[None, :], n_items)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, n_items: int = 5, search_k: SearchK = None) -> List[List[int]]:
+        return [indices for indices, _ in self._search_batch_with_scores(query_embeddings, n_items)]
+
+    def search_batch_with_scores(self, query_embeddings: np.ndarray, n_items: int = 5,
+                                 search_k: SearchK = None) -> List[Tuple[List[int], List[float]]]:
+        return self._search_batch_with_scores(query_embeddings, n_items)
+
+    def _search_batch_with_scores(self, query_embeddings: np.ndarray,
+                                  n_items: int) -> List[Tuple[List[int], List[float]]]:
+        """
+        Search several queries, scoring on the codes and optionally reranking with float32 embeddings.
+
+        Args:
+            query_embeddings (np.ndarray): Query embeddings, one per row.
+            n_items (int): Number of nearest items to return per query.
+
+        Returns:
+            List[Tuple[List[int], List[float]]]: Indices and similarities, one pair per query.
+        """
+        query_embeddings = _normalize(query_embeddings)
+        if query_embeddings.shape[0] == 0:
+            return []
+        scores = self._approximate_scores(query_embeddings)
+        if self._rerank_embeddings is None:
+            indices = _top_k(scores, n_items)
+            return [(row.tolist(), row_scores[row].tolist()) for row, row_scores in zip(indices, scores)]
+
+        candidates = _top_k(scores, max(n_items, self._rerank_candidates))
+        results = []
+        for query_embedding, query_candidates in zip(query_embeddings, candidates):
+            ordered = np.sort(query_candidates)  # sequential reads from the memory map
+            exact_scores = np.asarray(self._rerank_embeddings[ordered], dtype=np.float32) @ query_embedding
+            top = _top_k(exact_scores, n_items)
+            results.append((ordered[top].tolist(), exact_scores[top].tolist()))
+        return results
+
+    def __len__(self) -> int:
+        return int(self._codes.shape[0])
@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from data_gathering.corpus_exporter import CorpusExporter, iter_song_files
+from search_engine.embedding_store import TextColumn
+from search_engine.lexical_index import LexicalIndex
+
+
+class TestCorpusExporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lyrics_dir = os.path.join(self.temp_dir, "lyrics")
+        self.songs = {
+            "Zespół": {"b.json": {"title": "Druga", "lyrics": "linia 1\nlinia 2"}, "a.json": {"title": "Pierwsza", "lyrics": "tab\there"}},
+            "Artist": {"c.json": {"title": "Only", "lyrics": "la la"}, "missing.json": {"title": "No lyrics"}},
+        }
+        for artist, files in self.songs.items():
+            os.makedirs(os.path.join(self.lyrics_dir, artist))
+            for filename, data in files.items():
+                with open(os.path.join(self.lyrics_dir, artist, filename), "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+        with open(os.path.join(self.lyrics_dir, "Artist", "broken.json"), "w", encoding="utf-8") as f:
+            f.write("{broken")
+        self.expected = [
+            {"artist": "Artist", "title": "Only", "lyrics": "la la", "index": 0},
+            {"artist": "Zespół", "title": "Pierwsza", "lyrics": "tab\there", "index": 1},
+            {"artist": "Zespół", "title": "Druga", "lyrics": "linia 1\nlinia 2", "index": 2},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def test_file_order(self):
+        files = [os.path.basename(path) for _, path in iter_song_files(self.lyrics_dir)]
+        self.assertEqual(files, ["broken.json", "c.json", "missing.json", "a.json", "b.json"])
+
+    def test_outputs_share_indexes(self):
+        with self.assertLogs(level="WARNING"):
+            count = CorpusExporter(self.lyrics_dir).export(
+                json_path=self._path("lyrics.json"), jsonl_path=self._path("lyrics.jsonl"),
+                tsv_path=self._path("lyrics.tsv"), columnar_path=self._path("columnar"),
+                lexical_path=self._path("lexical")
+            )
+        self.assertEqual(count, 3)
+        with open(self._path("lyrics.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f), self.expected)
+        with open(self._path("lyrics.jsonl"), encoding="utf-8") as f:
+            self.assertEqual([json.loads(line) for line in f], self.expected)
+        with open(self._path("lyrics.tsv"), newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f, delimiter="\t"))
+        self.assertEqual([(row["Artist"], row["Title"], row["Lyrics"], int(row["Index"])) for row in rows],
+                         [(song["artist"], song["title"], song["lyrics"], song["index"]) for song in self.expected])
+        column = TextColumn.open(self._path("columnar/lyrics.bin"), self._path("columnar/lyrics.offsets.npy"))
+        self.assertEqual(list(column), [song["lyrics"] for song in self.expected])
+        with open(self._path("columnar/schema.json")) as f:
+            self.assertEqual(json.load(f)["count"], 3)
+        lexical_index = LexicalIndex(self._path("lexical"))
+        self.assertEqual(len(lexical_index), 3)
+        self.assertEqual(lexical_index.search("linia", 5)[0], [2])
+
+    def test_parallel_reads_keep_order(self):
+        with self.assertLogs(level="WARNING"):
+            songs = list(CorpusExporter(self.lyrics_dir, workers=4, chunk_size=2).iter_songs())
+        self.assertEqual(songs, self.expected)
+
+    def test_empty_corpus(self):
+        empty_dir = self._path("empty")
+        os.makedirs(empty_dir)
+        self.assertEqual(CorpusExporter(empty_dir).export(json_path=self._path("empty.json")), 0)
+        with open(self._path("empty.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,12 @@
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
-from data_gathering.lyrics_fetcher import LyricsFetcher
+from requests.exceptions import HTTPError, Timeout
+from data_gathering.lyrics_fetcher import LyricsFetcher, RateLimitedGenius
 import json
+import os
+import tempfile
+import threading
+import time
 
 class TestLyricsFetcher(unittest.TestCase):
 
@@ -31,4 +36,135 @@ class TestLyricsFetcher(unittest.TestCase):
         mock_song.lyrics = "[Intro]\nLyrics line 1\nLyrics line 2"
         mock_artist_query = MagicMock()
         mock_artist_query.songs = [mock_song]
-        mock_search_artist.side_effect = [mock_artist_query, None]
\ No newline at end of file
+        mock_search_artist.side_effect = [mock_artist_query, None]
+
+class StubSong:
+    def __init__(self, title, lyrics):
+        self.title = title
+        self.lyrics = lyrics
+
+
+class StubArtist:
+    def __init__(self, songs):
+        self.songs = songs
+
+
+class StubGenius:
+    """
+    Local stand-in for the Genius client, records the threads that used it.
+    """
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def search_artist(self, artist_name, max_songs, sort):
+        with self.lock:
+            self.threads.add(threading.get_ident())
+        time.sleep(0.01)
+        if artist_name in self.failing:
+            raise TimeoutError("Request timed out")
+        if artist_name == "Unknown":
+            return None
+        return StubArtist([StubSong(f"Song {i}", f"[Verse]\n{artist_name} line {i}") for i in range(max_songs)]
+                          + [StubSong("Instrumental", "")])
+
+
+class StubLyricsFetcher(LyricsFetcher):
+    def __init__(self, artists, genius):
+        self.stub = genius
+        super().__init__("fake_api_token", artists)
+
+    def _set_up(self):
+        return self.stub
+
+
+class TestConcurrentFetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lyrics_dir = os.path.join(self.tmp.name, "lyrics")
+        self.checkpoint = os.path.join(self.tmp.name, "done.txt")
+        self.artists = [f"Artist{i}" for i in range(12)] + ["Unknown", "", "Artist0"]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_concurrent_fetch(self):
+        genius = StubGenius()
+        fetcher = StubLyricsFetcher(self.artists, genius)
+        stats = fetcher.fetch_songs(songs_per_artist=2, workers=4, lyrics_dir=self.lyrics_dir,
+                                    checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['artists'], 13)
+        self.assertEqual(stats['songs'], 24)
+        self.assertEqual(stats['failed'], [])
+        self.assertGreater(len(genius.threads), 1)
+        with open(os.path.join(self.lyrics_dir, "Artist3", "Song 1.json"), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {"title": "Song 1", "lyrics": "Artist3 line 1"})
+
+    def test_resume_from_checkpoint(self):
+        fetcher = StubLyricsFetcher(self.artists, StubGenius(failing={"Artist5"}))
+        stats = fetcher.fetch_songs(songs_per_artist=1, workers=3, lyrics_dir=self.lyrics_dir,
+                                    checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['failed'], ["Artist5"])
+        self.assertEqual(stats['artists'], 12)
+
+        genius = StubGenius()
+        resumed = StubLyricsFetcher(self.artists, genius)
+        stats = resumed.fetch_songs(songs_per_artist=1, workers=3, lyrics_dir=self.lyrics_dir,
+                                    checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['skipped'], 12)
+        self.assertEqual(stats['artists'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.lyrics_dir, "Artist5", "Song 0.json")))
+
+    def test_serial_fetch_records_failures(self):
+        fetcher = StubLyricsFetcher(["Artist1", "Artist2"], StubGenius(failing={"Artist1"}))
+        stats = fetcher.fetch_songs(songs_per_artist=1, lyrics_dir=self.lyrics_dir)
+        self.assertEqual(stats['failed'], ["Artist1"])
+        self.assertEqual(stats['songs'], 1)
+
+    def test_error_while_saving_songs_is_not_checkpointed(self):
+        genius = StubGenius()
+        # The second title is not a valid file name, it fails after the first song was saved
+        genius.search_artist = lambda **kwargs: StubArtist([StubSong("Fine", "la la"), StubSong("a/b", "la")])
+        fetcher = StubLyricsFetcher(["Artist1"], genius)
+        stats = fetcher.fetch_songs(songs_per_artist=2, lyrics_dir=self.lyrics_dir, checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['failed'], ["Artist1"])
+        self.assertEqual(stats['artists'], 0)
+        self.assertEqual(fetcher._load_checkpoint(self.checkpoint), set())
+
+
+class TestRateLimitedGenius(unittest.TestCase):
+    @patch("lyricsgenius.api.base.Sender._make_request")
+    def test_retries_after_too_many_requests(self, mock_make_request):
+        mock_make_request.side_effect = [HTTPError(429, "Too many requests"), {"song": 1}]
+        limiter = MagicMock()
+        genius = RateLimitedGenius("fake_api_token", rate_limiter=limiter, retries=1, retry_after=5)
+        self.assertEqual(genius._make_request("songs/1"), {"song": 1})
+        self.assertEqual(limiter.acquire.call_count, 2)
+        limiter.pause.assert_called_once_with(5)
+
+    @patch("lyricsgenius.api.base.Sender._make_request")
+    def test_other_errors_are_raised(self, mock_make_request):
+        mock_make_request.side_effect = HTTPError(404, "Not found")
+        genius = RateLimitedGenius("fake_api_token", rate_limiter=MagicMock(), retries=3)
+        with self.assertRaises(HTTPError):
+            genius._make_request("songs/1")
+
+    @patch("lyricsgenius.api.base.Sender._make_request")
+    def test_timeouts_are_retried_with_a_token_per_attempt(self, mock_make_request):
+        mock_make_request.side_effect = [Timeout("timed out"), HTTPError(503, "Unavailable"), {"song": 1}]
+        limiter = MagicMock()
+        genius = RateLimitedGenius("fake_api_token", rate_limiter=limiter, retries=2)
+        self.assertEqual(genius.retries, 0)  # lyricsgenius must not retry past the limiter
+        self.assertEqual(genius._make_request("songs/1"), {"song": 1})
+        self.assertEqual(limiter.acquire.call_count, 3)
+        limiter.pause.assert_not_called()
+
+    @patch("lyricsgenius.api.base.Sender._make_request")
+    def test_timeouts_are_raised_after_the_last_retry(self, mock_make_request):
+        mock_make_request.side_effect = Timeout("timed out")
+        limiter = MagicMock()
+        genius = RateLimitedGenius("fake_api_token", rate_limiter=limiter, retries=1)
+        with self.assertRaises(Timeout):
+            genius._make_request("songs/1")
+        self.assertEqual(limiter.acquire.call_count, 2)
@@ -0,0 +1,74 @@
+import threading
+import unittest
+from data_gathering.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=2, capacity=3, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_up_to_capacity(self):
+        self.assertTrue(all(self.bucket.try_acquire() for _ in range(3)))
+        self.assertFalse(self.bucket.try_acquire())
+        self.clock.now += 0.5
+        self.assertTrue(self.bucket.try_acquire())
+
+    def test_acquire_waits_for_refill(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        self.bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 0.5)
+        for _ in range(4):
+            self.bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 2.5)
+
+    def test_acquire_timeout(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertFalse(self.bucket.acquire(timeout=0.1))
+        self.assertTrue(self.bucket.acquire(timeout=1))
+
+    def test_pause(self):
+        self.bucket.pause(10)
+        self.assertFalse(self.bucket.try_acquire())
+        self.bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 10.5)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+        with self.assertRaises(ValueError):
+            self.bucket.acquire(tokens=4)
+
+    def test_threads_share_the_limit(self):
+        bucket = TokenBucket(rate=1, capacity=5, clock=self.clock)
+        acquired = []
+
+        def worker():
+            while bucket.try_acquire():
+                acquired.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(acquired), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from search_engine.annoy_tuner import (exact_neighbors, format_report, hold_out_queries, pareto_frontier,
+                                       recall_at_k, recommend, tune)
+from search_engine.embedding_store import FlatEmbeddingStore
+
+
+def _result(n_trees, search_k, recall, p50_ms, index_bytes):
+    return {'n_trees': n_trees, 'search_k': search_k, 'annoy_search_k': 100, 'recall': recall, 'p50_ms': p50_ms,
+            'p99_ms': p50_ms * 2, 'build_seconds': 0.1, 'index_bytes': index_bytes}
+
+
+class TestAnnoyTuner(unittest.TestCase):
+    def test_hold_out_queries_splits_all_items(self):
+        corpus_ids, query_ids = hold_out_queries(100, 10, seed=3)
+        self.assertEqual(len(query_ids), 10)
+        self.assertEqual(sorted(np.concatenate([corpus_ids, query_ids]).tolist()), list(range(100)))
+        np.testing.assert_array_equal(hold_out_queries(100, 10, seed=3)[1], query_ids)
+        with self.assertRaises(ValueError):
+            hold_out_queries(10, 6)
+
+    def test_exact_neighbors_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        corpus = rng.normal(size=(50, 8)).astype(np.float32)
+        queries = rng.normal(size=(7, 8)).astype(np.float32)
+        neighbors = exact_neighbors(corpus, queries, 5, batch_size=3)
+
+        normalized = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        for query, row in zip(queries, neighbors):
+            expected = np.argsort(-(normalized @ query))[:5]
+            np.testing.assert_array_equal(row, expected)
+        with self.assertRaises(ValueError):
+            exact_neighbors(corpus, queries, 51)
+
+    def test_recall_at_k(self):
+        expected = np.array([[1, 2], [3, 4]])
+        self.assertAlmostEqual(recall_at_k([[2, 1], [3, 9]], expected), 0.75)
+        self.assertEqual(recall_at_k([], np.empty((0, 2))), 0.0)
+
+    def test_pareto_frontier_and_recommendation(self):
+        fast = _result(10, "fast", 0.80, 0.1, 100)
+        accurate = _result(50, 5000, 0.97, 0.5, 500)
+        dominated = _result(50, "fast", 0.79, 0.2, 500)
+        exact = _result(100, "exact", 1.0, 9.0, 1000)
+        results = [fast, accurate, dominated, exact]
+
+        frontier = pareto_frontier(results)
+        self.assertEqual(frontier, [exact, accurate, fast])
+        self.assertIs(recommend(results, 0.95), accurate)
+        self.assertIs(recommend(results, 0.5), fast)
+        # Unreachable targets fall back to the highest recall
+        self.assertIs(recommend(results, 1.1), exact)
+        self.assertIsNone(recommend([], 0.9))
+
+        report = format_report(results, 0.95)
+        self.assertIn("Recommended: n_trees=50 search_k=5000", report)
+        self.assertEqual(sum(line.startswith("*") for line in report.splitlines()), 3)
+
+    def test_tune_sweeps_grid(self):
+        rng = np.random.default_rng(1)
+        embeddings = rng.normal(size=(300, 16)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_path = os.path.join(tmp_dir, "embeddings")
+            FlatEmbeddingStore.write(store_path, embeddings)
+            work_dir = os.path.join(tmp_dir, "work")
+            results = tune(store_path, [2, 8], ["fast", "exact"], k=5, n_queries=20, n_dims=16, n_jobs=2,
+                           work_dir=work_dir)
+            self.assertTrue(os.path.exists(os.path.join(work_dir, "trees_8.ann")))
+
+        self.assertEqual([(r['n_trees'], r['search_k']) for r in results],
+                         [(2, "fast"), (2, "exact"), (8, "fast"), (8, "exact")])
+        for r in results:
+            self.assertGreater(r['index_bytes'], 0)
+            self.assertLessEqual(r['p50_ms'], r['p99_ms'])
+        # Inspecting every node finds the exact neighbors
+        self.assertEqual(results[1]['recall'], 1.0)
+        self.assertEqual(results[3]['recall'], 1.0)
+        self.assertLess(results[0]['index_bytes'], results[2]['index_bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
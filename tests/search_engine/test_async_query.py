@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+import queue
+import threading
+import time
+from search_engine.async_query import AsyncQueryInterface
+from search_engine.metrics import StageTimer, stage
+
+
+class FakeQueryInterface:
+    def __init__(self, release=None):
+        self.release = release
+        self.threads = []
+
+    def query_with_scores(self, query, n_items=5, search_k=None, min_score=None):
+        self.threads.append(threading.current_thread().name)
+        if self.release is not None:
+            self.release.wait(5)
+        with stage("embed"):
+            time.sleep(0.001)
+        return [len(query)], [float(n_items)]
+
+    def query_batch_with_scores(self, queries, n_items=5, search_k=None, min_score=None):
+        return [([len(query)], [1.0]) for query in queries]
+
+
+class TestAsyncQueryInterface(unittest.TestCase):
+    def test_calls_run_on_the_pool(self):
+        interface = FakeQueryInterface()
+        async_interface = AsyncQueryInterface(interface, max_workers=2)
+        timer = StageTimer()
+
+        async def search():
+            return await asyncio.gather(async_interface.query_with_scores("abc", 3, timer=timer),
+                                        async_interface.query_batch_with_scores(["a", "bb"]))
+
+        single, batch = asyncio.run(search())
+        async_interface.close()
+        self.assertEqual(single, ([3], [3.0]))
+        self.assertEqual(batch, [([1], [1.0]), ([2], [1.0])])
+        self.assertTrue(interface.threads[0].startswith("inference"))
+        # Stages of the pool thread are recorded into the request's timer
+        self.assertIn("embed", timer.stages)
+        self.assertEqual(async_interface.stats['completed'], 2)
+        self.assertEqual(async_interface.stats['pending'], 0)
+
+    def test_rejects_calls_above_max_pending(self):
+        release = threading.Event()
+        async_interface = AsyncQueryInterface(FakeQueryInterface(release), max_workers=1, max_pending=2)
+
+        async def flood():
+            running = [asyncio.ensure_future(async_interface.query_with_scores(str(i))) for i in range(2)]
+            await asyncio.sleep(0)
+            self.assertEqual(async_interface.stats['pending'], 2)
+            with self.assertRaises(queue.Full):
+                await async_interface.query_with_scores("rejected")
+            release.set()
+            return await asyncio.gather(*running)
+
+        results = asyncio.run(flood())
+        async_interface.close()
+        self.assertEqual(results, [([1], [5.0]), ([1], [5.0])])
+        self.assertEqual(async_interface.stats['rejected'], 1)
+        self.assertEqual(async_interface.stats['completed'], 2)
+
+    def test_validates_pool_size(self):
+        with self.assertRaises(ValueError):
+            AsyncQueryInterface(FakeQueryInterface(), max_workers=0)
+        with self.assertRaises(ValueError):
+            AsyncQueryInterface(FakeQueryInterface(), max_workers=4, max_pending=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
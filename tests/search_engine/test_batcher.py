@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from search_engine.batcher import QueryBatcher
+
+
+class FakeQueryInterface:
+    def __init__(self):
+        self.embed_calls = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def embed(self, queries):
+        self.entered.set()
+        self.release.wait(5)
+        self.embed_calls.append(list(queries))
+        return np.array([[float(len(q))] for q in queries])
+
+    def search(self, query_embedding, n_items=5, search_k=None):
+        return [int(query_embedding[0])] * n_items
+
+    def search_with_scores(self, query_embedding, n_items=5, search_k=None):
+        return [int(query_embedding[0])] * n_items, [1.0 if search_k is None else float(search_k)] * n_items
+
+    def get_cached_results(self, query, n_items=5, search_k=None):
+        return None
+
+    def get_cached_scored_results(self, query, n_items=5, search_k=None):
+        return None
+
+    def store_results(self, query, n_items, results, search_k=None):
+        pass
+
+    def store_scored_results(self, query, n_items, results, scores, search_k=None):
+        pass
+
+
+class TestQueryBatcher(unittest.TestCase):
+    def setUp(self):
+        self.query_interface = FakeQueryInterface()
+
+    def test_init_validates_params(self):
+        with self.assertRaises(ValueError):
+            QueryBatcher(self.query_interface, max_batch_size=0)
+        with self.assertRaises(ValueError):
+            QueryBatcher(self.query_interface, batch_window_ms=-1)
+
+    def test_submit_requires_start(self):
+        batcher = QueryBatcher(self.query_interface)
+        with self.assertRaises(RuntimeError):
+            batcher.submit("abc")
+
+    def test_submit_racing_stop_is_rejected(self):
+        query_interface = MagicMock()
+        batcher = QueryBatcher(query_interface, batch_window_ms=0).start()
+
+        def stop_during_lookup(*args):
+            # stop() runs after submit's first check, as it would from another thread
+            batcher.stop()
+            return None
+
+        query_interface.get_cached_results.side_effect = stop_during_lookup
+        with self.assertRaises(RuntimeError):
+            batcher.submit("late", timeout=1)
+        self.assertEqual(batcher.stats['queue_depth'], 0)
+
+    def test_submit_returns_own_results(self):
+        batcher = QueryBatcher(self.query_interface, batch_window_ms=0).start()
+        try:
+            self.assertEqual(batcher.submit("abc", n_items=2), [3, 3])
+            self.assertEqual(batcher.submit("abcd", n_items=1), [4])
+        finally:
+            batcher.stop()
+
+    def test_submit_scored(self):
+        batcher = QueryBatcher(self.query_interface, batch_window_ms=0).start()
+        try:
+            self.assertEqual(batcher.submit("ab", n_items=2, scored=True), ([2, 2], [1.0, 1.0]))
+            self.assertEqual(batcher.submit("ab", n_items=1, scored=True, search_k=7), ([2], [7.0]))
+        finally:
+            batcher.stop()
+
+    def test_concurrent_queries_share_one_embedding_call(self):
+        batcher = QueryBatcher(self.query_interface, max_batch_size=8, batch_window_ms=200).start()
+        results = {}
+
+        def worker(text):
+            results[text] = batcher.submit(text, n_items=1)
+
+        threads = [threading.Thread(target=worker, args=("x" * n,)) for n in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        batcher.stop()
+
+        self.assertEqual(results, {"x": [1], "xx": [2], "xxx": [3], "xxxx": [4]})
+        self.assertEqual(len(self.query_interface.embed_calls), 1)
+        stats = batcher.stats
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['queries'], 4)
+        self.assertEqual(stats['batch_size_histogram'], {4: 1})
+
+    def test_batches_are_capped_at_max_batch_size(self):
+        self.query_interface.release.clear()
+        batcher = QueryBatcher(self.query_interface, max_batch_size=2, batch_window_ms=50).start()
+        threads = [threading.Thread(target=batcher.submit, args=("q",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        self.query_interface.release.set()
+        for thread in threads:
+            thread.join(5)
+        batcher.stop()
+
+        self.assertTrue(all(len(call) <= 2 for call in self.query_interface.embed_calls))
+        self.assertEqual(batcher.stats['queries'], 5)
+
+    def test_full_queue_rejects_queries(self):
+        self.query_interface.release.clear()
+        batcher = QueryBatcher(self.query_interface, max_batch_size=1, batch_window_ms=0, max_queue_size=1).start()
+        first = threading.Thread(target=batcher.submit, args=("first",))
+        first.start()
+        self.assertTrue(self.query_interface.entered.wait(5))
+        second = threading.Thread(target=batcher.submit, args=("second",))
+        second.start()
+        deadline = time.monotonic() + 5
+        while batcher.stats['queue_depth'] < 1:
+            self.assertLess(time.monotonic(), deadline, "second query was never queued")
+            time.sleep(0.001)
+        with self.assertRaises(queue.Full):
+            batcher.submit("third")
+        self.assertEqual(batcher.stats['rejected'], 1)
+        self.query_interface.release.set()
+        first.join(5)
+        second.join(5)
+        batcher.stop()
+
+    def test_embedding_errors_are_propagated_to_callers(self):
+        query_interface = MagicMock()
+        query_interface.get_cached_results.return_value = None
+        query_interface.embed.side_effect = RuntimeError("model failure")
+        batcher = QueryBatcher(query_interface, batch_window_ms=0).start()
+        try:
+            with self.assertRaises(RuntimeError):
+                batcher.submit("abc")
+        finally:
+            batcher.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,7 @@ import tempfile
 from pathlib import Path
 
 from search_engine.data_pipeline import DataPipeline
+from search_engine.embedding_store import FlatEmbeddingStore
 
 class TestDataPipeline(unittest.TestCase):
     
@@ -93,7 +94,106 @@ class TestDataPipeline(unittest.TestCase):
         mock_normalize.assert_called_once_with(embeddings, axis=1)
         self.assertTrue(np.allclose(result, np.array([[0.5, 0.5], [0.6, 0.6]])))
 
-    
+
+    @patch('search_engine.data_pipeline.hub')
+    def test_compute_embeddings_with_cache_embeds_only_new_texts(self, mock_hub):
+        def embed(batch):
+            return tf.constant([[float(len(text)), 1.0] for text in batch.numpy()])
+
+        model = MagicMock(side_effect=embed)
+        mock_hub.load.return_value = model
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_path = os.path.join(temp_dir, 'cache.sqlite')
+            pipeline = DataPipeline(batch_size=2, embedding_cache_path=cache_path)
+            first = pipeline.compute_embeddings(tf.data.Dataset.from_tensor_slices(['a', 'bb']).batch(2))
+            self.assertEqual(model.call_count, 1)
+            pipeline.embedding_cache.close()
+
+            pipeline = DataPipeline(batch_size=2, embedding_cache_path=cache_path)
+            model.reset_mock()
+            dataset = tf.data.Dataset.from_tensor_slices(['bb', 'ccc', 'a', 'ccc']).batch(2)
+            result = pipeline.compute_embeddings(dataset, normalize=False)
+
+            model.assert_called_once()
+            self.assertEqual([t.decode() for t in model.call_args[0][0].numpy()], ['ccc'])
+            np.testing.assert_allclose(result, [[2, 1], [3, 1], [1, 1], [3, 1]])
+            np.testing.assert_allclose(first[1], np.array([2, 1]) / np.sqrt(5), rtol=1e-6)
+            pipeline.embedding_cache.close()
+
+    @patch('search_engine.data_pipeline.hub')
+    def test_embed_tsv_in_chunks_resumes(self, mock_hub):
+        calls = []
+
+        def embed(batch):
+            texts = [t.decode() for t in batch.numpy()]
+            calls.append(texts)
+            if 'fail' in texts:
+                raise RuntimeError("interrupted")
+            return tf.constant([[float(len(text)), 0.0] for text in texts])
+
+        mock_hub.load.return_value = MagicMock(side_effect=embed)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tsv_path = os.path.join(temp_dir, 'lyrics.tsv')
+            output_path = os.path.join(temp_dir, 'store')
+            rows = ['a', 'bb', 'ccc', 'dddd', 'fail', 'ffffff', 'g']
+            pd.DataFrame({'Artist': [f'artist{i}' for i in range(7)], 'Lyrics': rows}).to_csv(tsv_path, sep='\t', index=False)
+
+            pipeline = DataPipeline(batch_size=2)
+            with self.assertRaises(RuntimeError):
+                pipeline.embed_tsv_in_chunks(tsv_path, output_path, chunk_size=3)
+            self.assertFalse(os.path.exists(os.path.join(output_path, 'schema.json')))
+
+            rows[4] = 'eeee'
+            pd.DataFrame({'Artist': [f'artist{i}' for i in range(7)], 'Lyrics': rows}).to_csv(tsv_path, sep='\t', index=False)
+            with self.assertRaises(ValueError):
+                pipeline.embed_tsv_in_chunks(tsv_path, output_path, chunk_size=4)
+            calls.clear()
+            result = pipeline.embed_tsv_in_chunks(tsv_path, output_path, chunk_size=3)
+
+            self.assertEqual(calls, [['dddd', 'eeee'], ['ffffff'], ['g']])
+            self.assertEqual(result.shape, (7, 2))
+            np.testing.assert_allclose(result[:, 0], 1.0)
+            self.assertEqual(list(pipeline.texts), rows)
+            self.assertEqual(pipeline.metadata['index'].tolist(), list(range(7)))
+            self.assertFalse(os.path.exists(os.path.join(output_path, 'shards')))
+            del result
+
+    @patch('search_engine.data_pipeline.hub')
+    def test_compute_and_save_passages(self, mock_hub):
+        def embed(batch):
+            return tf.constant([[float(len(text)), 1.0] for text in batch.numpy()])
+
+        model = MagicMock(side_effect=embed)
+        mock_hub.load.return_value = model
+        pipeline = DataPipeline(batch_size=2)
+        pipeline._texts = ["l1\nl2\nl3\nl4\nl5", "short"]
+
+        result = pipeline.compute_passage_embeddings(window_lines=3, stride=2, normalize=False)
+
+        self.assertEqual(model.call_count, 2)
+        self.assertEqual(pipeline.passage_map.song_ids.tolist(), [0, 0, 1])
+        np.testing.assert_allclose(result, [[8, 1], [8, 1], [5, 1]])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, 'passages')
+            pipeline.save_passages(store_path)
+            store = FlatEmbeddingStore(store_path)
+            self.assertEqual(list(store.texts), ["l1\nl2\nl3", "l3\nl4\nl5", "short"])
+            self.assertEqual(store.metadata_column('song_id').tolist(), [0, 0, 1])
+            self.assertEqual(store.metadata_column('line_start').tolist(), [0, 2, 0])
+            del store
+
+    @patch('search_engine.data_pipeline.hub')
+    def test_embed_no_texts(self, mock_hub):
+        mock_hub.load.return_value = MagicMock(side_effect=lambda batch: tf.zeros((len(batch), 3)))
+        pipeline = DataPipeline(batch_size=2)
+        self.assertEqual(pipeline._embed_texts([], normalize=True).shape, (0, 3))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cached = DataPipeline(batch_size=2, embedding_cache_path=os.path.join(temp_dir, 'cache.sqlite'))
+            self.assertEqual(cached._embed_texts([], normalize=True).shape, (0, 3))
+            cached._embedding_cache.close()
+        pipeline._texts = []
+        self.assertEqual(pipeline.compute_passage_embeddings().shape, (0, 3))
+
     @patch('builtins.open', new_callable=mock_open)
     @patch('json.load')
     def test_load_embeddings(self, mock_json_load, mock_open):
@@ -144,6 +244,31 @@ class TestDataPipeline(unittest.TestCase):
             for col in expected_metadata.columns:
                 self.assertIn(col, self.data_pipeline._metadata.columns)
     
+    def test_save_and_load_flat_embeddings(self):
+        self.data_pipeline._embeddings = np.array([[0.1, 0.2], [0.3, 0.4]], dtype=np.float32)
+        self.data_pipeline._texts = ['text1', 'text2']
+        self.data_pipeline._metadata = pd.DataFrame({'Artist': ['artist1', 'artist2']})
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, 'embeddings')
+            self.data_pipeline.save_embeddings(store_path, fmt='flat')
+            self.data_pipeline._embeddings = None
+
+            result = self.data_pipeline.load_embeddings(store_path)
+
+            self.assertIsInstance(result, np.memmap)
+            self.assertTrue(np.allclose(result, [[0.1, 0.2], [0.3, 0.4]]))
+            self.assertEqual(list(self.data_pipeline.texts), ['text1', 'text2'])
+            self.assertEqual(self.data_pipeline.metadata['Artist'].tolist(), ['artist1', 'artist2'])
+            del result
+            self.data_pipeline._embeddings = None
+
+    def test_save_embeddings_unknown_format(self):
+        self.data_pipeline._embeddings = np.zeros((1, 2))
+        self.data_pipeline._texts = ['text1']
+        with self.assertRaises(ValueError):
+            self.data_pipeline.save_embeddings('out', fmt='csv')
+
     def test_create_example(self):
         text = "sample text"
         embedding = np.array([0.1, 0.2, 0.3])
@@ -0,0 +1,192 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from annoy import AnnoyIndex
+from search_engine.delta_index import DeltaBackend, DeltaIndex
+from search_engine.quantization import ScalarQuantizer
+from search_engine.query_cache import QueryCache
+from search_engine.search_backends import AnnoyBackend, ExactBackend, QuantizedBackend
+
+
+def random_unit_vectors(n, dims, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_annoy(vectors):
+    annoy_index = AnnoyIndex(vectors.shape[1], "angular")
+    for i, vector in enumerate(vectors):
+        annoy_index.add_item(i, vector)
+    annoy_index.build(10)
+    return annoy_index
+
+
+class TestDeltaIndex(unittest.TestCase):
+    def test_add_search_and_replace(self):
+        vectors = random_unit_vectors(5, 8)
+        delta = DeltaIndex(n_dims=8, capacity=2)
+        delta.add([10, 11, 12], vectors[:3] * 2.0)
+        self.assertEqual(len(delta), 3)
+        self.assertIn(11, delta)
+
+        ids, scores = delta.search_with_scores(vectors[1], n_items=1)
+        self.assertEqual(ids, [11])
+        self.assertAlmostEqual(scores[0], 1.0, places=5)
+
+        delta.add([11], vectors[4:5])
+        self.assertEqual(len(delta), 3)
+        self.assertEqual(delta.search_with_scores(vectors[4], n_items=1)[0], [11])
+
+    def test_tombstones(self):
+        delta = DeltaIndex(n_dims=8)
+        delta.remove([1, 2])
+        self.assertEqual(delta.tombstones, {1, 2})
+        self.assertFalse(delta.set_tombstones([2, 1]))
+        self.assertTrue(delta.set_tombstones([3]))
+        delta.add([3], random_unit_vectors(1, 8))
+        self.assertEqual(delta.tombstones, frozenset())
+
+    def test_discard_keeps_items_replaced_after_snapshot(self):
+        vectors = random_unit_vectors(4, 8)
+        delta = DeltaIndex(n_dims=8)
+        delta.add([0, 1, 2], vectors[:3])
+        ids, embeddings = delta.snapshot()
+        delta.add([1], vectors[3:4])
+        self.assertEqual(delta.discard(ids, embeddings), 2)
+        self.assertEqual(len(delta), 1)
+        self.assertEqual(delta.search_with_scores(vectors[3], n_items=5)[0], [1])
+
+    def test_save_and_load(self):
+        vectors = random_unit_vectors(3, 8)
+        delta = DeltaIndex(n_dims=8)
+        delta.add([5, 6, 7], vectors)
+        delta.remove([1])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "delta.npz")
+            delta.save(path)
+            loaded = DeltaIndex.load(path)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(loaded.n_dims, 8)
+        self.assertEqual(loaded.tombstones, {1})
+        self.assertEqual(loaded.search_with_scores(vectors[2], 1)[0], [7])
+
+
+class TestDeltaBackend(unittest.TestCase):
+    def setUp(self):
+        self.vectors = random_unit_vectors(50, 8)
+        self.backend = DeltaBackend(ExactBackend(self.vectors[:40]), compaction_threshold=0)
+
+    def test_without_delta_matches_main(self):
+        query = self.vectors[3]
+        self.assertEqual(self.backend.search(query, 5), self.backend.main.search(query, 5))
+
+    def test_search_batch_uses_main_batch_search_without_delta(self):
+        queries = self.vectors[:3]
+        with patch.object(self.backend.main, "search_batch", wraps=self.backend.main.search_batch) as search_batch:
+            self.assertEqual(self.backend.search_batch(queries, 4), [self.backend.search(q, 4) for q in queries])
+        search_batch.assert_called_once()
+
+    def test_search_batch_merges_delta_per_query(self):
+        self.backend.add([40, 41], self.vectors[40:42])
+        self.backend.remove([2])
+        queries = self.vectors[[41, 2, 7]]
+        with patch.object(self.backend.main, "search_batch_with_scores",
+                          wraps=self.backend.main.search_batch_with_scores) as main_batch:
+            found = self.backend.search_batch_with_scores(queries, 5)
+        main_batch.assert_called_once()
+        for (ids, scores), query in zip(found, queries):
+            expected_ids, expected_scores = self.backend.search_with_scores(query, 5)
+            self.assertEqual(ids, expected_ids)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+        self.assertEqual(found[0][0][0], 41)
+        self.assertNotIn(2, found[1][0])
+        self.assertEqual(self.backend.search_batch(queries, 5), [ids for ids, _ in found])
+
+    def test_new_items_are_merged_with_main_results(self):
+        self.backend.add([40, 41], self.vectors[40:42])
+        self.assertEqual(self.backend.search(self.vectors[41], n_items=1), [41])
+        self.assertEqual(self.backend.search(self.vectors[7], n_items=1), [7])
+        self.assertEqual(self.backend.next_item_id, 42)
+        self.assertEqual(len(self.backend), 42)
+
+    def test_delta_replaces_main_item(self):
+        self.backend.add([7], self.vectors[45:46])
+        ids = self.backend.search(self.vectors[7], n_items=40)
+        self.assertEqual(ids.count(7), 1)
+        self.assertEqual(self.backend.search(self.vectors[45], n_items=1), [7])
+
+    def test_tombstones_are_filtered(self):
+        self.backend.add([40], self.vectors[40:41])
+        self.backend.remove([7, 40])
+        self.assertNotIn(7, self.backend.search(self.vectors[7], n_items=5))
+        self.assertNotIn(40, self.backend.search(self.vectors[40], n_items=5))
+        self.assertEqual(len(self.backend.search(self.vectors[7], n_items=5)), 5)
+
+    def test_update_listeners(self):
+        calls = []
+        self.backend.add_update_listener(lambda: calls.append(1))
+        self.backend.add([40], self.vectors[40:41])
+        self.backend.remove([1])
+        self.backend.set_tombstones([1])
+        self.assertEqual(len(calls), 2)
+
+    def test_set_tombstones_does_not_write_the_delta(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            delta_path = os.path.join(tmp, "delta.npz")
+            backend = DeltaBackend(ExactBackend(self.vectors[:40]), compaction_threshold=0, delta_path=delta_path)
+            backend.set_tombstones([1, 2])
+            self.assertFalse(os.path.exists(delta_path))
+            self.assertEqual(backend.delta.tombstones, {1, 2})
+            backend.add([40], self.vectors[40:41])
+            self.assertEqual(len(DeltaIndex.load(delta_path)), 1)
+
+    def test_compaction_into_exact_main(self):
+        self.backend.add([40, 45], self.vectors[[40, 45]])
+        self.assertEqual(self.backend.compact(), 2)
+        self.assertEqual(len(self.backend.delta), 0)
+        self.assertEqual(self.backend.main.embeddings.shape[0], 46)
+        self.assertEqual(self.backend.search(self.vectors[45], n_items=1), [45])
+        self.assertEqual(self.backend.compactions, 1)
+
+    def test_compaction_invalidates_cached_results(self):
+        cache = QueryCache()
+        self.backend.add_update_listener(cache.invalidate_results)
+        self.backend.add([45], self.vectors[45:46])
+        cache.put_results("query", 5, [45])
+        self.backend.compact()
+        self.assertIsNone(cache.get_results("query", 5))
+
+    def test_background_compaction_of_annoy_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, "index.ann")
+            delta_path = os.path.join(tmp, "delta.npz")
+            backend = DeltaBackend(AnnoyBackend(build_annoy(self.vectors[:40])), compaction_threshold=5,
+                                   n_trees=10, index_path=index_path, delta_path=delta_path)
+            backend.add(range(40, 44), self.vectors[40:44])
+            self.assertEqual(backend.compactions, 0)
+            backend.add([44], self.vectors[44:45])
+            backend.wait_for_compaction(timeout=10)
+
+            self.assertEqual(backend.compactions, 1)
+            self.assertEqual(len(backend.delta), 0)
+            self.assertEqual(len(DeltaIndex.load(delta_path)), 0)
+            self.assertEqual(backend.main.annoy_index.get_n_items(), 45)
+            self.assertEqual(backend.search(self.vectors[44], n_items=1), [44])
+            saved = AnnoyIndex(8, "angular")
+            saved.load(index_path)
+            self.assertEqual(saved.get_n_items(), 45)
+
+    def test_quantized_main_is_searched_but_not_compacted(self):
+        quantizer = ScalarQuantizer("int8").fit(self.vectors)
+        backend = DeltaBackend(QuantizedBackend(quantizer.encode(self.vectors[:40]), quantizer), compaction_threshold=1)
+        backend.add([40], self.vectors[40:41])
+        self.assertFalse(backend.can_compact)
+        self.assertEqual(backend.search(self.vectors[40], n_items=1), [40])
+        with self.assertRaises(TypeError):
+            backend.compact()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from search_engine.embedding_cache import EmbeddingCache, normalize_text
+
+
+class TestNormalizeText(unittest.TestCase):
+    def test_normalization(self):
+        self.assertEqual(normalize_text("  a\r\nb\rc \n"), "a\nb\nc")
+        self.assertEqual(normalize_text("ź"), normalize_text("ź"))
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache", "embeddings.sqlite")
+        self.cache = EmbeddingCache(self.path, "model-a")
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_put_and_get(self):
+        embeddings = np.arange(6, dtype=np.float32).reshape(2, 3)
+        self.cache.put_many(["one", "two"], embeddings)
+        results = self.cache.get_many(["two", "three", "one\r\n"])
+        np.testing.assert_array_equal(results[0], embeddings[1])
+        self.assertIsNone(results[1])
+        np.testing.assert_array_equal(results[2], embeddings[0])
+        self.assertEqual(self.cache.stats, {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_counters_are_exact_under_concurrent_lookups(self):
+        self.cache.put_many(["one"], np.ones((1, 3), dtype=np.float32))
+        threads = [threading.Thread(target=lambda: [self.cache.get_many(["one", "two"]) for _ in range(50)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        stats = self.cache.stats
+        self.assertEqual((stats['hits'], stats['misses']), (400, 400))
+
+    def test_key_depends_on_model(self):
+        other = EmbeddingCache(self.path, "model-b")
+        try:
+            self.assertNotEqual(self.cache.key("text"), other.key("text"))
+            self.cache.put_many(["text"], np.ones((1, 3)))
+            self.assertEqual(other.get_many(["text"]), [None])
+        finally:
+            other.close()
+
+    def test_persists_across_connections(self):
+        self.cache.put_many(["text"], np.ones((1, 3)))
+        self.cache.close()
+        self.cache = EmbeddingCache(self.path, "model-a")
+        self.assertEqual(len(self.cache), 1)
+        np.testing.assert_array_equal(self.cache.get_many(["text"])[0], np.ones(3))
+
+    def test_many_keys_are_chunked(self):
+        cache = EmbeddingCache(self.path, "model-a", chunk_size=7)
+        texts = [f"text {i}" for i in range(30)]
+        cache.put_many(texts, np.arange(30, dtype=np.float32)[:, None])
+        results = cache.get_many(texts)
+        self.assertEqual([float(r[0]) for r in results], list(range(30)))
+        cache.close()
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.cache.put_many(["a", "b"], np.ones((1, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
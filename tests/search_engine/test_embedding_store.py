@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from search_engine.embedding_store import FlatEmbeddingStore, TextColumn
+
+
+class TestTextColumn(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.temp_dir, "texts.bin")
+        self.offsets_path = os.path.join(self.temp_dir, "texts.offsets.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_and_open(self):
+        texts = ["pierwszy", "", "zażółć gęślą jaźń", "last"]
+        self.assertEqual(TextColumn.write(iter(texts), self.data_path, self.offsets_path), 4)
+        column = TextColumn.open(self.data_path, self.offsets_path)
+        self.assertEqual(len(column), 4)
+        self.assertEqual(list(column), texts)
+        self.assertEqual(column[-1], "last")
+        self.assertEqual(column[1:3], ["", "zażółć gęślą jaźń"])
+        with self.assertRaises(IndexError):
+            column[4]
+
+    def test_empty_column(self):
+        TextColumn.write([], self.data_path, self.offsets_path)
+        column = TextColumn.open(self.data_path, self.offsets_path)
+        self.assertEqual(len(column), 0)
+        self.assertEqual(list(column), [])
+
+
+class TestFlatEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.temp_dir, "store")
+        self.embeddings = np.arange(12, dtype=np.float64).reshape(3, 4)
+        self.texts = ["text1", "tekst drugi", "text3"]
+        self.metadata = pd.DataFrame({
+            'Artist': ['artist1', 'artysta2', 'artist3'],
+            'Year': [2001, 2002, 2003],
+            'Rating': [1.5, 2.5, 3.5],
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_and_open_round_trip(self):
+        FlatEmbeddingStore.write(self.store_path, self.embeddings, self.texts, self.metadata)
+        self.assertTrue(FlatEmbeddingStore.is_flat_store(self.store_path))
+
+        store = FlatEmbeddingStore(self.store_path)
+        self.assertEqual(len(store), 3)
+        self.assertIsInstance(store.embeddings, np.memmap)
+        self.assertEqual(store.embeddings.dtype, np.float32)
+        self.assertTrue(np.allclose(store.embeddings, self.embeddings))
+        self.assertEqual(list(store.texts), self.texts)
+        self.assertEqual(store.metadata_columns, ['Artist', 'Year', 'Rating'])
+        self.assertEqual(store.schema['dtype_Year'], 'int')
+        self.assertEqual(store.metadata['Artist'].tolist(), self.metadata['Artist'].tolist())
+        self.assertEqual(store.metadata['Year'].tolist(), [2001, 2002, 2003])
+        self.assertTrue(np.allclose(store.metadata_column('Rating'), [1.5, 2.5, 3.5]))
+
+    def test_without_texts_and_metadata(self):
+        store = FlatEmbeddingStore.write(self.store_path, self.embeddings)
+        self.assertIsNone(store.texts)
+        self.assertEqual(store.metadata['index'].tolist(), [0, 1, 2])
+
+    def test_quantized_store(self):
+        store = FlatEmbeddingStore.write(self.store_path, self.embeddings, quantization="int8")
+        self.assertEqual(store.schema['quantization'], 'int8')
+
+        reopened = FlatEmbeddingStore(self.store_path)
+        self.assertEqual(reopened.quantized_embeddings.dtype, np.int8)
+        self.assertTrue(np.allclose(reopened.quantizer.scale, store.quantizer.scale))
+        self.assertTrue(np.allclose(reopened.quantizer.decode(reopened.quantized_embeddings),
+                                    self.embeddings, atol=reopened.quantizer.scale.max()))
+
+    def test_not_quantized_by_default(self):
+        store = FlatEmbeddingStore.write(self.store_path, self.embeddings)
+        self.assertIsNone(store.quantizer)
+        self.assertIsNone(store.quantized_embeddings)
+
+    def test_is_flat_store(self):
+        self.assertFalse(FlatEmbeddingStore.is_flat_store(self.store_path))
+        self.assertFalse(FlatEmbeddingStore.is_flat_store(os.path.join(self.temp_dir, "file.tfrecord")))
+
+    def test_write_validates_lengths(self):
+        with self.assertRaises(ValueError):
+            FlatEmbeddingStore.write(self.store_path, self.embeddings, texts=["only one"])
+        with self.assertRaises(ValueError):
+            FlatEmbeddingStore.write(self.store_path, self.embeddings, metadata=self.metadata.iloc[:2])
+        with self.assertRaises(ValueError):
+            FlatEmbeddingStore.write(self.store_path, np.zeros(3))
+        self.assertFalse(FlatEmbeddingStore.is_flat_store(self.store_path))
+
+    def test_merge(self):
+        first = FlatEmbeddingStore.write(os.path.join(self.temp_dir, "a"), self.embeddings[:2], self.texts[:2],
+                                         self.metadata.iloc[:2])
+        second = FlatEmbeddingStore.write(os.path.join(self.temp_dir, "b"), self.embeddings[2:], self.texts[2:],
+                                          self.metadata.iloc[2:])
+        merged = FlatEmbeddingStore.merge(self.store_path, [first.path, second.path], quantization="int8", block_size=1)
+        self.assertEqual(len(merged), 3)
+        self.assertTrue(np.allclose(merged.embeddings, self.embeddings))
+        self.assertEqual(list(merged.texts), self.texts)
+        self.assertEqual(merged.metadata['Artist'].tolist(), self.metadata['Artist'].tolist())
+        self.assertEqual(merged.metadata['Year'].tolist(), [2001, 2002, 2003])
+        self.assertEqual(merged.quantized_embeddings.shape, (3, self.embeddings.shape[1]))
+
+    def test_merge_rejects_mismatched_shards(self):
+        first = FlatEmbeddingStore.write(os.path.join(self.temp_dir, "a"), self.embeddings, self.texts)
+        second = FlatEmbeddingStore.write(os.path.join(self.temp_dir, "b"), self.embeddings)
+        with self.assertRaises(ValueError):
+            FlatEmbeddingStore.merge(self.store_path, [first.path, second.path])
+        with self.assertRaises(ValueError):
+            FlatEmbeddingStore.merge(self.store_path, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,10 @@
 import unittest
 from unittest.mock import patch, MagicMock, call
+import os
+import tempfile
+import numpy as np
+import tensorflow as tf
+from search_engine.embedding_store import FlatEmbeddingStore
 from search_engine.index_builder import IndexBuilder
 
 class TestIndexBuilder(unittest.TestCase):
@@ -32,6 +37,61 @@ class TestIndexBuilder(unittest.TestCase):
         builder._index.add_item.assert_has_calls(calls)
         builder._index.build.assert_called_once_with(builder._n_trees)
 
+    @patch("search_engine.index_builder.tf")
+    def test_build_index_from_flat_store(self, mock_tf):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, "store")
+            FlatEmbeddingStore.write(store_path, np.eye(3, 4))
+            builder = IndexBuilder(n_trees=2, n_dims=4)
+            builder.build_index_from_files([store_path])
+
+        mock_tf.data.TFRecordDataset.assert_not_called()
+        self.assertEqual(builder.annoy_index.get_n_items(), 3)
+        self.assertEqual(builder.annoy_index.get_nns_by_item(1, 1), [1])
+
+    def test_build_index_from_flat_store_checks_dims(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, "store")
+            FlatEmbeddingStore.write(store_path, np.eye(3, 4))
+            with self.assertRaises(ValueError):
+                IndexBuilder(n_dims=8).build_index_from_files([store_path])
+
+    def _write_tfrecord(self, path, embeddings):
+        with tf.io.TFRecordWriter(path) as writer:
+            for embedding in embeddings:
+                feature = {
+                    'text': tf.train.Feature(bytes_list=tf.train.BytesList(value=[b"some text"])),
+                    'embedding': tf.train.Feature(float_list=tf.train.FloatList(value=embedding)),
+                }
+                writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+
+    def test_parallel_build_keeps_file_order(self):
+        rng = np.random.default_rng(0)
+        first, second, third = rng.random((5, 8)), rng.random((3, 8)), rng.random((4, 8))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, "a.tfrecord"), os.path.join(temp_dir, "store"),
+                     os.path.join(temp_dir, "c.tfrecord")]
+            self._write_tfrecord(paths[0], first)
+            FlatEmbeddingStore.write(paths[1], second)
+            self._write_tfrecord(paths[2], third)
+
+            builder = IndexBuilder(n_trees=2, n_dims=8, n_jobs=1)
+            builder.build_index_from_files(paths, num_parallel_reads=3)
+
+        expected = np.concatenate([first, second, third]).astype(np.float32)
+        self.assertEqual(builder.annoy_index.get_n_items(), 12)
+        for i, vector in enumerate(expected):
+            self.assertTrue(np.allclose(builder.annoy_index.get_item_vector(i), vector))
+        timings = builder.build_timings
+        self.assertEqual(timings['items'], 12)
+        self.assertEqual(set(timings), {'read', 'add', 'build', 'items'})
+
+    @patch("search_engine.index_builder.AnnoyIndex")
+    def test_build_passes_n_jobs_to_annoy(self, mock_annoy):
+        builder = IndexBuilder(n_trees=7, n_jobs=4)
+        builder.build_index_from_files([], num_parallel_reads=2)
+        builder.annoy_index.build.assert_called_once_with(7, n_jobs=4)
+
     @patch("search_engine.index_builder.AnnoyIndex")
     def test_save_to_file_calls_save(self, mock_annoy):
         builder = IndexBuilder()
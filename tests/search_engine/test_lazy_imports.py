@@ -0,0 +1,46 @@
+import subprocess
+import sys
+import unittest
+from search_engine.lazy import LazyModule
+
+
+class TestLazyModule(unittest.TestCase):
+    def test_attribute_access_imports_module(self):
+        lazy_json = LazyModule("json")
+        self.assertEqual(lazy_json.dumps([1]), "[1]")
+        self.assertIn("loads", dir(lazy_json))
+
+    def test_missing_attribute(self):
+        with self.assertRaises(AttributeError):
+            LazyModule("json").not_a_function
+
+
+class TestPackageImports(unittest.TestCase):
+    def _loaded_modules(self, code):
+        result = subprocess.run(
+            [sys.executable, "-c", code + "\nimport sys\nprint(' '.join(sorted(sys.modules)))"],
+            capture_output=True, text=True, check=True
+        )
+        return set(result.stdout.split())
+
+    def test_query_path_does_not_import_heavy_dependencies(self):
+        modules = self._loaded_modules(
+            "import search_engine\n"
+            "from search_engine import QueryInterface, DeltaBackend, QueryBatcher, FlatEmbeddingStore"
+        )
+        self.assertIn("search_engine.query_interface", modules)
+        self.assertNotIn("tensorflow", modules)
+        self.assertNotIn("tensorflow_hub", modules)
+        self.assertNotIn("pandas", modules)
+
+    def test_exports(self):
+        import search_engine
+        from search_engine.search_backends import ExactBackend
+        self.assertIs(search_engine.ExactBackend, ExactBackend)
+        self.assertIn("DataPipeline", dir(search_engine))
+        with self.assertRaises(AttributeError):
+            search_engine.NotAClass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from search_engine.delta_index import DeltaBackend
+from search_engine.lexical_index import LexicalIndex, LexicalIndexWriter, reciprocal_rank_fusion, tokenize
+from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import ExactBackend
+
+
+class TestTokenize(unittest.TestCase):
+    def test_polish_normalization(self):
+        self.assertEqual(tokenize("Żółć, GĘŚLĄ jaźń!"), ["zolc", "gesla", "jazn"])
+        self.assertEqual(tokenize("Łódź\nłódź"), ["lodz", "lodz"])
+        self.assertEqual(tokenize("Café  don't"), ["cafe", "don", "t"])
+        self.assertEqual(tokenize(""), [])
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    def test_fusion(self):
+        indices, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 4]], n_items=3, k=1.0)
+        # 3 is third and first: 1/4 + 1/2, 1 is first once: 1/2, 2 and 4 are second once: 1/3
+        self.assertEqual(indices, [3, 1, 2])
+        np.testing.assert_allclose(scores, [0.75, 0.5, 1 / 3])
+
+    def test_weights(self):
+        indices, _ = reciprocal_rank_fusion([[1], [2]], n_items=2, weights=[1.0, 2.0])
+        self.assertEqual(indices, [2, 1])
+        with self.assertRaises(ValueError):
+            reciprocal_rank_fusion([[1], [2]], weights=[1.0])
+
+
+class TestLexicalIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "lexical")
+        self.texts = [
+            "Płynie Wisła płynie\npo polskiej krainie",
+            "la la la\nla la la la",
+            "Szła dzieweczka do laseczka",
+            "Wisła, Wisła, Wisła",
+        ]
+        self.index = LexicalIndex.build(self.path, self.texts)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_layout(self):
+        self.assertTrue(LexicalIndex.is_lexical_index(self.path))
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.n_terms, 10)
+        doc_ids, term_freqs = self.index.postings("wisla")
+        self.assertEqual(doc_ids.tolist(), [0, 3])
+        self.assertEqual(term_freqs.tolist(), [1, 3])
+        self.assertIsInstance(doc_ids, np.memmap)
+        self.assertEqual(self.index.postings("missing")[0].size, 0)
+
+    def test_bm25_scores(self):
+        scores = self.index.scores("Wisła")
+        n, df, avg_length = 4, 2, np.mean([6, 7, 4, 3])
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        for doc, (tf, length) in {0: (1, 6), 3: (3, 3)}.items():
+            expected = idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / avg_length))
+            self.assertAlmostEqual(float(scores[doc]), expected, places=5)
+        self.assertEqual(scores[1], 0.0)
+
+    def test_search(self):
+        self.assertEqual(self.index.search("szla dzieweczka", 5)[0], [2])
+        self.assertEqual(self.index.search("wisla plynie", 5)[0], [0, 3])
+        self.assertEqual(self.index.search("nic takiego", 5), ([], []))
+        self.assertEqual(len(self.index.search("la wisla", 1)[0]), 1)
+
+    def test_phrase_search(self):
+        self.assertTrue(self.index.has_positions)
+        self.assertEqual(self.index.phrase_search("wisla po polskiej"), [])
+        # Line breaks do not split a phrase
+        self.assertEqual(self.index.phrase_search("plynie po polskiej"), [0])
+        self.assertEqual(self.index.phrase_search("Wisła płynie, po polskiej"), [0])
+        self.assertEqual(self.index.phrase_search("wisla wisla"), [3])
+        self.assertEqual(self.index.phrase_search("la la la la"), [1])
+        self.assertEqual(self.index.phrase_search("krainie po"), [])
+        self.assertEqual(self.index.phrase_search("wisla"), [])
+        self.assertEqual(self.index.phrase_search("wisla missing"), [])
+
+    def test_phrase_matches_rank_first(self):
+        index = LexicalIndex.build(os.path.join(self.temp_dir, "phrases"), [
+            "kocham cie kocham cie kocham cie",
+            "cie kocham",
+            "ja kocham cie",
+        ])
+        # All three contain both words, only 0 and 2 in the order of the query
+        self.assertEqual(index.search("kocham cie", 3)[0][2], 1)
+        self.assertEqual(sorted(index.search("cie kocham", 3)[0][:2]), [0, 1])
+        self.assertEqual(index.search("ja kocham cie", 1)[0], [2])
+
+    def test_positions_follow_their_postings(self):
+        writer = LexicalIndexWriter()
+        for i in range(50):
+            writer.add(" ".join(f"w{(i * 7 + j) % 13}" for j in range(i % 9 + 2)))
+        index = writer.save(os.path.join(self.temp_dir, "many"))
+        for i in range(50):
+            terms = [f"w{(i * 7 + j) % 13}" for j in range(i % 9 + 2)]
+            self.assertIn(i, index.phrase_search(" ".join(terms)))
+
+    def test_index_without_positions(self):
+        # Indexes written before positions were stored are still searched, without phrase matching
+        schema_path = os.path.join(self.path, "schema.json")
+        with open(schema_path) as f:
+            schema = json.load(f)
+        schema['version'] = 1
+        with open(schema_path, 'w') as f:
+            json.dump(schema, f)
+        os.remove(os.path.join(self.path, "positions.npy"))
+        index = LexicalIndex(self.path)
+        self.assertFalse(index.has_positions)
+        self.assertEqual(index.phrase_search("wisla plynie"), [])
+        self.assertEqual(index.search("wisla plynie", 5)[0], [0, 3])
+
+    def test_reopen_and_overwrite(self):
+        self.assertEqual(LexicalIndex(self.path).search("laseczka")[0], [2])
+        writer = LexicalIndexWriter()
+        writer.add("inny tekst")
+        index = writer.save(self.path)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.search("laseczka"), ([], []))
+
+    def test_empty_index(self):
+        index = LexicalIndex.build(os.path.join(self.temp_dir, "empty"), [])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.search("anything"), ([], []))
+
+    def test_query_hybrid(self):
+        embeddings = np.eye(4, dtype=np.float32)
+        model = MagicMock(return_value=np.array([[0.0, 1.0, 0.1, 0.0]], dtype=np.float32))
+        interface = QueryInterface(None, model, backend=ExactBackend(embeddings), lexical_index=self.index,
+                                   hybrid_candidates=2)
+        indices, scores, passages = interface.query_hybrid("dzieweczka", n_items=2)
+        # Song 2 is second in the semantic ranking and first in the lexical one
+        self.assertEqual(indices, [2, 1])
+        self.assertGreater(scores[0], scores[1])
+        self.assertEqual(passages, [None, None])
+        with self.assertRaises(ValueError):
+            QueryInterface(None, model, backend=ExactBackend(embeddings)).query_hybrid("x")
+
+    def test_query_hybrid_skips_removed_songs(self):
+        embeddings = np.eye(4, dtype=np.float32)
+        model = MagicMock(return_value=np.array([[0.0, 1.0, 0.1, 0.0]], dtype=np.float32))
+        backend = DeltaBackend(ExactBackend(embeddings), compaction_threshold=0)
+        interface = QueryInterface(None, model, backend=backend, lexical_index=self.index, hybrid_candidates=2)
+        self.assertIn(2, interface.query_hybrid("dzieweczka", n_items=3)[0])
+        backend.remove([2])
+        indices, _, _ = interface.query_hybrid("dzieweczka", n_items=3)
+        self.assertNotIn(2, indices)
+        self.assertEqual(indices[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import threading
+import unittest
+from search_engine.metrics import Counter, Histogram, MetricsRegistry, StageTimer, current_timer, stage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCounter(unittest.TestCase):
+    def test_inc_by_labels(self):
+        counter = Counter("requests_total", "Requests.", ["status"])
+        counter.inc(status="200")
+        counter.inc(2, status="200")
+        counter.inc(status="500")
+        self.assertEqual(counter.value(status="200"), 3)
+        self.assertEqual(counter.value(status="404"), 0)
+        self.assertEqual(list(counter.samples()), [("requests_total", {"status": "200"}, 3),
+                                                   ("requests_total", {"status": "500"}, 1)])
+        with self.assertRaises(ValueError):
+            counter.inc(-1, status="200")
+        with self.assertRaises(ValueError):
+            counter.inc(endpoint="x")
+
+
+class TestHistogram(unittest.TestCase):
+    def test_cumulative_buckets(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        self.assertEqual(histogram.buckets, (0.1, 1.0, float("inf")))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        self.assertAlmostEqual(histogram.sum(), 3.65)
+        samples = list(histogram.samples())
+        self.assertEqual([(name, labels.get("le"), value) for name, labels, value in samples[:3]],
+                         [("latency_seconds_bucket", "0.1", 2), ("latency_seconds_bucket", "1", 3),
+                          ("latency_seconds_bucket", "+Inf", 4)])
+        self.assertEqual(samples[-1], ("latency_seconds_count", {}, 4))
+
+    def test_invalid_buckets(self):
+        with self.assertRaises(ValueError):
+            Histogram("h", "H.", buckets=(1.0, 0.5))
+
+    def test_concurrent_observations(self):
+        histogram = Histogram("h", "H.", ["stage"])
+
+        def observe():
+            for _ in range(1000):
+                histogram.observe(0.01, stage="embed")
+
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(histogram.count(stage="embed"), 4000)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_render_text_format(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("errors_total", "Errors.", ["endpoint"])
+        histogram = registry.histogram("latency_seconds", "Latency.", buckets=(1.0,))
+        registry.add_callback("cache_hits_total", "Hits.", lambda: [({"cache": 'say "hi"'}, 7)], "counter")
+        counter.inc(endpoint="query")
+        histogram.observe(0.25)
+        self.assertEqual(registry.render(), "\n".join([
+            "# HELP errors_total Errors.",
+            "# TYPE errors_total counter",
+            'errors_total{endpoint="query"} 1',
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="1"} 1',
+            'latency_seconds_bucket{le="+Inf"} 1',
+            "latency_seconds_sum 0.25",
+            "latency_seconds_count 1",
+            "# HELP cache_hits_total Hits.",
+            "# TYPE cache_hits_total counter",
+            'cache_hits_total{cache="say \\"hi\\""} 7',
+        ]) + "\n")
+        with self.assertRaises(ValueError):
+            registry.counter("errors_total", "Again.")
+
+
+class TestStageTimer(unittest.TestCase):
+    def test_stages_accumulate(self):
+        clock = FakeClock()
+        timer = StageTimer(clock)
+        with timer.stage("embed"):
+            clock.now += 0.5
+        with timer.stage("search"):
+            clock.now += 0.25
+        with timer.stage("embed"):
+            clock.now += 0.5
+        self.assertEqual(timer.stages, {"embed": 1.0, "search": 0.25})
+        self.assertEqual(list(timer.stages), ["embed", "search"])
+        self.assertEqual(timer.elapsed(), 1.25)
+
+    def test_stage_records_into_active_timer(self):
+        clock = FakeClock()
+        timer = StageTimer(clock)
+        with stage("ignored"):
+            clock.now += 1.0
+        with timer.activate():
+            self.assertIs(current_timer(), timer)
+            with stage("db"):
+                clock.now += 2.0
+            seen = []
+            other = threading.Thread(target=lambda: seen.append(current_timer()))
+            other.start()
+            other.join()
+        self.assertEqual(seen, [None])
+        self.assertIsNone(current_timer())
+        self.assertEqual(timer.stages, {"db": 2.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from search_engine.delta_index import DeltaBackend
+from search_engine.embedding_store import FlatEmbeddingStore
+from search_engine.passages import PassageBackend, PassageMap, iter_passages, passage_bounds
+from search_engine.query_cache import QueryCache
+from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import ExactBackend
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TestPassageSplitting(unittest.TestCase):
+    def test_passage_bounds(self):
+        self.assertEqual(passage_bounds(3, window_lines=4, stride=2), [(0, 3)])
+        self.assertEqual(passage_bounds(0), [(0, 0)])
+        self.assertEqual(passage_bounds(8, window_lines=4, stride=2), [(0, 4), (2, 6), (4, 8)])
+        self.assertEqual(passage_bounds(7, window_lines=4, stride=2), [(0, 4), (2, 6), (3, 7)])
+        with self.assertRaises(ValueError):
+            passage_bounds(5, stride=0)
+
+    def test_iter_passages_and_map(self):
+        texts = ["a\nb\n\nc\nd\ne", "only line"]
+        passages = list(iter_passages(texts, window_lines=3, stride=2))
+        self.assertEqual(passages, [(0, 0, 3, "a\nb\nc"), (0, 2, 5, "c\nd\ne"), (1, 0, 1, "only line")])
+        passage_map = PassageMap.build(texts, window_lines=3, stride=2)
+        self.assertEqual(passage_map.song_ids.tolist(), [0, 0, 1])
+        self.assertEqual(passage_map.line_starts.tolist(), [0, 2, 0])
+        self.assertEqual(passage_map.line_ends.tolist(), [3, 5, 1])
+
+    def test_aggregate_max_pools_per_song(self):
+        passage_map = PassageMap(np.array([0, 0, 1, 2, 2]))
+        songs, scores, passages = passage_map.aggregate([4, 1, 3, 0, 2], [0.9, 0.8, 0.7, 0.6, 0.5], n_items=2)
+        self.assertEqual(songs, [2, 0])
+        np.testing.assert_allclose(scores, [0.9, 0.8])
+        self.assertEqual(passages, [4, 1])
+        self.assertEqual(passage_map.aggregate([], [], 3), ([], [], []))
+
+
+class TestPassageBackend(unittest.TestCase):
+    def setUp(self):
+        # Song 0 has one passage close to the query, song 1 is close on average only
+        self.embeddings = np.stack([unit(1, 0, 0), unit(0, 0, 1), unit(0.8, 0.6, 0), unit(0.8, -0.6, 0), unit(0, 1, 0)])
+        self.passage_map = PassageMap(np.array([0, 0, 1, 1, 2]))
+        self.texts = ["verse a", "verse b", "verse c", "verse d", "verse e"]
+        self.backend = PassageBackend(ExactBackend(self.embeddings), self.passage_map, self.texts, overfetch=1)
+
+    def test_search_with_passages(self):
+        songs, scores, passages = self.backend.search_with_passages(unit(1, 0, 0), n_items=3)
+        self.assertEqual(songs, [0, 1, 2])
+        self.assertEqual(passages, [0, 2, 4])
+        self.assertAlmostEqual(scores[0], 1.0, places=5)
+        self.assertEqual(self.backend.passage_text(passages[1]), "verse c")
+        self.assertIsNone(self.backend.passage_text(-1))
+        self.assertEqual(self.backend.search(unit(1, 0, 0), n_items=1), [0])
+        self.assertEqual(len(self.backend), 3)
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            PassageBackend(ExactBackend(self.embeddings), PassageMap(np.array([0, 1])))
+
+    def test_delta_backend_keeps_passages(self):
+        backend = DeltaBackend(self.backend, compaction_threshold=0)
+        backend.add([7], unit(0.9, 0.1, 0)[None, :])
+        backend.remove([1])
+        songs, _, passages = backend.search_with_passages(unit(1, 0, 0), n_items=3)
+        self.assertEqual(songs, [0, 7, 2])
+        self.assertEqual(passages, [0, -1, 4])
+        self.assertEqual(backend.passage_text(0), "verse a")
+
+    def test_query_interface_returns_passage_texts(self):
+        model = MagicMock(return_value=np.array([[0.0, 0.6, 0.8]], dtype=np.float32))
+        qi = QueryInterface(None, model, cache=QueryCache(), backend=self.backend)
+        songs, scores, passages = qi.query_with_passages("query", n_items=2)
+        self.assertEqual((songs, passages), ([0, 2], ["verse b", "verse e"]))
+        np.testing.assert_allclose(scores, [0.8, 0.6], rtol=1e-5)
+        self.assertEqual(qi.query_with_passages("query", n_items=2)[2], ["verse b", "verse e"])
+        model.assert_called_once()
+
+        whole_songs = QueryInterface(None, model, backend=ExactBackend(self.embeddings))
+        self.assertEqual(whole_songs.query_with_passages("query", n_items=1)[2], [None])
+
+    def test_from_store(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            import pandas as pd
+            metadata = pd.DataFrame({'song_id': self.passage_map.song_ids, 'line_start': [0] * 5, 'line_end': [4] * 5})
+            store = FlatEmbeddingStore.write(os.path.join(temp_dir, "passages"), self.embeddings, self.texts, metadata)
+            backend = PassageBackend.from_store(store)
+            self.assertEqual(backend.search_with_passages(unit(0, 1, 0), n_items=1), ([2], [1.0], [4]))
+            self.assertEqual(backend.passage_text(4), "verse e")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from search_engine.quantization import ScalarQuantizer
+
+
+class TestScalarQuantizer(unittest.TestCase):
+    def setUp(self):
+        vectors = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        self.embeddings = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            ScalarQuantizer("int4")
+
+    def test_int8_round_trip(self):
+        quantizer = ScalarQuantizer("int8").fit(self.embeddings, chunk_size=7)
+        codes = quantizer.encode(self.embeddings)
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual(quantizer.dtype, np.int8)
+        self.assertEqual(quantizer.scale.shape, (8,))
+        self.assertTrue(np.allclose(quantizer.decode(codes), self.embeddings, atol=quantizer.scale.max()))
+        self.assertEqual(np.abs(codes).max(), 127)
+
+    def test_int8_requires_fit(self):
+        with self.assertRaises(ValueError):
+            ScalarQuantizer("int8").encode(self.embeddings)
+
+    def test_float16_round_trip(self):
+        quantizer = ScalarQuantizer("float16").fit(self.embeddings)
+        codes = quantizer.encode(self.embeddings)
+        self.assertEqual(codes.dtype, np.float16)
+        self.assertIsNone(quantizer.scale)
+        self.assertTrue(np.allclose(quantizer.decode(codes), self.embeddings, atol=1e-3))
+
+    def test_prepared_query_dot_product_approximates_original(self):
+        quantizer = ScalarQuantizer("int8").fit(self.embeddings)
+        codes = quantizer.encode(self.embeddings)
+        query = self.embeddings[0]
+        approximate = codes.astype(np.float32) @ quantizer.prepare_query(query)
+        self.assertTrue(np.allclose(approximate, self.embeddings @ query, atol=0.05))
+
+    def test_scale_can_be_restored(self):
+        quantizer = ScalarQuantizer("int8").fit(self.embeddings)
+        restored = ScalarQuantizer("int8", quantizer.scale)
+        self.assertTrue(np.array_equal(restored.encode(self.embeddings), quantizer.encode(self.embeddings)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+from search_engine.query_cache import LRUCache, QueryCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestNormalizeQuery(unittest.TestCase):
+    def test_case_folds_and_collapses_whitespace(self):
+        self.assertEqual(normalize_query("  Hello \t  WORLD\n"), "hello world")
+
+    def test_unicode_case_folding(self):
+        self.assertEqual(normalize_query("ŻÓŁW Straße"), "żółw strasse")
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = LRUCache(max_size=2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_expires_entries_after_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(max_size=2, ttl_seconds=10, clock=clock)
+        cache.put("a", 1)
+        clock.now = 5
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 11
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats['expirations'], 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            LRUCache(max_size=0)
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = QueryCache(max_size=4)
+
+    def test_results_keyed_on_normalized_query_and_n_items(self):
+        self.cache.put_results("Hello  World", 5, [1, 2, 3])
+        self.assertEqual(self.cache.get_results("hello world", 5), [1, 2, 3])
+        self.assertIsNone(self.cache.get_results("hello world", 3))
+
+    def test_embeddings_are_read_only_copies(self):
+        embedding = np.array([0.1, 0.2])
+        self.cache.put_embedding("abc", embedding)
+        embedding[0] = 1.0
+        cached = self.cache.get_embedding("ABC")
+        self.assertTrue(np.allclose(cached, [0.1, 0.2]))
+        self.assertFalse(cached.flags.writeable)
+
+    def test_invalidate_results_keeps_embeddings(self):
+        self.cache.put_results("abc", 5, [1])
+        self.cache.put_embedding("abc", np.array([0.1]))
+        self.cache.invalidate_results()
+        self.assertIsNone(self.cache.get_results("abc", 5))
+        self.assertIsNotNone(self.cache.get_embedding("abc"))
+
+    def test_stats(self):
+        self.cache.get_results("abc", 5)
+        stats = self.cache.stats
+        self.assertEqual(stats['results']['misses'], 1)
+        self.assertEqual(stats['embeddings']['misses'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
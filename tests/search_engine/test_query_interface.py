@@ -1,6 +1,10 @@
 import unittest
 from unittest.mock import MagicMock, patch
+import numpy as np
+from annoy import AnnoyIndex
+from search_engine.query_cache import QueryCache
 from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import AnnoyBackend, ExactBackend
 
 class DummyModel:
     def __call__(self, inputs):
@@ -36,5 +40,125 @@ class TestQueryInterface(unittest.TestCase):
         annoy_index.get_nns_by_vector.assert_called_once_with([0.1, 0.2, 0.3], n=5)
         self.assertEqual(result, [4, 5, 6, 7, 8])
 
+    def test_query_batch_embeds_all_queries_in_one_call(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.side_effect = [[1, 2], [3, 4]]
+        model = MagicMock(return_value=np.array([[0.1, 0.2], [0.3, 0.4]]))
+        qi = QueryInterface(annoy_index, model)
+
+        result = qi.query_batch(["first", "second"], n_items=2)
+
+        model.assert_called_once_with(["first", "second"])
+        self.assertEqual(annoy_index.get_nns_by_vector.call_count, 2)
+        first_call, second_call = annoy_index.get_nns_by_vector.call_args_list
+        self.assertTrue(np.allclose(first_call.args[0], [0.1, 0.2]))
+        self.assertTrue(np.allclose(second_call.args[0], [0.3, 0.4]))
+        self.assertEqual(first_call.kwargs, {"n": 2})
+        self.assertEqual(result, [[1, 2], [3, 4]])
+
+    def test_query_batch_empty(self):
+        qi = QueryInterface(self.annoy_index_mock, self.model_mock)
+        self.assertEqual(qi.query_batch([]), [])
+        self.model_mock.assert_not_called()
+
+    def test_query_with_cache_reuses_results(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.return_value = [7, 8]
+        model = MagicMock(return_value=np.array([[0.1, 0.2]]))
+        qi = QueryInterface(annoy_index, model, cache=QueryCache())
+
+        self.assertEqual(qi.query("Some  Query", n_items=2), [7, 8])
+        self.assertEqual(qi.query("some query", n_items=2), [7, 8])
+
+        model.assert_called_once_with(["Some  Query"])
+        annoy_index.get_nns_by_vector.assert_called_once()
+
+    def test_query_with_cache_reuses_embedding_for_other_n_items(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.side_effect = [[7, 8], [7, 8, 9]]
+        model = MagicMock(return_value=np.array([[0.1, 0.2]]))
+        qi = QueryInterface(annoy_index, model, cache=QueryCache())
+
+        qi.query("abc", n_items=2)
+        self.assertEqual(qi.query("abc", n_items=3), [7, 8, 9])
+        model.assert_called_once()
+        self.assertEqual(annoy_index.get_nns_by_vector.call_count, 2)
+
+    def test_query_batch_with_cache_embeds_only_missing_queries(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.side_effect = [[1], [2]]
+        model = MagicMock(side_effect=[np.array([[0.1, 0.2]]), np.array([[0.3, 0.4]])])
+        qi = QueryInterface(annoy_index, model, cache=QueryCache())
+
+        qi.query("first", n_items=1)
+        result = qi.query_batch(["FIRST", "second"], n_items=1)
+
+        self.assertEqual(result, [[1], [2]])
+        self.assertEqual(model.call_args_list[1].args[0], ["second"])
+        self.assertEqual(qi.get_cached_results("second", 1), [2])
+
+    def test_query_with_scores_uses_cache(self):
+        embeddings = np.eye(3, dtype=np.float32)
+        model = MagicMock(return_value=np.array([[0.0, 2.0, 0.0]]))
+        qi = QueryInterface(None, model, cache=QueryCache(), backend=ExactBackend(embeddings))
+
+        indices, scores = qi.query_with_scores("abc", n_items=2)
+        self.assertEqual(indices[0], 1)
+        self.assertAlmostEqual(scores[0], 1.0, places=5)
+        self.assertEqual(qi.query_with_scores("ABC", n_items=2), (indices, scores))
+        model.assert_called_once()
+        self.assertIsNone(qi.get_cached_results("abc", 2))
+
+    def test_query_batch_with_scores(self):
+        embeddings = np.eye(3, dtype=np.float32)
+        model = MagicMock(return_value=np.array([[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]))
+        qi = QueryInterface(None, model, backend=ExactBackend(embeddings))
+        results = qi.query_batch_with_scores(["a", "b"], n_items=1)
+        self.assertEqual([indices for indices, _ in results], [[0], [2]])
+        self.assertEqual(qi.query_batch_with_scores([]), [])
+
+    def test_min_score_and_search_k(self):
+        embeddings = np.array([[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]], dtype=np.float32)
+        model = MagicMock(return_value=np.array([[1.0, 0.0]], dtype=np.float32))
+        backend = MagicMock(wraps=ExactBackend(embeddings))
+        qi = QueryInterface(None, model, cache=QueryCache(), backend=backend)
+
+        indices, scores = qi.query_with_scores("q", n_items=3, min_score=0.5)
+        self.assertEqual(indices, [0, 1])
+        self.assertEqual(qi.query_with_scores("q", n_items=3, min_score=1.5), ([], []))
+        self.assertEqual(len(qi.query_with_scores("q", n_items=3)[0]), 3)
+        backend.search_with_scores.assert_called_once()
+        # The exact backend ignores search_k, so every search_k shares the cached results
+        qi.query_with_scores("q", n_items=3, search_k="fast")
+        self.assertEqual(backend.search_with_scores.call_count, 1)
+        self.assertEqual(qi.query_batch_with_scores(["q"], n_items=3, min_score=0.7), [([0], [1.0])])
+
+    def test_equivalent_search_k_share_cached_results(self):
+        annoy_index = AnnoyIndex(2, 'angular')
+        for i, vector in enumerate([[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]]):
+            annoy_index.add_item(i, vector)
+        annoy_index.build(4)
+        model = MagicMock(return_value=np.array([[1.0, 0.0]], dtype=np.float32))
+        backend = MagicMock(wraps=AnnoyBackend(annoy_index))
+        qi = QueryInterface(None, model, cache=QueryCache(), backend=backend)
+
+        indices, _ = qi.query_with_scores("q", n_items=2, search_k="balanced")
+        self.assertEqual(indices, [0, 1])
+        qi.query_with_scores("q", n_items=2, search_k=-1)
+        qi.query_with_scores("q", n_items=2)
+        self.assertIsNotNone(qi.get_cached_scored_results("q", 2, -1))
+        self.assertEqual(backend.search_with_scores.call_count, 1)
+        # "exact" resolves to n_trees * n_items candidates, the same as asking for them
+        qi.query_with_scores("q", n_items=2, search_k="exact")
+        qi.query_with_scores("q", n_items=2, search_k=12)
+        self.assertEqual(backend.search_with_scores.call_count, 2)
+        qi.query_with_scores("q", n_items=2, search_k="fast")
+        self.assertEqual(backend.search_with_scores.call_count, 3)
+
+    def test_get_cached_results_without_cache(self):
+        qi = QueryInterface(self.annoy_index_mock, self.model_mock)
+        qi.store_results("abc", 5, [1])
+        self.assertIsNone(qi.get_cached_results("abc", 5))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,185 @@
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from annoy import AnnoyIndex
+from search_engine.quantization import ScalarQuantizer
+from search_engine.search_backends import AnnoyBackend, ExactBackend, QuantizedBackend, annoy_search_k
+from search_engine.query_interface import QueryInterface
+
+
+def random_unit_vectors(n, dims, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestAnnoyBackend(unittest.TestCase):
+    def test_search_delegates_to_annoy(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.return_value = [3, 1]
+        annoy_index.get_n_items.return_value = 10
+        backend = AnnoyBackend(annoy_index)
+
+        self.assertEqual(backend.search([0.1, 0.2], n_items=2), [3, 1])
+        annoy_index.get_nns_by_vector.assert_called_once_with([0.1, 0.2], n=2)
+        self.assertEqual(len(backend), 10)
+        self.assertIs(backend.annoy_index, annoy_index)
+
+    def test_annoy_search_k(self):
+        self.assertEqual(annoy_search_k(None, 5, 100, 1000), -1)
+        self.assertEqual(annoy_search_k("balanced", 5, 100, 1000), -1)
+        self.assertEqual(annoy_search_k("fast", 5, 100, 1000), 125)
+        self.assertEqual(annoy_search_k("fast", 5, 1, 1000), 5)
+        self.assertEqual(annoy_search_k("exact", 5, 100, 1000), 100000)
+        self.assertEqual(annoy_search_k(300, 5, 100, 1000), 300)
+        for invalid in ("slow", 0, -2, 1.5, True):
+            with self.assertRaises(ValueError):
+                annoy_search_k(invalid, 5, 100, 1000)
+
+    def test_search_k_is_passed_to_annoy(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.return_value = ([3], [0.0])
+        annoy_index.get_n_trees.return_value = 10
+        annoy_index.get_n_items.return_value = 50
+        backend = AnnoyBackend(annoy_index)
+        self.assertEqual(backend.search_with_scores([0.1], n_items=1, search_k="exact"), ([3], [1.0]))
+        annoy_index.get_nns_by_vector.assert_called_once_with([0.1], n=1, include_distances=True, search_k=500)
+
+    def test_tensor_queries_are_converted_for_annoy(self):
+        import tensorflow as tf
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.return_value = [3]
+        annoy_index.get_n_trees.return_value = 10
+        annoy_index.get_n_items.return_value = 50
+        backend = AnnoyBackend(annoy_index)
+        self.assertEqual(backend.search(tf.constant([0.5, 0.25]), n_items=1), [3])
+        vector = annoy_index.get_nns_by_vector.call_args.args[0]
+        self.assertIsInstance(vector, np.ndarray)
+        np.testing.assert_array_equal(vector, [0.5, 0.25])
+
+    def test_exact_preset_matches_brute_force(self):
+        vectors = random_unit_vectors(300, 8)
+        index = AnnoyIndex(8, "angular")
+        for i, vector in enumerate(vectors):
+            index.add_item(i, vector)
+        index.build(2)
+        backend = AnnoyBackend(index)
+        query = random_unit_vectors(1, 8, seed=3)[0]
+        self.assertEqual(backend.search(query, 10, search_k="exact"), ExactBackend(vectors).search(query, 10))
+
+    def test_search_batch_searches_every_row(self):
+        annoy_index = MagicMock()
+        annoy_index.get_nns_by_vector.side_effect = [[1], [2]]
+        backend = AnnoyBackend(annoy_index)
+        self.assertEqual(backend.search_batch(np.zeros((2, 3)), n_items=1), [[1], [2]])
+
+
+class TestExactBackend(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = random_unit_vectors(200, 16)
+        self.backend = ExactBackend(self.embeddings)
+
+    def _expected(self, query, n_items):
+        scores = self.embeddings @ (query / np.linalg.norm(query))
+        return np.argsort(-scores)[:n_items].tolist()
+
+    def test_search_returns_exact_top_k_in_order(self):
+        query = random_unit_vectors(1, 16, seed=1)[0] * 3.0
+        self.assertEqual(self.backend.search(query, n_items=10), self._expected(query, 10))
+
+    def test_search_item_finds_itself_first(self):
+        self.assertEqual(self.backend.search(self.embeddings[42], n_items=1), [42])
+
+    def test_search_more_items_than_corpus(self):
+        backend = ExactBackend(self.embeddings[:3])
+        self.assertEqual(sorted(backend.search(self.embeddings[0], n_items=10)), [0, 1, 2])
+        self.assertEqual(backend.search(self.embeddings[0], n_items=0), [])
+
+    def test_search_batch_matches_search(self):
+        queries = random_unit_vectors(5, 16, seed=2)
+        expected = [self.backend.search(query, n_items=7) for query in queries]
+        self.assertEqual(self.backend.search_batch(queries, n_items=7), expected)
+        self.assertEqual(self.backend.search_batch(np.zeros((0, 16)), n_items=7), [])
+
+    def test_search_batch_with_scores_matches_search_with_scores(self):
+        queries = random_unit_vectors(4, 16, seed=2)
+        for (indices, scores), query in zip(self.backend.search_batch_with_scores(queries, n_items=5), queries):
+            expected_indices, expected_scores = self.backend.search_with_scores(query, n_items=5)
+            self.assertEqual(indices, expected_indices)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_unnormalized_embeddings(self):
+        backend = ExactBackend(self.embeddings * np.arange(1, 201, dtype=np.float32)[:, None], normalized=False)
+        query = random_unit_vectors(1, 16, seed=3)[0]
+        self.assertEqual(backend.search(query, n_items=5), self._expected(query, 5))
+
+    def test_matches_annoy_on_small_corpus(self):
+        annoy_index = AnnoyIndex(16, "angular")
+        for i, vector in enumerate(self.embeddings):
+            annoy_index.add_item(i, vector)
+        annoy_index.build(10)
+        query = random_unit_vectors(1, 16, seed=4)[0]
+        self.assertEqual(self.backend.search(query, n_items=1),
+                         annoy_index.get_nns_by_vector(query, 1, search_k=len(self.embeddings) * 10))
+        self.assertEqual(len(self.backend), 200)
+
+    def test_scores_are_cosine_similarities(self):
+        query = random_unit_vectors(1, 16, seed=6)[0]
+        indices, scores = self.backend.search_with_scores(query, n_items=3)
+        self.assertEqual(indices, self._expected(query, 3))
+        np.testing.assert_allclose(scores, self.embeddings[indices] @ query, rtol=1e-5)
+
+        annoy_index = AnnoyIndex(16, "angular")
+        for i, vector in enumerate(self.embeddings):
+            annoy_index.add_item(i, vector)
+        annoy_index.build(10)
+        annoy_indices, annoy_scores = AnnoyBackend(annoy_index).search_with_scores(query, n_items=3)
+        np.testing.assert_allclose(annoy_scores, self.embeddings[annoy_indices] @ query, atol=1e-5)
+
+    def test_query_interface_with_exact_backend(self):
+        model = MagicMock(return_value=self.embeddings[[5, 9]])
+        qi = QueryInterface(None, model, backend=self.backend)
+        self.assertEqual(qi.query_batch(["a", "b"], n_items=1), [[5], [9]])
+
+    def test_query_interface_requires_index_or_backend(self):
+        with self.assertRaises(ValueError):
+            QueryInterface(None, MagicMock())
+
+
+class TestQuantizedBackend(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = random_unit_vectors(300, 16)
+        self.queries = random_unit_vectors(10, 16, seed=5)
+        self.exact = ExactBackend(self.embeddings)
+
+    def _backend(self, mode, rerank, **kwargs):
+        quantizer = ScalarQuantizer(mode).fit(self.embeddings)
+        return QuantizedBackend(quantizer.encode(self.embeddings), quantizer,
+                                rerank_embeddings=self.embeddings if rerank else None, **kwargs)
+
+    def _recall(self, backend, n_items=10):
+        found = backend.search_batch(self.queries, n_items)
+        expected = self.exact.search_batch(self.queries, n_items)
+        return np.mean([len(set(f) & set(e)) / n_items for f, e in zip(found, expected)])
+
+    def test_int8_without_rerank_has_high_recall(self):
+        self.assertGreaterEqual(self._recall(self._backend("int8", rerank=False, block_size=64)), 0.8)
+
+    def test_rerank_restores_exact_order(self):
+        for mode in ("int8", "float16"):
+            backend = self._backend(mode, rerank=True, rerank_candidates=50)
+            self.assertEqual(backend.search_batch(self.queries, 10), self.exact.search_batch(self.queries, 10))
+            self.assertEqual(backend.search(self.queries[0], 10), self.exact.search(self.queries[0], 10))
+            indices, scores = backend.search_with_scores(self.queries[0], 3)
+            np.testing.assert_allclose(scores, self.embeddings[indices] @ self.queries[0], rtol=1e-5)
+
+    def test_len_and_validation(self):
+        backend = self._backend("float16", rerank=False)
+        self.assertEqual(len(backend), 300)
+        self.assertEqual(backend.codes.dtype, np.float16)
+        self.assertEqual(backend.search_batch(np.zeros((0, 16)), 5), [])
+        with self.assertRaises(ValueError):
+            QuantizedBackend(backend.codes, ScalarQuantizer("float16"), rerank_embeddings=self.embeddings[:10])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from starlette.testclient import TestClient
+from search_engine.async_query import AsyncQueryInterface
+from search_engine.delta_index import DeltaBackend
+from search_engine.query_cache import QueryCache
+from search_engine.query_interface import QueryInterface
+from search_engine.search_backends import ExactBackend
+from web_app.config import Config
+from web_app.lyrics_search.async_app import create_asgi_app
+from web_app.lyrics_search.extensions import db
+from web_app.lyrics_search.models import Song
+
+# Queries are embedded as the vector of a word they contain, so the nearest song is known
+VECTORS = {"rain": [1.0, 0.0, 0.0], "sun": [0.0, 1.0, 0.0], "snow": [0.0, 0.0, 1.0]}
+
+
+def stub_model(texts):
+    return np.array([next((vector for word, vector in VECTORS.items() if word in text), [1.0, 1.0, 1.0])
+                     for text in texts], dtype=np.float32)
+
+
+class TestAsyncApp(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(self.tmp.name, 'songs.db')}"
+        engine = create_engine(database_url)
+        db.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add_all([Song(title=f"{word} song", author="artist", lyrics=f"{word} lyrics", index=i)
+                             for i, word in enumerate(VECTORS)])
+            session.commit()
+        engine.dispose()
+
+        self.backend = DeltaBackend(ExactBackend(np.eye(3, dtype=np.float32)), compaction_threshold=0)
+        interface = QueryInterface(None, stub_model, cache=QueryCache(), backend=self.backend)
+        patches = [
+            patch("web_app.lyrics_search.build_query_handle.create_query_interface", return_value=interface),
+            patch.multiple(Config, DATABASE_URL=database_url, ADMIN_TOKEN="secret", PASSAGES_PATH="",
+                           DEFAULT_SEARCH_K="", TOMBSTONE_REFRESH_SECONDS=0.0, SERVER_WORKERS=1),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = TestClient(create_asgi_app())
+        self.client.__enter__()  # Runs the lifespan, warming up blocks until the stub is loaded
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def test_query_lyrics(self):
+        response = self.client.post("/query_lyrics", json={"query": "songs about the sun", "n_items": 2})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["index"], 1)
+        self.assertEqual(results[0]["title"], "Sun Song")
+        self.assertEqual(results[0]["snippet"], "sun lyrics...")
+        self.assertAlmostEqual(results[0]["score"], 1.0)
+
+    def test_invalid_requests(self):
+        for body in [{}, {"query": "rain", "n_items": 0}, {"query": "rain", "search_k": "slow"},
+                     {"query": "rain", "min_score": "high"}]:
+            with self.subTest(body=body):
+                response = self.client.post("/query_lyrics", json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+        response = self.client.post("/query_lyrics/batch", json={"queries": "rain"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_inference_queue(self):
+        with patch.object(AsyncQueryInterface, "run", side_effect=queue.Full):
+            response = self.client.post("/query_lyrics", json={"query": "rain"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'error': "Too many queries waiting, try again later"})
+
+    def test_ready(self):
+        self.assertEqual(self.client.get("/ready").json(), {'ready': True})
+        service = self.client.app.state.service
+        service.ready.clear()
+        service.warm_up_error = "model not loaded"
+        response = self.client.get("/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'ready': False, 'error': "model not loaded"})
+
+    def test_removed_song_is_filtered_off_the_event_loop(self):
+        threads = []
+        remove = self.backend.remove
+
+        def record_thread(item_ids):
+            threads.append(threading.current_thread().name)
+            remove(item_ids)
+
+        self.backend.remove = record_thread
+        self.assertEqual(self.client.delete("/songs/2").status_code, 403)
+        response = self.client.delete("/songs/2", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("inference"))
+        response = self.client.post("/query_lyrics", json={"query": "snow", "n_items": 3})
+        self.assertNotIn(2, [result["index"] for result in response.json()["results"]])
+
+    def test_add_songs(self):
+        headers = {"Authorization": "Bearer secret"}
+        response = self.client.post("/songs", json={"songs": [{"artist": "new", "lyrics": "sun again"}]},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'indexes': [3]})
+        self.assertIn(3, self.backend.delta)
+        # Indexes taken by another writer after they were allocated
+        with patch("web_app.lyrics_search.async_app.next_indexes", return_value=[0]):
+            response = self.client.post("/songs", json={"songs": [{"artist": "new", "lyrics": "rain"}]},
+                                        headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn(0, self.backend.delta)
+
+    def test_song_updates_need_a_single_process(self):
+        headers = {"Authorization": "Bearer secret"}
+        with patch.object(Config, "SERVER_WORKERS", 2):
+            response = self.client.post("/songs", json={"songs": [{"artist": "new", "lyrics": "sun"}]},
+                                        headers=headers)
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(self.client.delete("/songs/2", headers=headers).status_code, 403)
+        self.assertEqual(len(self.backend.delta), 0)
+        self.assertEqual(self.backend.delta.tombstones, frozenset())
+
+    def test_get_song_etag(self):
+        response = self.client.get("/songs/0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'index': 0, 'title': "Rain Song", 'artist': "Artist",
+                                           'lyrics': "rain lyrics"})
+        etag = response.headers["ETag"]
+        self.assertEqual(self.client.get("/songs/0", headers={"If-None-Match": f"W/{etag}"}).status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from web_app.lyrics_search import create_app
+from web_app.lyrics_search.extensions import db
+from web_app.lyrics_search.models import Song
+from web_app.populate_db import _upsert_statement, iter_json_array, iter_json_lines, iter_tsv, populate_db
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def setUp(self):
+        self.songs = [
+            {"artist": "A ] }", "title": 'Say "hi"', "lyrics": "line ] one\n} and \\ \"quoted\" [", "index": 0},
+            {"artist": "B", "title": "", "lyrics": "x" * 50, "index": 12345},
+            {"artist": "C", "title": "T", "lyrics": "zażółć", "index": 2},
+        ]
+        self.text = json.dumps(self.songs, indent=2, ensure_ascii=False)
+
+    def test_elements_split_across_buffer_boundaries(self):
+        for buffer_size in (1, 2, 3, 7, 16, 1 << 16):
+            with self.subTest(buffer_size=buffer_size):
+                self.assertEqual(list(iter_json_array(io.StringIO(self.text), buffer_size)), self.songs)
+
+    def test_compact_array(self):
+        text = json.dumps(self.songs, separators=(",", ":"))
+        self.assertEqual(list(iter_json_array(io.StringIO(text), buffer_size=5)), self.songs)
+
+    def test_number_at_buffer_end_is_not_cut(self):
+        self.assertEqual(list(iter_json_array(io.StringIO("[12345, 6]"), buffer_size=3)), [12345, 6])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(io.StringIO("  [ \n ]  "), buffer_size=2)), [])
+
+    def test_empty_file(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO("  \n")))
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"artist": "A"}')))
+
+    def test_unterminated_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO(self.text[:-1]), buffer_size=8))
+        # Truncated inside an element
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO(self.text[:40]), buffer_size=8))
+
+
+class TestIterLinesAndTsv(unittest.TestCase):
+    def test_json_lines_skip_blank_lines(self):
+        handle = io.StringIO('{"index": 1}\n\n  \n{"index": 2}\n')
+        self.assertEqual(list(iter_json_lines(handle)), [{"index": 1}, {"index": 2}])
+
+    def test_tsv_with_index_column(self):
+        handle = io.StringIO("Artist\tTitle\tLyrics\tIndex\nA\tT\tla la\t7\nB\tU\tna na\t3\n")
+        rows = list(iter_tsv(handle))
+        self.assertEqual([row["index"] for row in rows], [7, 3])
+        self.assertEqual(rows[0]["artist"], "A")
+        self.assertEqual(rows[1]["lyrics"], "na na")
+
+    def test_tsv_without_index_column_uses_row_numbers(self):
+        handle = io.StringIO("Artist\tTitle\tLyrics\nA\tT\tla la\nB\tU\tna na\nC\tV\tda da\n")
+        self.assertEqual([row["index"] for row in iter_tsv(handle)], [0, 1, 2])
+
+    def test_tsv_with_empty_index_uses_row_number(self):
+        handle = io.StringIO("Artist\tTitle\tLyrics\tIndex\nA\tT\tla la\t\nB\tU\tna na\t9\n")
+        self.assertEqual([row["index"] for row in iter_tsv(handle)], [0, 9])
+
+
+class TestPopulateDb(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(self.tmp.name, 'songs.db')}"
+        with patch.dict(os.environ, {"DATABASE_URL": database_url}):
+            self.app = create_app()
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        self.tmp.cleanup()
+
+    def _write_json(self, songs):
+        path = os.path.join(self.tmp.name, "songs.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(songs, f)
+        return path
+
+    def _songs(self):
+        with self.app.app_context():
+            return {song.index: (song.title, song.author, song.lyrics, song.snippet)
+                    for song in Song.query.order_by(Song.index)}
+
+    def test_rerun_updates_existing_songs(self):
+        songs = [{"artist": f"Artist {i}", "title": f"Title {i}", "lyrics": f"lyrics {i}", "index": i}
+                 for i in range(7)]
+        self.assertEqual(populate_db(self.app, self._write_json(songs), batch_size=3), 7)
+        self.assertEqual(len(self._songs()), 7)
+
+        songs[4] = {"artist": "New artist", "title": "New title", "lyrics": "new lyrics", "index": 4}
+        self.assertEqual(populate_db(self.app, self._write_json(songs), batch_size=3), 7)
+        stored = self._songs()
+        self.assertEqual(len(stored), 7)
+        self.assertEqual(stored[4], ("New title", "New artist", "new lyrics", "new lyrics..."))
+        self.assertEqual(stored[3], ("Title 3", "Artist 3", "lyrics 3", "lyrics 3..."))
+
+    def test_last_duplicate_in_a_batch_wins(self):
+        songs = [{"artist": "A", "title": "First", "lyrics": "one", "index": 1},
+                 {"artist": "A", "title": "Second", "lyrics": "two", "index": 1}]
+        populate_db(self.app, self._write_json(songs), batch_size=10)
+        self.assertEqual(self._songs()[1][0], "Second")
+
+    def test_upsert_statement_dialects(self):
+        self.assertIn("ON CONFLICT", str(_upsert_statement("sqlite")))
+        with self.assertRaises(ValueError):
+            _upsert_statement("mysql")
+
+
+if __name__ == "__main__":
+    unittest.main()
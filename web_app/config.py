@@ -3,4 +3,58 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     DEBUG=os.environ.get("DEBUG", "False").lower() == 'true'
-    DATABASE_URL = os.environ.get("DATABASE_URL")
\ No newline at end of file
+    DATABASE_URL = os.environ.get("DATABASE_URL")
+    # Dynamic batching of concurrent queries, only useful with threaded workers (e.g. gunicorn --threads)
+    QUERY_BATCHING = os.environ.get("QUERY_BATCHING", "False").lower() == 'true'
+    BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "5"))
+    BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "32"))
+    BATCH_MAX_QUEUE = int(os.environ.get("BATCH_MAX_QUEUE", "256"))
+    # Cache of query embeddings and results, QUERY_CACHE_SIZE=0 disables it
+    QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+    # Search backend: "annoy" (approximate, index file), "exact" (brute force over a flat embedding store)
+    # or "quantized" (brute force over int8/float16 embeddings of a quantized flat embedding store)
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "annoy").lower()
+    INDEX_PATH = os.environ.get("INDEX_PATH", "index/index.ann")
+    EMBEDDINGS_PATH = os.environ.get("EMBEDDINGS_PATH", "index/embeddings")
+    # Passage store written by DataPipeline.save_passages. When set, songs are found by their best matching
+    # window of lines, which is also returned as the snippet. SEARCH_BACKEND=annoy then uses PASSAGE_INDEX_PATH
+    PASSAGES_PATH = os.environ.get("PASSAGES_PATH", "")
+    PASSAGE_INDEX_PATH = os.environ.get("PASSAGE_INDEX_PATH", "index/passages.ann")
+    # BM25 index written by search_engine.lexical_index from the same TSV as the embeddings. When set, results
+    # of the embedding search and of the lexical index are fused, so exactly remembered lines are found too
+    LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "")
+    HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))
+    RRF_K = float(os.environ.get("RRF_K", "60"))
+    # Annoy search_k used when a query doesn't set one: a number of candidates or "fast", "balanced" or "exact",
+    # empty keeps Annoy's default (same as "balanced")
+    DEFAULT_SEARCH_K = os.environ.get("DEFAULT_SEARCH_K", "")
+    # Candidates rescored with float32 embeddings by the quantized backend, 0 disables reranking
+    RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "50"))
+    # Mutable segment of songs added after the index was built, merged with the index at query time.
+    # The Annoy index is rebuilt in the background once it holds DELTA_COMPACTION_THRESHOLD songs, 0 disables it
+    DELTA_INDEX_PATH = os.environ.get("DELTA_INDEX_PATH", "index/delta.npz")
+    DELTA_COMPACTION_THRESHOLD = int(os.environ.get("DELTA_COMPACTION_THRESHOLD", "1000"))
+    # Server processes sharing the index files. Every process keeps its own delta and would rewrite index.ann and
+    # delta.npz, so automatic compaction only runs with a single one
+    SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi").lower()
+    SERVER_WORKERS = int(os.environ.get("UVICORN_WORKERS" if SERVER_MODE == "asgi" else "GUNICORN_WORKERS", "1"))
+    # How often songs flagged as removed are reloaded from the database
+    TOMBSTONE_REFRESH_SECONDS = float(os.environ.get("TOMBSTONE_REFRESH_SECONDS", "60"))
+    # Bearer token required to add and remove songs through the API, unset disables these endpoints
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+    # Browser cache lifetime of full lyrics served by GET /songs/<index>
+    SONG_CACHE_MAX_AGE = int(os.environ.get("SONG_CACHE_MAX_AGE", "3600"))
+    # Requests slower than this are printed with the time spent in every stage, 0 disables the slow request log
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))
+    # When the embedding model is loaded: "blocking" before a server starts accepting requests,
+    # "background" in a thread after start, "lazy" on the first search. GET /ready reports when it is done
+    WARM_UP = os.environ.get("WARM_UP", "blocking").lower()
+    # Async serving mode (web_app.lyrics_search.async_app): threads running embedding and search calls, calls
+    # allowed to wait for one before the API returns 503, and database connections per process
+    INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "4"))
+    INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", "256"))
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+    # TensorFlow thread pool sizes per worker, 0 keeps TensorFlow's default of one thread per core
+    TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0"))
+    TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "0"))
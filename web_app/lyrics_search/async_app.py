@@ -0,0 +1,454 @@
+"""
+Asynchronous serving mode: the search API as an ASGI app (Starlette, served by uvicorn).
+
+Requests are handled on an asyncio event loop and database queries use async SQLAlchemy sessions,
+so a request waiting for the database doesn't hold a thread. Embedding and search calls run on a
+bounded thread pool (see `search_engine.AsyncQueryInterface`), so one process serves many requests
+in flight with a few inference threads, instead of needing one sync worker per concurrent request.
+Responses are the same as the ones of the Flask routes, the query batcher is not used.
+
+Usage:
+    SERVER_MODE=asgi ./entrypoint.sh
+    uvicorn --factory web_app.lyrics_search.async_app:create_asgi_app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import functools
+import os
+import queue
+import time
+import numpy as np
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import load_only
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from search_engine.async_query import AsyncQueryInterface
+from search_engine.metrics import StageTimer, stage
+from web_app.config import Config
+from . import build_query_handle
+from .instrumentation import REGISTRY, RESULTS, describe_body, record, watch
+from .models import Song
+from .song_api import (INDEX_CONFLICT_ERROR, SINGLE_PROCESS_ERROR, added_songs, batch_queries, etag_matches, is_admin,
+                       next_indexes, search_options, search_results, song_etag, song_json, song_updates_allowed)
+
+# Async drivers replacing the sync ones of DATABASE_URL
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def async_database_url(url):
+    """
+    Switches a database URL to the async driver of its database, e.g. postgresql:// to postgresql+asyncpg://.
+    URLs already naming an async driver are returned unchanged.
+    """
+    parsed = make_url(url)
+    backend, _, driver = parsed.drivername.partition("+")
+    if driver in ("asyncpg", "aiosqlite", "psycopg_async"):
+        return url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {parsed.drivername} databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def _embed_lyrics(model, lyrics):
+    # Lyrics of added songs bypass the query cache, unlike QueryInterface.embed
+    with stage("embed"):
+        return np.asarray(model(lyrics), dtype=np.float32)
+
+
+def _json_body(request):
+    return describe_body(getattr(request.state, "body", None))
+
+
+def instrumented(endpoint):
+    """
+    Decorates an async handler, so its latency, status and stages are recorded under the given endpoint name.
+    The handler gets the request's timer as `request.state.timer`.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            timer = StageTimer()
+            request.state.timer = timer
+            try:
+                response = await handler(request)
+            except Exception:
+                record(endpoint, timer, 500, describe=lambda: _json_body(request))
+                raise
+            record(endpoint, timer, response.status_code, describe=lambda: _json_body(request))
+            return response
+        return wrapper
+    return decorator
+
+
+async def _read_json(request):
+    with request.state.timer.stage("parse"):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+    request.state.body = data
+    return data
+
+
+def _is_admin(request):
+    return is_admin(request.headers.get("Authorization"))
+
+
+class _SearchService:
+    def __init__(self):
+        """
+        Per-process state of the async app: database sessions and the query interface, created on first use.
+        """
+        url = async_database_url(Config.DATABASE_URL)
+        # SQLite databases get SQLAlchemy's own pool, sized connection pools are for database servers
+        pool_options = {} if url.startswith("sqlite") else {'pool_size': Config.DB_POOL_SIZE}
+        self.engine = create_async_engine(url, **pool_options)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.interface = None
+        self.ready = asyncio.Event()
+        self.warm_up_error = None
+        # Kept referenced, the event loop only holds weak references to tasks
+        self._warm_up_task = None
+        self._init_lock = asyncio.Lock()
+        # Serializes the allocation of indexes to added songs between concurrent requests
+        self.add_songs_lock = asyncio.Lock()
+        self._tombstones_synced_at = None
+
+    async def get_interface(self):
+        """
+        Returns the async query interface, loading the index and the embedding model on first use.
+        Loading blocks, so it runs in a thread and the event loop keeps answering /ready meanwhile.
+        """
+        if self.interface is None:
+            async with self._init_lock:
+                if self.interface is None:
+                    query_interface = await asyncio.get_running_loop().run_in_executor(
+                        None, build_query_handle.create_query_interface)
+                    interface = AsyncQueryInterface(query_interface, max_workers=Config.INFERENCE_THREADS,
+                                                    max_pending=Config.INFERENCE_MAX_PENDING)
+                    watch(query_interface, inference_pool=interface)
+                    self.interface = interface
+        return self.interface
+
+    async def warm_up(self):
+        """
+        Builds the query interface and runs one search, so the first request doesn't pay for
+        loading the model and tracing its graph. Marks the app as ready.
+        """
+        try:
+            interface = await self.get_interface()
+            embedding = await interface.embed(["warm up"])
+            await interface.run(interface.query_interface.search, embedding[0], 1)
+        except Exception as e:
+            self.warm_up_error = str(e)
+            raise
+        self.warm_up_error = None
+        self.ready.set()
+
+    async def _warm_up_in_background(self):
+        try:
+            await self.warm_up()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    async def start(self, mode=Config.WARM_UP):
+        if mode == "blocking":
+            await self.warm_up()
+        elif mode == "background":
+            self._warm_up_task = asyncio.create_task(self._warm_up_in_background())
+        elif mode != "lazy":
+            raise ValueError(f"Unknown warm-up mode: {mode}")
+
+    async def close(self):
+        if self.interface is not None:
+            self.interface.close(wait=False)
+        await self.engine.dispose()
+
+    async def sync_tombstones(self, timer):
+        """
+        Reloads the indexes of songs flagged as removed into the search backend,
+        at most once per TOMBSTONE_REFRESH_SECONDS. The backend saves its delta and invalidates
+        cached results when they change, so they are set on the inference pool.
+        """
+        now = time.monotonic()
+        if self._tombstones_synced_at is not None and now - self._tombstones_synced_at < Config.TOMBSTONE_REFRESH_SECONDS:
+            return
+        self._tombstones_synced_at = now
+        with timer.stage("db"):
+            async with self.sessions() as session:
+                removed = list((await session.execute(select(Song.index).where(Song.removed.is_(True)))).scalars())
+        try:
+            await self.interface.run(self.interface.query_interface.backend.set_tombstones, removed, timer=timer)
+        except Exception:
+            self._tombstones_synced_at = None
+            raise
+
+    def resync_tombstones(self):
+        """
+        Makes the next search reload the tombstones, e.g. after a removal that couldn't reach the backend.
+        """
+        self._tombstones_synced_at = None
+
+    async def fetch_songs(self, indexes, timer):
+        """
+        Fetches all songs with given annoy indexes using a single query, without their lyrics.
+
+        Returns:
+            dict mapping song index to Song.
+        """
+        if not indexes:
+            return {}
+        with timer.stage("db"):
+            async with self.sessions() as session:
+                songs = (await session.execute(
+                    select(Song)
+                    .options(load_only(Song.index, Song.title, Song.author, Song.snippet))
+                    .where(Song.index.in_(set(indexes)), Song.removed.isnot(True))
+                )).scalars().all()
+        return {song.index: song for song in songs}
+
+
+async def index(request):
+    template = request.app.state.templates.get_template("index.html")
+    return HTMLResponse(template.render(url_for=lambda endpoint, filename: f"/static/{filename}"))
+
+
+@instrumented("query_lyrics")
+async def query_lyrics(request):
+    service, timer = request.app.state.service, request.state.timer
+    data = await _read_json(request)
+    if not data or 'query' not in data:
+        return JSONResponse({'error': "Missing 'query' in request body"}, 400)
+    query = data["query"]
+    try:
+        n_items, search_k, min_score = search_options(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+    try:
+        interface = await service.get_interface()
+        await service.sync_tombstones(timer)
+        passages = None
+        if interface.query_interface.lexical_index is not None:
+            result_indexes, scores, passages = await interface.query_hybrid(query, n_items, search_k, min_score, timer)
+        elif Config.PASSAGES_PATH:
+            result_indexes, scores, passages = await interface.query_with_passages(query, n_items, search_k,
+                                                                                   min_score, timer)
+        else:
+            result_indexes, scores = await interface.query_with_scores(query, n_items, search_k, min_score, timer)
+        service.ready.set()
+        songs_by_index = await service.fetch_songs(result_indexes, timer)
+        results = search_results(result_indexes, scores, songs_by_index, passages)
+        RESULTS.observe(len(results), endpoint="query_lyrics")
+        with timer.stage("serialize"):
+            return JSONResponse({'results': results})
+    except queue.Full:
+        return JSONResponse({'error': "Too many queries waiting, try again later"}, 503)
+    except Exception as e:
+        print(str(e))
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@instrumented("query_lyrics_batch")
+async def query_lyrics_batch(request):
+    service, timer = request.app.state.service, request.state.timer
+    data = await _read_json(request)
+    try:
+        queries = batch_queries(data)
+        n_items, search_k, min_score = search_options(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+    try:
+        interface = await service.get_interface()
+        await service.sync_tombstones(timer)
+        batch_results = await interface.query_batch_with_scores(queries, n_items, search_k, min_score, timer)
+        songs_by_index = await service.fetch_songs([i for result_indexes, _ in batch_results for i in result_indexes],
+                                                   timer)
+        results = [search_results(result_indexes, scores, songs_by_index)
+                   for result_indexes, scores in batch_results]
+        for query_results in results:
+            RESULTS.observe(len(query_results), endpoint="query_lyrics_batch")
+        with timer.stage("serialize"):
+            return JSONResponse({'results': results})
+    except queue.Full:
+        return JSONResponse({'error': "Too many queries waiting, try again later"}, 503)
+    except Exception as e:
+        print(str(e))
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@instrumented("get_song")
+async def get_song(request):
+    """
+    Serves the full lyrics of a song with an ETag, answers 304 when the client's copy is current.
+    """
+    service, timer = request.app.state.service, request.state.timer
+    song_index = request.path_params["song_index"]
+    with timer.stage("db"):
+        async with service.sessions() as session:
+            song = (await session.execute(
+                select(Song).where(Song.index == song_index, Song.removed.isnot(True)).limit(1)
+            )).scalars().first()
+    if song is None:
+        return JSONResponse({'error': "Song not found"}, 404)
+    etag = song_etag(song)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': f"public, max-age={Config.SONG_CACHE_MAX_AGE}"}
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(song_json(song), headers=headers)
+
+
+@instrumented("add_songs")
+async def add_songs(request):
+    """
+    Adds songs to the database and to the delta segment of the search index.
+    Body: {"songs": [{"title": "...", "artist": "...", "lyrics": "..."}]}
+    """
+    service, timer = request.app.state.service, request.state.timer
+    if not _is_admin(request):
+        return JSONResponse({'error': "Forbidden"}, 403)
+    if not song_updates_allowed():
+        return JSONResponse({'error': SINGLE_PROCESS_ERROR}, 403)
+    try:
+        songs = added_songs(await _read_json(request))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+    try:
+        interface = await service.get_interface()
+        backend = interface.query_interface.backend
+        embeddings = await interface.run(_embed_lyrics, interface.query_interface.model,
+                                         [song["lyrics"] for song in songs], timer=timer)
+        async with service.add_songs_lock:
+            with timer.stage("db"):
+                async with service.sessions() as session:
+                    max_index = (await session.execute(select(func.max(Song.index)))).scalar()
+                    indexes = next_indexes(max_index, backend.next_item_id, len(songs))
+                    session.add_all([
+                        Song(title=song.get("title"), author=song["artist"], lyrics=song["lyrics"], index=index)
+                        for song, index in zip(songs, indexes)
+                    ])
+                    await session.commit()
+            await interface.run(backend.add, indexes, embeddings)
+        return JSONResponse({'indexes': indexes}, 201)
+    except IntegrityError:
+        # Another writer, e.g. populate_db, took the indexes between reading the maximum and the commit
+        return JSONResponse({'error': INDEX_CONFLICT_ERROR}, 409)
+    except queue.Full:
+        return JSONResponse({'error': "Too many queries waiting, try again later"}, 503)
+    except Exception as e:
+        print(str(e))
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@instrumented("remove_song")
+async def remove_song(request):
+    """
+    Flags a song as removed, it is filtered from search results without rebuilding the index.
+    """
+    service, timer = request.app.state.service, request.state.timer
+    if not _is_admin(request):
+        return JSONResponse({'error': "Forbidden"}, 403)
+    if not song_updates_allowed():
+        return JSONResponse({'error': SINGLE_PROCESS_ERROR}, 403)
+    song_index = request.path_params["song_index"]
+    with timer.stage("db"):
+        async with service.sessions() as session:
+            song = (await session.execute(select(Song).where(Song.index == song_index).limit(1))).scalars().first()
+            if song is None:
+                return JSONResponse({'error': "Song not found"}, 404)
+            song.removed = True
+            await session.commit()
+    interface = await service.get_interface()
+    try:
+        await interface.run(interface.query_interface.backend.remove, [song_index], timer=timer)
+    except queue.Full:
+        # The song is flagged in the database, the next search loads it with the other tombstones
+        service.resync_tombstones()
+    return Response(status_code=204)
+
+
+async def index_stats(request):
+    backend = (await request.app.state.service.get_interface()).query_interface.backend
+    return JSONResponse({
+        'main_items': len(backend.main),
+        'delta_items': len(backend.delta),
+        'removed_items': len(backend.delta.tombstones),
+        'compactions': backend.compactions,
+    })
+
+
+async def batcher_stats(request):
+    return JSONResponse({'enabled': False})
+
+
+async def cache_stats(request):
+    cache = (await request.app.state.service.get_interface()).query_interface.cache
+    if cache is None:
+        return JSONResponse({'enabled': False})
+    return JSONResponse({'enabled': True, **cache.stats})
+
+
+async def inference_stats(request):
+    return JSONResponse((await request.app.state.service.get_interface()).stats)
+
+
+async def metrics(request):
+    """
+    Request latencies, stage timings and counters in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def ready(request):
+    """
+    Readiness probe, succeeds once the embedding model has been loaded and used.
+    """
+    service = request.app.state.service
+    if service.ready.is_set():
+        return JSONResponse({'ready': True})
+    return JSONResponse({'ready': False, 'error': service.warm_up_error}, 503)
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app):
+    service = _SearchService()
+    app.state.service = service
+    try:
+        await service.start()
+        yield
+    finally:
+        await service.close()
+
+
+def create_asgi_app():
+    """
+    Creates the ASGI app, configured like the Flask app with environment variables (see web_app.config).
+    """
+    app = Starlette(
+        routes=[
+            Route("/", index),
+            Route("/query_lyrics", query_lyrics, methods=["POST"]),
+            Route("/query_lyrics/batch", query_lyrics_batch, methods=["POST"]),
+            Route("/songs", add_songs, methods=["POST"]),
+            Route("/songs/{song_index:int}", get_song, methods=["GET"]),
+            Route("/songs/{song_index:int}", remove_song, methods=["DELETE"]),
+            Route("/query_lyrics/index_stats", index_stats),
+            Route("/query_lyrics/batcher_stats", batcher_stats),
+            Route("/query_lyrics/cache_stats", cache_stats),
+            Route("/query_lyrics/inference_stats", inference_stats),
+            Route("/metrics", metrics),
+            Route("/ready", ready),
+            Mount("/static", StaticFiles(directory=os.path.join(_PACKAGE_DIR, "static")), name="static"),
+        ],
+        lifespan=_lifespan,
+    )
+    app.state.templates = Environment(loader=FileSystemLoader(os.path.join(_PACKAGE_DIR, "templates")),
+                                      autoescape=select_autoescape())
+    return app
@@ -1,18 +1,160 @@
 import os
-import tensorflow_hub as hub
-from search_engine import IndexBuilder, QueryInterface
+from search_engine import IndexBuilder, QueryInterface, QueryBatcher, QueryCache, AnnoyBackend, ExactBackend, QuantizedBackend, FlatEmbeddingStore, DeltaBackend, DeltaIndex, PassageBackend, LexicalIndex
+from web_app.config import Config
+
+def _load_backend(search_backend: str, index_full_path: str, store_full_path: str):
+    """
+    Opens the main search backend, over songs or over passages. The index is loaded once, it is only
+    replaced by DeltaBackend compactions, whose update listeners invalidate cached results.
+
+    Returns:
+        Tuple of the search backend and the Annoy index (None for other backends).
+    """
+    if search_backend == "annoy":
+        print(index_full_path)
+        index = IndexBuilder().load_from_file(index_full_path)
+        return AnnoyBackend(index), index
+    if search_backend in ("exact", "quantized"):
+        print(store_full_path)
+        store = FlatEmbeddingStore(store_full_path)
+        if search_backend == "exact":
+            return ExactBackend(store.embeddings), None
+        if store.quantizer is None:
+            raise ValueError(f"Embedding store {store_full_path} is not quantized")
+        return QuantizedBackend(
+            store.quantized_embeddings,
+            store.quantizer,
+            rerank_embeddings=store.embeddings if Config.RERANK_CANDIDATES > 0 else None,
+            rerank_candidates=Config.RERANK_CANDIDATES,
+        ), None
+    raise ValueError(f"Unknown search backend: {search_backend}")
+
+def create_search_backend(index_file_path: str=Config.INDEX_PATH,
+                          embeddings_path: str=Config.EMBEDDINGS_PATH,
+                          search_backend: str=Config.SEARCH_BACKEND,
+                          delta_path: str=Config.DELTA_INDEX_PATH,
+                          passages_path: str=Config.PASSAGES_PATH,
+                          lexical_index_path: str=Config.LEXICAL_INDEX_PATH):
+    """
+    Loads the search index and the query cache. Nothing here starts threads or touches TensorFlow,
+    and indexes and embedding stores are memory-mapped, so it is safe to call in the gunicorn
+    master before workers are forked, which then share the mapped pages.
+
+    Args:
+        index_file_path (str) : Path to .ann file containing annoy index
+        embeddings_path (str) : Path to flat embedding store, used by the exact backend
+        search_backend (str) : One of "annoy", "exact" or "quantized"
+        delta_path (str) : Path to the .npz file with songs added after the index was built
+        passages_path (str) : Path to a passage store written by DataPipeline.save_passages, empty
+            to search whole songs. The Annoy backend then uses Config.PASSAGE_INDEX_PATH
+        lexical_index_path (str) : Path to a lexical index built by search_engine.lexical_index, empty
+            to search embeddings only
+
+    Returns:
+        Tuple of the search backend, the Annoy index (None for other backends), the query cache (or None)
+        and the lexical index (or None).
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    base_dir = os.path.join(os.path.dirname(script_dir), "lyrics_search")
+    cache = None
+    if Config.QUERY_CACHE_SIZE > 0:
+        cache = QueryCache(max_size=Config.QUERY_CACHE_SIZE, ttl_seconds=Config.QUERY_CACHE_TTL)
+
+    index_full_path = os.path.join(base_dir, index_file_path)
+    if passages_path:
+        # Passages are max-pooled per song, so the rest of the app still sees song indexes
+        passages_full_path = os.path.join(base_dir, passages_path)
+        passage_backend, _ = _load_backend(search_backend, os.path.join(base_dir, Config.PASSAGE_INDEX_PATH),
+                                           passages_full_path)
+        backend = PassageBackend.from_store(FlatEmbeddingStore(passages_full_path), passage_backend)
+        index = None
+    else:
+        backend, index = _load_backend(search_backend, index_full_path, os.path.join(base_dir, embeddings_path))
+
+    # Added and removed songs are handled by a delta segment, only the Annoy index is rebuilt
+    # automatically, flat embedding stores keep the delta until they are rebuilt offline.
+    rebuild_annoy = search_backend == "annoy" and not passages_path
+    compaction_threshold = Config.DELTA_COMPACTION_THRESHOLD if rebuild_annoy else 0
+    delta_full_path = os.path.join(base_dir, delta_path)
+    delta = DeltaIndex.load(delta_full_path) if os.path.exists(delta_full_path) else None
+    # Every process keeps its own delta, only a single process may change and save it.
+    # With several, the saved delta is read-only and the song API refuses changes, see song_api.
+    single_process = Config.SERVER_WORKERS <= 1
+    if not single_process:
+        print(f"Delta segment is read-only, {Config.SERVER_WORKERS} server processes share the index")
+    backend = DeltaBackend(
+        backend,
+        delta,
+        compaction_threshold=compaction_threshold if single_process else 0,
+        index_path=index_full_path if rebuild_annoy else None,
+        delta_path=delta_full_path if single_process else None,
+    )
+    if cache is not None:
+        # Adding, removing and compacting (which swaps the main index) all change results
+        backend.add_update_listener(cache.invalidate_results)
+    lexical_index = None
+    if lexical_index_path:
+        lexical_index = LexicalIndex(os.path.join(base_dir, lexical_index_path))
+    return backend, index, cache, lexical_index
+
+def load_embedding_model(model_url: str="https://tfhub.dev/google/universal-sentence-encoder-multilingual/3"):
+    """
+    Loads the embedding model. TensorFlow starts its thread pools when the model is restored and
+    they do not survive a fork, so with gunicorn this has to run in each worker, after forking.
+
+    Args:
+        model_url (str) : Link to tf hub embedding model.
+    """
+    # Imported here, so the web app and `flask db upgrade` start without loading TensorFlow
+    import tensorflow as tf
+    import tensorflow_hub as hub
+    import tensorflow_text  # registers the ops used by the multilingual USE model
+
+    if Config.TF_INTRA_OP_THREADS > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(Config.TF_INTRA_OP_THREADS)
+    if Config.TF_INTER_OP_THREADS > 0:
+        tf.config.threading.set_inter_op_parallelism_threads(Config.TF_INTER_OP_THREADS)
+    return hub.load(model_url)
 
 def create_query_interface(model_url: str="https://tfhub.dev/google/universal-sentence-encoder-multilingual/3",
-                           index_file_path: str="index/index.ann"):
+                           index_file_path: str=Config.INDEX_PATH,
+                           embeddings_path: str=Config.EMBEDDINGS_PATH,
+                           search_backend: str=Config.SEARCH_BACKEND,
+                           delta_path: str=Config.DELTA_INDEX_PATH,
+                           preloaded=None):
     """
     Args:
         model_url (str) : Link to tf hub embedding model.
         index_file_path (str) : Path to .ann file containing annoy index
+        embeddings_path (str) : Path to flat embedding store, used by the exact backend
+        search_backend (str) : One of "annoy", "exact" or "quantized"
+        delta_path (str) : Path to the .npz file with songs added after the index was built
+        preloaded : Result of create_search_backend loaded before forking, loaded here if None
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    index_full_path = os.path.join(os.path.dirname(script_dir), "lyrics_search" ,index_file_path)
-    print(index_full_path)
-    index = IndexBuilder().load_from_file(index_full_path)
-    embedding_model = hub.load(model_url)
-    query_interface = QueryInterface(annoy_index=index, model=embedding_model)
-    return query_interface
\ No newline at end of file
+    if preloaded is None:
+        preloaded = create_search_backend(index_file_path, embeddings_path, search_backend, delta_path)
+    backend, index, cache, lexical_index = preloaded
+    embedding_model = load_embedding_model(model_url)
+    query_interface = QueryInterface(annoy_index=index, model=embedding_model, cache=cache, backend=backend,
+                                     lexical_index=lexical_index, hybrid_candidates=Config.HYBRID_CANDIDATES,
+                                     rrf_k=Config.RRF_K)
+    return query_interface
+
+def create_query_batcher(query_interface: QueryInterface):
+    """
+    Creates and starts a QueryBatcher if batching is enabled with the QUERY_BATCHING env variable.
+
+    Args:
+        query_interface (QueryInterface) : Query interface used by the batcher.
+
+    Returns:
+        QueryBatcher or None if batching is disabled.
+    """
+    if not Config.QUERY_BATCHING:
+        return None
+    return QueryBatcher(
+        query_interface,
+        max_batch_size=Config.BATCH_MAX_SIZE,
+        batch_window_ms=Config.BATCH_WINDOW_MS,
+        max_queue_size=Config.BATCH_MAX_QUEUE,
+    ).start()
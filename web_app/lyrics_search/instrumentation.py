@@ -0,0 +1,138 @@
+"""
+Request metrics of the web app, rendered in the Prometheus text format by GET /metrics.
+
+Every instrumented request gets a StageTimer. The query path records its stages into it (parse,
+embed, search, lexical, batch, db and serialize, see `search_engine.metrics.stage`), and the stages
+feed per-endpoint histograms. Requests slower than SLOW_QUERY_MS are printed with their stage breakdown.
+Metrics are kept per process, with several gunicorn workers every scrape reads one of them.
+"""
+import functools
+from flask import make_response, request
+from werkzeug.exceptions import HTTPException
+from search_engine.metrics import MetricsRegistry, StageTimer
+from web_app.config import Config
+
+REGISTRY = MetricsRegistry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "lyrics_search_request_seconds", "Request latency by endpoint.", ["endpoint"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "lyrics_search_stage_seconds", "Time spent in each stage of a request.", ["endpoint", "stage"])
+REQUESTS = REGISTRY.counter(
+    "lyrics_search_requests_total", "Requests by endpoint and status code.", ["endpoint", "status"])
+ERRORS = REGISTRY.counter(
+    "lyrics_search_errors_total", "Requests that failed with a server error.", ["endpoint"])
+SLOW_REQUESTS = REGISTRY.counter(
+    "lyrics_search_slow_requests_total", "Requests slower than SLOW_QUERY_MS.", ["endpoint"])
+RESULTS = REGISTRY.histogram(
+    "lyrics_search_results", "Number of results returned per query.", ["endpoint"],
+    buckets=(0, 1, 2, 3, 4, 5, 10, 25, 50))
+
+# Components created on first use, read when metrics are rendered
+_query_interface = None
+_query_batcher = None
+_inference_pool = None
+
+
+def watch(query_interface, query_batcher=None, inference_pool=None):
+    """
+    Exposes the counters of the query cache, the batcher and the inference pool of the async
+    serving mode, of a newly created query interface.
+    """
+    global _query_interface, _query_batcher, _inference_pool
+    _query_interface = query_interface
+    _query_batcher = query_batcher
+    _inference_pool = inference_pool
+
+
+def _cache_stat(name):
+    def collect():
+        cache = _query_interface.cache if _query_interface is not None else None
+        if cache is None:
+            return []
+        return [({'cache': kind}, stats[name]) for kind, stats in cache.stats.items()]
+    return collect
+
+
+def _batcher_stat(name):
+    def collect():
+        if _query_batcher is None:
+            return []
+        return [({}, _query_batcher.stats[name])]
+    return collect
+
+
+def _inference_pool_stat(name):
+    def collect():
+        if _inference_pool is None:
+            return []
+        return [({}, _inference_pool.stats[name])]
+    return collect
+
+
+REGISTRY.add_callback("lyrics_search_cache_hits_total", "Query cache hits.", _cache_stat('hits'), "counter")
+REGISTRY.add_callback("lyrics_search_cache_misses_total", "Query cache misses.", _cache_stat('misses'), "counter")
+REGISTRY.add_callback("lyrics_search_cache_entries", "Entries in the query cache.", _cache_stat('size'))
+REGISTRY.add_callback("lyrics_search_batcher_queue_depth", "Queries waiting for the batcher.",
+                      _batcher_stat('queue_depth'))
+REGISTRY.add_callback("lyrics_search_batcher_rejected_total", "Queries rejected by a full batcher queue.",
+                      _batcher_stat('rejected'), "counter")
+REGISTRY.add_callback("lyrics_search_inference_pending", "Embedding and search calls running or waiting for a thread.",
+                      _inference_pool_stat('pending'))
+REGISTRY.add_callback("lyrics_search_inference_rejected_total", "Calls rejected by a full inference pool.",
+                      _inference_pool_stat('rejected'), "counter")
+
+
+def describe_body(data):
+    """
+    Summarizes a request body for the slow request log.
+    """
+    if not isinstance(data, dict):
+        return ""
+    if isinstance(data.get("query"), str):
+        return f" query={data['query'][:100]!r}"
+    if isinstance(data.get("queries"), list):
+        return f" queries={len(data['queries'])}"
+    return ""
+
+
+def _describe_request():
+    return describe_body(request.get_json(silent=True))
+
+
+def record(endpoint, timer, status, describe=_describe_request):
+    """
+    Records the latency, status and stages of a finished request. `describe` is only called
+    for slow requests and returns a summary of the request for the log.
+    """
+    elapsed = timer.elapsed()
+    REQUESTS.inc(endpoint=endpoint, status=str(status))
+    if status >= 500:
+        ERRORS.inc(endpoint=endpoint)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    stages = timer.stages
+    for name, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=name)
+    if Config.SLOW_QUERY_MS > 0 and elapsed * 1000 >= Config.SLOW_QUERY_MS:
+        SLOW_REQUESTS.inc(endpoint=endpoint)
+        breakdown = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in stages.items())
+        print(f"Slow request {endpoint} ({status}) took {elapsed * 1000:.1f}ms: {breakdown}{describe()}")
+
+
+def instrumented(endpoint):
+    """
+    Decorates a view, so its latency, status and stages are recorded under the given endpoint name.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            timer = StageTimer()
+            try:
+                with timer.activate():
+                    response = make_response(view(*args, **kwargs))
+            except Exception as e:
+                record(endpoint, timer, e.code if isinstance(e, HTTPException) and e.code else 500)
+                raise
+            record(endpoint, timer, response.status_code)
+            return response
+        return wrapper
+    return decorator
@@ -1,14 +1,31 @@
-from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from sqlalchemy.orm import Mapped, mapped_column, validates
 from web_app.lyrics_search.extensions import db
 
+SNIPPET_LENGTH = 60
+
+
+def make_snippet(lyrics: str) -> str:
+    """
+    Builds the short lyrics preview shown in search results.
+    """
+    return lyrics[:SNIPPET_LENGTH] + "..."
+
 
 class Song(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(db.String(255), nullable=True)
     author: Mapped[str] = mapped_column(db.String(120), nullable=False)
     lyrics: Mapped[str] = mapped_column(db.Text, nullable=False)
-    index: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    index: Mapped[int] = mapped_column(db.Integer, nullable=False, unique=True, index=True)
     removed: Mapped[bool] = mapped_column(db.Boolean, default=False)
+    # Precomputed preview, so search results don't have to load the lyrics column
+    snippet: Mapped[Optional[str]] = mapped_column(db.String(SNIPPET_LENGTH + 3), nullable=True)
+
+    @validates("lyrics")
+    def _update_snippet(self, key, lyrics):
+        self.snippet = make_snippet(lyrics)
+        return lyrics
 
     def __repr__(self):
         return f"<Song {self.title}, author: {self.author}>"
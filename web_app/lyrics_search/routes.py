@@ -1,32 +1,306 @@
-from flask import render_template, Blueprint, request, jsonify
-from .build_query_handle import create_query_interface
+import queue
+import threading
+import time
+import numpy as np
+from flask import render_template, Blueprint, request, jsonify, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
+from search_engine.metrics import stage
+from .build_query_handle import create_query_interface, create_query_batcher, create_search_backend
+from .instrumentation import REGISTRY, RESULTS, instrumented, watch
+from .song_api import (INDEX_CONFLICT_ERROR, SINGLE_PROCESS_ERROR, added_songs, batch_queries, is_admin, next_indexes,
+                       search_options, search_results, song_etag, song_json, song_updates_allowed)
+from web_app.config import Config
+from web_app.lyrics_search.extensions import db
 from web_app.lyrics_search.models import Song
 
-query_interface = create_query_interface()
+# Nothing is loaded at import, so `flask db upgrade` and scripts using the models start instantly.
+# The query interface is built by a warm-up hook (see schedule_warm_up) or on the first search.
+query_interface = None
+query_batcher = None
+_preloaded_backend = None
+_init_lock = threading.Lock()
+# Serializes the allocation of indexes to added songs between the threads of a worker
+_add_songs_lock = threading.Lock()
+_ready = threading.Event()
+_warm_up_error = None
 bp = Blueprint('routes', __name__, url_prefix="/")
+_tombstones_synced_at = None
+
+
+def preload_search_backend():
+    """
+    Loads the memory-mapped search index without the embedding model.
+    Called in the gunicorn master before forking, see gunicorn.conf.py.
+    """
+    global _preloaded_backend
+    with _init_lock:
+        if _preloaded_backend is None and query_interface is None:
+            _preloaded_backend = create_search_backend()
+
+def get_query_interface():
+    """
+    Returns the query interface, loading the embedding model and starting the batcher on first use.
+    """
+    global query_interface, query_batcher
+    if query_interface is None:
+        with _init_lock:
+            if query_interface is None:
+                interface = create_query_interface(preloaded=_preloaded_backend)
+                query_batcher = create_query_batcher(interface)
+                watch(interface, query_batcher)
+                query_interface = interface
+    return query_interface
+
+def warm_up():
+    """
+    Builds the query interface and runs one search, so the first request doesn't pay for
+    loading the model and tracing its graph. Marks the app as ready.
+    """
+    global _warm_up_error
+    try:
+        interface = get_query_interface()
+        embedding = np.asarray(interface.model(["warm up"]), dtype=np.float32)[0]
+        interface.search(embedding, n_items=1)
+    except Exception as e:
+        _warm_up_error = str(e)
+        raise
+    _warm_up_error = None
+    _ready.set()
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+def schedule_warm_up(mode=Config.WARM_UP):
+    """
+    Warms up according to the WARM_UP setting: "blocking" returns once the model is loaded,
+    "background" loads it in a thread and "lazy" waits for the first search.
+    """
+    if mode == "blocking":
+        warm_up()
+    elif mode == "background":
+        threading.Thread(target=_warm_up_in_background, name="warm-up", daemon=True).start()
+    elif mode != "lazy":
+        raise ValueError(f"Unknown warm-up mode: {mode}")
+
+
+def _sync_tombstones():
+    """
+    Reloads the indexes of songs flagged as removed into the search backend,
+    at most once per TOMBSTONE_REFRESH_SECONDS.
+    """
+    global _tombstones_synced_at
+    now = time.monotonic()
+    if _tombstones_synced_at is not None and now - _tombstones_synced_at < Config.TOMBSTONE_REFRESH_SECONDS:
+        return
+    _tombstones_synced_at = now
+    with stage("db"):
+        removed = list(db.session.execute(db.select(Song.index).where(Song.removed.is_(True))).scalars())
+    get_query_interface().backend.set_tombstones(removed)
+
+def _fetch_songs(indexes):
+    """
+    Fetches all songs with given annoy indexes using a single query.
+    Only the columns shown in search results are loaded, the lyrics are not.
+
+    Returns:
+        dict mapping song index to Song.
+    """
+    if not indexes:
+        return {}
+    with stage("db"):
+        songs = (Song.query
+                 .options(load_only(Song.index, Song.title, Song.author, Song.snippet))
+                 .filter(Song.index.in_(set(indexes)), Song.removed.isnot(True))
+                 .all())
+    return {song.index: song for song in songs}
+
+def _songs_for_indexes(result_indexes, scores, songs_by_index=None, passages=None):
+    if songs_by_index is None:
+        songs_by_index = _fetch_songs(result_indexes)
+    return search_results(result_indexes, scores, songs_by_index, passages)
 
 @bp.route("/")
 def index():
     return render_template("index.html")
 
 @bp.route("/query_lyrics", methods=["POST"])
+@instrumented("query_lyrics")
 def query_lyrics():
-    data = request.get_json()
+    with stage("parse"):
+        data = request.get_json()
     if not data or 'query' not in data:
         return jsonify(error="Missing 'query' in request body"), 400 # Bad request
     query = data["query"]
     try:
-        results = []
-        result_indexes = query_interface.query(query, n_items=5)
-        for i in result_indexes:
-            song = Song.query.filter_by(index=i).first()
-            if song:
-                results.append({
-                    "title": song.title.title(),
-                    "artist": song.author.title(),
-                    "lyrics": song.lyrics,
-                })
-        return jsonify(results=results)
+        n_items, search_k, min_score = search_options(data)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        interface = get_query_interface()
+        _sync_tombstones()
+        passages = None
+        if interface.lexical_index is not None:
+            result_indexes, scores, passages = interface.query_hybrid(query, n_items, search_k, min_score)
+        elif Config.PASSAGES_PATH:
+            result_indexes, scores, passages = interface.query_with_passages(query, n_items, search_k, min_score)
+        elif query_batcher is not None:
+            # Embedding and search run in the batcher thread, the stage includes the wait for a batch
+            with stage("batch"):
+                result_indexes, scores = query_batcher.submit(query, n_items, scored=True, search_k=search_k)
+            if min_score is not None:
+                kept = [(index, score) for index, score in zip(result_indexes, scores) if score >= min_score]
+                result_indexes, scores = [index for index, _ in kept], [score for _, score in kept]
+        else:
+            result_indexes, scores = interface.query_with_scores(query, n_items, search_k, min_score)
+        _ready.set()
+        results = _songs_for_indexes(result_indexes, scores, passages=passages)
+        RESULTS.observe(len(results), endpoint="query_lyrics")
+        with stage("serialize"):
+            return jsonify(results=results)
+    except queue.Full:
+        return jsonify(error="Too many queries waiting, try again later"), 503 # Service unavailable
     except Exception as e:
         print(str(e))
         return jsonify(error=str(e)), 500 # Internal server error
+
+@bp.route("/query_lyrics/batch", methods=["POST"])
+@instrumented("query_lyrics_batch")
+def query_lyrics_batch():
+    with stage("parse"):
+        data = request.get_json()
+    try:
+        queries = batch_queries(data)
+        n_items, search_k, min_score = search_options(data)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400 # Bad request
+    try:
+        _sync_tombstones()
+        batch_results = get_query_interface().query_batch_with_scores(queries, n_items, search_k, min_score)
+        songs_by_index = _fetch_songs([i for result_indexes, _ in batch_results for i in result_indexes])
+        results = [_songs_for_indexes(result_indexes, scores, songs_by_index)
+                   for result_indexes, scores in batch_results]
+        for query_results in results:
+            RESULTS.observe(len(query_results), endpoint="query_lyrics_batch")
+        with stage("serialize"):
+            return jsonify(results=results)
+    except Exception as e:
+        print(str(e))
+        return jsonify(error=str(e)), 500 # Internal server error
+
+@bp.route("/songs/<int:song_index>", methods=["GET"])
+@instrumented("get_song")
+def get_song(song_index):
+    """
+    Serves the full lyrics of a song, fetched by the frontend when a result is opened.
+    Responses carry an ETag and can be cached by the browser.
+    """
+    with stage("db"):
+        song = Song.query.filter(Song.index == song_index, Song.removed.isnot(True)).first()
+    if song is None:
+        return jsonify(error="Song not found"), 404
+    response = jsonify(song_json(song))
+    response.set_etag(song_etag(song))
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.SONG_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+@bp.route("/songs", methods=["POST"])
+@instrumented("add_songs")
+def add_songs():
+    """
+    Adds songs to the database and to the delta segment of the search index, so they are
+    searchable right away without rebuilding the index.
+    Body: {"songs": [{"title": "...", "artist": "...", "lyrics": "..."}]}
+    """
+    if not is_admin(request.headers.get("Authorization")):
+        return jsonify(error="Forbidden"), 403
+    if not song_updates_allowed():
+        return jsonify(error=SINGLE_PROCESS_ERROR), 403
+    try:
+        songs = added_songs(request.get_json())
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        interface = get_query_interface()
+        with stage("embed"):
+            embeddings = np.asarray(interface.model([song["lyrics"] for song in songs]), dtype=np.float32)
+        with _add_songs_lock:
+            max_index = db.session.execute(db.select(db.func.max(Song.index))).scalar()
+            indexes = next_indexes(max_index, interface.backend.next_item_id, len(songs))
+            db.session.add_all([
+                Song(title=song.get("title"), author=song["artist"], lyrics=song["lyrics"], index=index)
+                for song, index in zip(songs, indexes)
+            ])
+            db.session.commit()
+            interface.backend.add(indexes, embeddings)
+        return jsonify(indexes=indexes), 201
+    except IntegrityError:
+        # Another writer, e.g. populate_db, took the indexes between reading the maximum and the commit
+        db.session.rollback()
+        return jsonify(error=INDEX_CONFLICT_ERROR), 409 # Conflict
+    except Exception as e:
+        db.session.rollback()
+        print(str(e))
+        return jsonify(error=str(e)), 500 # Internal server error
+
+@bp.route("/songs/<int:song_index>", methods=["DELETE"])
+@instrumented("remove_song")
+def remove_song(song_index):
+    """
+    Flags a song as removed, it is filtered from search results without rebuilding the index.
+    """
+    if not is_admin(request.headers.get("Authorization")):
+        return jsonify(error="Forbidden"), 403
+    if not song_updates_allowed():
+        return jsonify(error=SINGLE_PROCESS_ERROR), 403
+    song = Song.query.filter_by(index=song_index).first()
+    if song is None:
+        return jsonify(error="Song not found"), 404
+    song.removed = True
+    db.session.commit()
+    get_query_interface().backend.remove([song_index])
+    return "", 204
+
+@bp.route("/query_lyrics/index_stats", methods=["GET"])
+def index_stats():
+    backend = get_query_interface().backend
+    return jsonify(
+        main_items=len(backend.main),
+        delta_items=len(backend.delta),
+        removed_items=len(backend.delta.tombstones),
+        compactions=backend.compactions,
+    )
+
+@bp.route("/query_lyrics/batcher_stats", methods=["GET"])
+def batcher_stats():
+    get_query_interface()
+    if query_batcher is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, **query_batcher.stats)
+
+@bp.route("/query_lyrics/cache_stats", methods=["GET"])
+def cache_stats():
+    cache = get_query_interface().cache
+    if cache is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, **cache.stats)
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Request latencies, stage timings and counters in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness probe, succeeds once the embedding model has been loaded and used.
+    """
+    if _ready.is_set():
+        return jsonify(ready=True)
+    return jsonify(ready=False, error=_warm_up_error), 503 # Service unavailable
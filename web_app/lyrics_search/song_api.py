@@ -0,0 +1,157 @@
+"""
+Request validation and response bodies of the search API, shared by the Flask routes and the async app.
+Nothing here depends on the web framework: invalid requests raise ValueError with the message returned
+to the client, and responses are plain dicts.
+"""
+import hashlib
+import hmac
+from search_engine.search_backends import SEARCH_PRESETS
+from web_app.config import Config
+
+MAX_BATCH_QUERIES = 64
+DEFAULT_RESULTS = 5
+MAX_RESULTS = 50
+MAX_ADDED_SONGS = 256
+
+SINGLE_PROCESS_ERROR = "Songs can only be added or removed when a single server process serves the app"
+INDEX_CONFLICT_ERROR = "The song indexes were taken by a concurrent request, try again"
+
+
+def parse_search_k(value):
+    """
+    Validates a search_k given as a positive number, -1, a numeric string or a preset name.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        if value in SEARCH_PRESETS:
+            return value
+        if value.lstrip("-").isdigit():
+            value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or (value <= 0 and value != -1):
+        raise ValueError(f"'search_k' must be a positive integer or one of {', '.join(SEARCH_PRESETS)}")
+    return value
+
+def search_options(data):
+    """
+    Reads the optional search settings of a request body.
+
+    Returns:
+        Tuple of the number of results, the search_k (None for the default) and the minimum score (or None).
+    """
+    n_items = data.get("n_items", DEFAULT_RESULTS)
+    if isinstance(n_items, bool) or not isinstance(n_items, int) or not 1 <= n_items <= MAX_RESULTS:
+        raise ValueError(f"'n_items' must be an integer between 1 and {MAX_RESULTS}")
+    search_k = parse_search_k(data.get("search_k", Config.DEFAULT_SEARCH_K))
+    min_score = data.get("min_score")
+    if min_score is not None and (isinstance(min_score, bool) or not isinstance(min_score, (int, float))):
+        raise ValueError("'min_score' must be a number")
+    return n_items, search_k, min_score
+
+def batch_queries(data):
+    """
+    Reads the queries of a batch search request body.
+
+    Returns:
+        List of query strings.
+    """
+    if not data or 'queries' not in data:
+        raise ValueError("Missing 'queries' in request body")
+    queries = data["queries"]
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        raise ValueError("'queries' must be a list of strings")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"At most {MAX_BATCH_QUERIES} queries are allowed per request")
+    return queries
+
+def added_songs(data):
+    """
+    Reads the songs of an add songs request body, every song needs an artist and lyrics.
+
+    Returns:
+        List of song dicts.
+    """
+    songs = data.get("songs") if isinstance(data, dict) else None
+    if not isinstance(songs, list) or not songs:
+        raise ValueError("'songs' must be a non-empty list")
+    if len(songs) > MAX_ADDED_SONGS:
+        raise ValueError(f"At most {MAX_ADDED_SONGS} songs are allowed per request")
+    if not all(isinstance(song, dict) and song.get("artist") and song.get("lyrics") for song in songs):
+        raise ValueError("Every song needs 'artist' and 'lyrics'")
+    return songs
+
+def song_updates_allowed():
+    """
+    Checks whether songs can be added or removed. Every server process keeps its own delta segment,
+    with several of them an added song would only be searchable in one and the saved delta would be
+    overwritten by the others, so the delta is read-only then.
+    """
+    return Config.SERVER_WORKERS <= 1
+
+def next_indexes(max_index, next_item_id, count):
+    """
+    Allocates the indexes of added songs after both the largest index in the database and the largest
+    item id of the search index, songs that are not in the database yet may already be indexed.
+
+    Args:
+        max_index: Largest song index in the database, None if it is empty.
+        next_item_id: Next free item id of the search backend.
+        count: Number of added songs.
+
+    Returns:
+        List of consecutive indexes.
+    """
+    first_index = max(next_item_id, 0 if max_index is None else max_index + 1)
+    return list(range(first_index, first_index + count))
+
+def is_admin(authorization):
+    """
+    Checks the Authorization header of a request against ADMIN_TOKEN, the admin API is disabled without one.
+    """
+    token = (authorization or "").removeprefix("Bearer ")
+    return Config.ADMIN_TOKEN is not None and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+def song_etag(song):
+    """
+    ETag of the full lyrics response of a song, changes whenever any served field does.
+    """
+    return hashlib.sha1(f"{song.title}\0{song.author}\0{song.lyrics}".encode()).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    """
+    Checks whether an If-None-Match header names the ETag, weak tags and "*" included.
+    """
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def song_json(song):
+    """
+    Body of the full lyrics response of a song.
+    """
+    return {
+        'index': song.index,
+        'title': (song.title or "").title(),
+        'artist': song.author.title(),
+        'lyrics': song.lyrics,
+    }
+
+def search_results(result_indexes, scores, songs_by_index, passages=None):
+    """
+    Bodies of search hits, in the ranking order of the search. Hits without a song, e.g. removed
+    songs or songs missing from the database, are skipped.
+    """
+    if passages is None:
+        passages = [None] * len(result_indexes)
+    results = []
+    for i, score, passage in zip(result_indexes, scores, passages):
+        song = songs_by_index.get(i)
+        if song:
+            results.append({
+                "index": song.index,
+                "title": (song.title or "").title(),
+                "artist": song.author.title(),
+                # The passage that matched the query, if searching passages, otherwise the song's beginning
+                "snippet": passage or song.snippet or "",
+                "score": round(float(score), 4),
+            })
+    return results
@@ -53,11 +53,11 @@ function displayResults(results) {
     resultsDiv.innerHTML = '';
 
     results.forEach(song => {
-        const snippetLyrics = song.lyrics.substring(0, 60) + '...';
+        const snippetLyrics = song.snippet;
 
         const resultElement = document.createElement('div');
         resultElement.className = 'p-4 mb-2 border-b border-gray-300 cursor-pointer bg-white dark:bg-gray-800 rounded-lg hover:bg-gray-100 dark:hover:bg-gray-700';
-        resultElement.onclick = () => showLyrics(song.title, song.lyrics, song.artist);
+        resultElement.onclick = () => fetchLyrics(song);
 
         resultElement.innerHTML = `
             <div class='flex items-center'>
@@ -76,6 +76,21 @@ function displayResults(results) {
     });
 }
 
+function fetchLyrics(song) {
+    fetch(`/songs/${song.index}`)
+    .then(response => {
+        if (!response.ok) {
+            throw new Error('Błąd serwera');
+        }
+        return response.json();
+    })
+    .then(data => showLyrics(data.title, data.lyrics, data.artist))
+    .catch(error => {
+        console.error('Błąd:', error);
+        showLyrics(song.title, song.snippet, song.artist);
+    });
+}
+
 function showLyrics(title, lyrics, artist) {
     document.getElementById('modal-title').textContent = `${title} - ${artist}`;
     document.getElementById('modal-lyrics').textContent = lyrics;
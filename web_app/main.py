@@ -3,8 +3,10 @@ import os
 from flask import Flask
 from web_app import create_app
 from web_app.lyrics_search import extensions
+from web_app.lyrics_search.routes import schedule_warm_up
 
 if __name__ == '__main__':
     app = create_app()
+    schedule_warm_up()
 
     app.run(host='0.0.0.0', port=5000, debug=os.environ.get("DEBUG"))
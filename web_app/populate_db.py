@@ -2,15 +2,221 @@
 This script populates the database with lyrics data, so then
 when similarity will be calculated we can retrieve full lyrics data
 from postgresql database.
+
+Songs are read incrementally from a JSON array (as written by `save_to_json`), JSON Lines or
+TSV (as written by `save_to_tsv`) file and upserted on `index` in batches, so the script can be
+rerun on a populated table and memory use does not grow with the size of the file.
 """
-# from lyrics_search.models import Song
+import argparse
+import csv
 import json
 import os
-from web_app.lyrics_search.models import Song
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+from web_app.lyrics_search.models import Song, make_snippet
 from web_app.lyrics_search.extensions import db
 from web_app.lyrics_search import create_app
 
-def populate_db_from_json(app, json_path: str):
+UPSERT_COLUMNS = ("title", "author", "lyrics", "snippet")
+
+
+def iter_json_array(handle: TextIO, buffer_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Parses a JSON array of objects one element at a time, reading the file in chunks.
+
+    Args:
+        handle (TextIO): Open text file containing a JSON array.
+        buffer_size (int, optional): Number of characters read at once. Defaults to 64k.
+
+    Yields:
+        dict: The array elements.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer) and not eof:
+            chunk = handle.read(buffer_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if not started:
+            if position == len(buffer):
+                raise ValueError("Expected a JSON array, the file is empty")
+            if buffer[position] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+            continue
+        if position == len(buffer):
+            raise ValueError("Unterminated JSON array")
+        if buffer[position] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The element continues in the next chunk
+            chunk = handle.read(buffer_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if end == len(buffer) and not eof:
+            # A number at the end of the buffer may continue in the next chunk
+            chunk = handle.read(buffer_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield element
+        position = end
+
+
+def iter_json_lines(handle: TextIO) -> Iterator[dict]:
+    """
+    Parses a JSON Lines file, one object per line.
+
+    Args:
+        handle (TextIO): Open text file.
+
+    Yields:
+        dict: The parsed lines.
+    """
+    for line in handle:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_tsv(handle: TextIO) -> Iterator[dict]:
+    """
+    Parses a TSV file with Artist, Title, Lyrics and optionally Index columns. Without an Index
+    column the row number is used, the same order the search index is built in.
+
+    Args:
+        handle (TextIO): Open text file.
+
+    Yields:
+        dict: Rows with lowercase keys.
+    """
+    csv.field_size_limit(sys.maxsize)
+    for row_number, row in enumerate(csv.DictReader(handle, delimiter="\t")):
+        row = {key.lower(): value for key, value in row.items()}
+        row["index"] = int(row["index"]) if row.get("index") not in (None, "") else row_number
+        yield row
+
+
+def read_songs(path: str, file_format: Optional[str] = None) -> Iterator[dict]:
+    """
+    Streams songs from a file.
+
+    Args:
+        path (str): Path to the file.
+        file_format (Optional[str], optional): "json", "jsonl" or "tsv". Defaults to None,
+            which picks the format from the file extension.
+
+    Yields:
+        dict: Songs with artist, title, lyrics and index keys.
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+    parsers = {"json": iter_json_array, "jsonl": iter_json_lines, "tsv": iter_tsv}
+    if file_format not in parsers:
+        raise ValueError(f"Unknown file format: {file_format}")
+    with open(path, "r", encoding="utf-8", newline="" if file_format == "tsv" else None) as handle:
+        yield from parsers[file_format](handle)
+
+
+def _song_rows(songs: Iterable[dict]) -> Iterator[Dict]:
+    """
+    Converts parsed songs to rows of the song table.
+    """
+    for song_data in songs:
+        lyrics = song_data["lyrics"]
+        yield {
+            "title": song_data["title"],
+            "author": song_data["artist"],
+            "lyrics": lyrics,
+            "snippet": make_snippet(lyrics),
+            "index": int(song_data["index"]),
+        }
+
+
+def _upsert_statement(dialect: str):
+    """
+    Builds an INSERT that updates songs which already exist with the same index.
+
+    Args:
+        dialect (str): Name of the database dialect.
+    """
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Upserts are not supported for {dialect}")
+    statement = insert(Song.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=[Song.__table__.c.index],
+        set_={column: statement.excluded[column] for column in UPSERT_COLUMNS},
+    )
+
+
+def _insert_batch(statement, batch: List[Dict]) -> None:
+    """
+    Upserts one batch of rows in its own transaction.
+    """
+    # A row may not be updated twice by one statement, so the last occurrence of an index wins
+    rows = list({row["index"]: row for row in batch}.values())
+    with db.engine.begin() as connection:
+        connection.execute(statement, rows)
+
+
+def populate_db(app, path: str, file_format: Optional[str] = None, batch_size: int = 1000,
+                report_every: int = 10000) -> int:
+    """
+    Upserts songs from a file into the database in batches.
+
+    Args:
+        app: Flask application instance
+        path (str): Path to a JSON, JSON Lines or TSV file.
+        file_format (Optional[str], optional): Format of the file, see `read_songs`. Defaults to None.
+        batch_size (int, optional): Rows per INSERT statement and transaction. Defaults to 1000.
+        report_every (int, optional): Print progress after about this many rows. Defaults to 10000.
+
+    Returns:
+        int: Number of rows written.
+    """
+    with app.app_context():
+        statement = _upsert_statement(db.engine.dialect.name)
+        start = time.perf_counter()
+        total = 0
+        reported = 0
+        batch = []
+        for row in _song_rows(read_songs(path, file_format)):
+            batch.append(row)
+            if len(batch) < batch_size:
+                continue
+            _insert_batch(statement, batch)
+            total += len(batch)
+            batch = []
+            if total - reported >= report_every:
+                reported = total
+                elapsed = time.perf_counter() - start
+                print(f"Upserted {total} songs, {total / elapsed:.0f} rows/s")
+        if batch:
+            _insert_batch(statement, batch)
+            total += len(batch)
+        elapsed = time.perf_counter() - start
+    print(f"Finished adding {total} songs to database in {elapsed:.2f}s, {total / max(elapsed, 1e-9):.0f} rows/s")
+    return total
+
+
+def populate_db_from_json(app, json_path: str, batch_size: int = 1000) -> int:
     """
     Populates Database with data from json file.
     Json structure:
@@ -26,28 +232,21 @@ def populate_db_from_json(app, json_path: str):
     Args:
         app: Flask application instance
         json_path (str): Path do json file.
+        batch_size (int, optional): Rows per INSERT statement. Defaults to 1000.
+
+    Returns:
+        int: Number of rows written.
     """
-    with app.app_context():
-        with open(json_path, "r") as handle:
-            data = json.load(handle)
-        for song_data in data:
-            artist = song_data["artist"]
-            title = song_data["title"]
-            lyrics = song_data["lyrics"]
-            index = song_data["index"]
-            song = Song(
-                title=title,
-                author=artist,
-                lyrics=lyrics,
-                index=index,
-            )
-            db.session.add(song)
-            db.session.commit()
-            print(f"Added: {song}")
-    print("Finished adding to database")
+    return populate_db(app, json_path, file_format="json", batch_size=batch_size)
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
     json_path = os.path.join(os.path.dirname(script_dir), "web_app/data_for_population", "lyrics.json")
+    parser = argparse.ArgumentParser(description="Upsert songs from a JSON, JSON Lines or TSV file into the database.")
+    parser.add_argument("path", nargs="?", default=json_path)
+    parser.add_argument("--format", choices=["json", "jsonl", "tsv"], default=None,
+                        help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
     app = create_app()
-    populate_db_from_json(app, json_path)
\ No newline at end of file
+    populate_db(app, args.path, file_format=args.format, batch_size=args.batch_size)